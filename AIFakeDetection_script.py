@@ -1,282 +1,360 @@
+"""
+Research pipeline: DenseNet121 transfer learning vs. the served CNN
+("Extension NasNetMobile") on Dataset/, as a cached stage DAG (pipeline.py):
+
+    load -> preprocess -> split -> train_densenet -> predict_densenet -> metrics_densenet --> plots
+                                -> train_cnn      -> predict_cnn      -> metrics_cnn      --> report
+                                                  -> explain (Grad-CAM + LIME on testImages/)
+
+A rerun only recomputes the stages whose inputs, parameters or code
+changed; the two training branches, and plots/report/explain, run in
+parallel. model/X.npy, model/Y.npy and model/*_weights.hdf5 are reused
+when they already exist.
+
+    python AIFakeDetection_script.py                     # bring everything up to date
+    python AIFakeDetection_script.py report --jobs 1     # only what the report needs
+    python AIFakeDetection_script.py --dry-run           # show which stages would run
+    python AIFakeDetection_script.py --force train_cnn   # retrain the CNN and everything after it
+
+Figures and the metrics table are written to results/.
+"""
+import argparse
+import json
+import os
+import shutil
+import warnings
+
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
-
-#loading python classes and packages
-from keras.optimizers import Adam
-from keras.applications import DenseNet121
-from keras.applications import NASNetMobile
-import os
-import cv2
-import pandas as pd
 import numpy as np
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import accuracy_score
-import pickle
-from keras.utils.np_utils import to_categorical
-from keras.callbacks import ModelCheckpoint
-from keras.models import Sequential, load_model, Model
-from keras.layers import AveragePooling2D, Dropout, Flatten, Dense, Input, Activation
-from keras.optimizers import Adam
-from keras.layers import  MaxPooling2D
-from keras.layers import Convolution2D
-from lime import lime_image
-from skimage.segmentation import mark_boundaries
-import matplotlib.pyplot as plt
-from sklearn.metrics import roc_curve
-from sklearn.metrics import roc_auc_score
-from sklearn import metrics 
-from sklearn.metrics import precision_score
-from sklearn.metrics import recall_score
-from sklearn.metrics import f1_score
-from sklearn.metrics import confusion_matrix
-import seaborn as sns
-import warnings
+
+import train_model
+from pipeline import Pipeline, Stage
+
 warnings.filterwarnings("ignore")
 
-#global variable definition for images and label storage
-X = []
-Y = []
-path = "Dataset"
-
-#function to load real and fake images
-if os.path.exists('model/X.npy'): #if images already processed the laod it
-    X = np.load('model/X.npy')
-    Y = np.load('model/Y.npy')
-else: #if not processed then read each image and process them
-    for root, dirs, directory in os.walk(path):
-        for j in range(len(directory)):
-            if 'Thumbs.db' not in directory[j]:
-                img = cv2.imread(root+"/"+directory[j])#read each image and extract features and add to X and Y array for training
-                img = cv2.resize(img, (32, 32))
-                label = 0 #for fake image label will be 0
-                name = os.path.basename(root)
-                if name == "real": #for real images label will be 1
-                    label = 1
-                X.append(img)
-                Y.append(label)
-print("Fake & Real Images Loading Completed")
-print("Total images found in dataset = "+str(X.shape[0]))
-
-#visualizing class labels count found in dataset
-names, count = np.unique(Y, return_counts = True)
-height = count
-bars = ['Fake', 'Real']
-y_pos = np.arange(len(bars))
-plt.figure(figsize = (4, 3)) 
-plt.bar(y_pos, height)
-plt.xticks(y_pos, bars)
-plt.xlabel("Class Labels in Dataset")
-plt.ylabel("Count")
-plt.title("different Images Class Labels Graph")
-# plt.show()
-
-#dataset processing such as shuffling and normalizing and this processing will be done on classification images and report generation images
-X = X.astype('float32')
-X = X/255
-indices = np.arange(X.shape[0])
-np.random.shuffle(indices) #shuffle images
-X = X[indices]
-Y = Y[indices]
-Y = to_categorical(Y)
-print("Images Shuffling & Normalization completed")
-
-#visualizing sample processed image
-img = X[10]
-plt.figure(figsize=(5, 3))
-plt.imshow(img)
-plt.title("Sample Processed Chest X-Ray Image")
-# plt.show()
-
-#splitting images data into train and test
-X_train, X_test, y_train, y_test = train_test_split(X, Y, test_size=0.2) #split dataset into train and test
-print("Dataset Train & Test Split Details")
-print("80% images files used to train algorithms : "+str(X_train.shape[0]))
-print("20% images files used to test algorithms : "+str(X_test.shape[0]))
-
-#define global variables to save accuracy and other metrics
-accuracy = []
-precision = []
-recall = []
-fscore = []
-
-#function to calculate all metrics
-def calculateMetrics(algorithm, testY, predict):
-    labels = ['Fake', 'Real']
-    p = precision_score(testY, predict,average='macro') * 100
-    r = recall_score(testY, predict,average='macro') * 100
-    f = f1_score(testY, predict,average='macro') * 100
-    a = accuracy_score(testY,predict)*100
-    accuracy.append(a)
-    precision.append(p)
-    recall.append(r)
-    fscore.append(f)
-    print(algorithm+" Accuracy  : "+str(a))
-    print(algorithm+" Precision : "+str(p))
-    print(algorithm+" Recall    : "+str(r))
-    print(algorithm+" FSCORE    : "+str(f))
-    conf_matrix = confusion_matrix(testY, predict)
-    fig, axs = plt.subplots(1,2,figsize=(10, 3))
-    ax = sns.heatmap(conf_matrix, xticklabels = labels, yticklabels = labels, annot = True, cmap="viridis" ,fmt ="g", ax=axs[0]);
-    ax.set_ylim([0,len(labels)])
-    axs[0].set_title(algorithm+" Confusion matrix") 
-
-    random_probs = [0 for i in range(len(testY))]
-    p_fpr, p_tpr, _ = roc_curve(testY, random_probs, pos_label=1)
-    plt.plot(p_fpr, p_tpr, linestyle='--', color='orange',label="True classes")
-    ns_fpr, ns_tpr, _ = roc_curve(testY, predict, pos_label=1)
-    axs[1].plot(ns_fpr, ns_tpr, linestyle='--', label='Predicted Classes')
-    axs[1].set_title(algorithm+" ROC AUC Curve")
+RESULTS_DIR = 'results'
+MODELS = {
+    'densenet': 'DenseNet121',
+    'cnn': 'Extension NasNetMobile',
+}
+LABELS = ['Fake', 'Real']
+TEST_IMAGES = ['testImages/1.jpg', 'testImages/2.png', 'testImages/5.jpg', 'testImages/4.jpg',
+               'testImages/10.jpg', 'testImages/6.jpg']
+
+
+def _dataset(ctx):
+    """Normalised images (memory-mapped), one-hot labels and the split indices."""
+    preprocess = ctx.inputs['preprocess']
+    split = np.load(ctx.inputs['split'].path('split.npz'))
+    return (np.load(preprocess.path('X.npy'), mmap_mode='r'), np.load(preprocess.path('Y.npy')),
+            split['train'], split['test'])
+
+
+# Stages -----------------------------------------------------------------
+
+def load(ctx):
+    """Read and resize every image in the dataset (labels: 0 fake, 1 real)."""
+    X, Y = train_model.load_images(ctx.params['dataset'])
+    np.save(ctx.artifacts['X'], X)
+    np.save(ctx.artifacts['Y'], Y)
+    print("Fake & Real Images Loading Completed")
+    return {'images': int(len(X))}
+
+
+def preprocess(ctx):
+    """Shuffle, normalise to [0, 1] and one-hot encode the labels."""
+    X = np.load(ctx.inputs['load'].artifacts['X'], mmap_mode='r')
+    Y = np.load(ctx.inputs['load'].artifacts['Y'])
+    order = np.random.RandomState(ctx.params['seed']).permutation(len(X))
+    # Written in chunks so the float copy never has to fit in memory at once
+    normalised = np.lib.format.open_memmap(ctx.path('X.npy'), mode='w+', dtype='float32', shape=X.shape)
+    for start in range(0, len(order), 4096):
+        normalised[start:start + 4096] = X[order[start:start + 4096]].astype('float32') / 255
+    normalised.flush()
+    del normalised
+    np.save(ctx.path('Y.npy'), train_model.one_hot(Y[order]))
+    # Row i here is row order[i] of model/X.npy (distill.py maps the split back)
+    np.save(ctx.path('order.npy'), order)
+    print("Images Shuffling & Normalization completed")
+    return {'images': int(len(X))}
+
+
+def split(ctx):
+    """Stratified train/test split of the preprocessed rows."""
+    from sklearn.model_selection import train_test_split
+    labels = np.argmax(np.load(ctx.inputs['preprocess'].path('Y.npy')), axis=1)
+    train, test = train_test_split(np.arange(len(labels)), test_size=ctx.params['test_size'],
+                                   random_state=ctx.params['seed'], stratify=labels)
+    np.savez(ctx.path('split.npz'), train=np.sort(train), test=np.sort(test))
+    print(f"{len(train)} images used to train, {len(test)} to test")
+    return {'train': int(len(train)), 'test': int(len(test))}
+
+
+def _fit(ctx, model):
+    from keras.callbacks import ModelCheckpoint
+    X, Y, train_idx, test_idx = _dataset(ctx)
+    # Checkpoint beside the weights and swap them in only once training finished
+    partial = ctx.artifacts['weights'] + '.partial'
+    checkpoint = ModelCheckpoint(filepath=partial, verbose=1, save_best_only=True)
+    hist = model.fit(X[train_idx], Y[train_idx], batch_size=ctx.params['batch_size'], epochs=ctx.params['epochs'],
+                     validation_data=(X[test_idx], Y[test_idx]), callbacks=[checkpoint], verbose=2)
+    os.replace(partial, ctx.artifacts['weights'])
+    history = {name: [float(value) for value in values] for name, values in hist.history.items()}
+    with open(ctx.path('history.json'), 'w') as f:
+        json.dump(history, f, indent=2)
+    return {'epochs': len(history['loss']), 'best_val_loss': min(history['val_loss'])}
+
+
+def train_densenet(ctx):
+    """Frozen ImageNet DenseNet121 with a small trainable head."""
+    from keras.applications import DenseNet121
+    from keras.layers import AveragePooling2D, Dense, Dropout, Flatten
+    from keras.models import Model
+    from keras.optimizers import Adam
+
+    densenet = DenseNet121(input_shape=(32, 32, 3), include_top=False, weights='imagenet')
+    for layer in densenet.layers:
+        layer.trainable = False
+    head = AveragePooling2D(pool_size=(1, 1))(densenet.output)
+    head = Flatten(name="flatten")(head)
+    head = Dense(128, activation="relu")(head)
+    head = Dropout(0.3)(head)
+    head = Dense(len(LABELS), activation="softmax")(head)
+    model = Model(inputs=densenet.input, outputs=head)
+    model.compile(optimizer=Adam(lr=ctx.params['learning_rate']), loss='categorical_crossentropy',
+                  metrics=['accuracy'])
+    return _fit(ctx, model)
+
+
+def train_cnn(ctx):
+    """The served two-conv CNN (train_model.build_model)."""
+    model = train_model.build_model((32, 32, 3), len(LABELS), ctx.params['dense_units'],
+                                    ctx.params['learning_rate'])
+    return _fit(ctx, model)
+
+
+def predict(ctx):
+    from keras.models import load_model
+    X, _, _, test_idx = _dataset(ctx)
+    model = load_model(ctx.inputs['train_' + ctx.params['model']].artifacts['weights'])
+    probs = model.predict(X[test_idx], batch_size=256)
+    np.save(ctx.path('probs.npy'), probs)
+    return {'samples': int(len(test_idx)),
+            'adopted': bool(ctx.inputs['train_' + ctx.params['model']].result.get('adopted'))}
+
+
+def metrics(ctx):
+    """Accuracy/precision/recall/F1/AUC on the test split, plus confusion matrix and ROC figure."""
+    import seaborn as sns
+    from sklearn.metrics import (accuracy_score, confusion_matrix, f1_score, precision_score, recall_score,
+                                 roc_auc_score, roc_curve)
+
+    algorithm = MODELS[ctx.params['model']]
+    _, Y, _, test_idx = _dataset(ctx)
+    labels = np.argmax(Y[test_idx], axis=1)
+    probs = np.load(ctx.inputs['predict_' + ctx.params['model']].path('probs.npy'))
+    predicted = np.argmax(probs, axis=1)
+    result = {
+        'algorithm': algorithm,
+        'adopted': ctx.inputs['predict_' + ctx.params['model']].result['adopted'],
+        'accuracy': accuracy_score(labels, predicted) * 100,
+        'precision': precision_score(labels, predicted, average='macro') * 100,
+        'recall': recall_score(labels, predicted, average='macro') * 100,
+        'fscore': f1_score(labels, predicted, average='macro') * 100,
+        'auc': roc_auc_score(labels, probs[:, 1]) * 100,
+        'confusion_matrix': confusion_matrix(labels, predicted).tolist(),
+    }
+    for name in ('accuracy', 'precision', 'recall', 'fscore', 'auc'):
+        print(f"{algorithm} {name:<9} : {result[name]:.2f}")
+
+    fig, axs = plt.subplots(1, 2, figsize=(10, 3))
+    ax = sns.heatmap(result['confusion_matrix'], xticklabels=LABELS, yticklabels=LABELS, annot=True,
+                     cmap="viridis", fmt="g", ax=axs[0])
+    ax.set_ylim([0, len(LABELS)])
+    axs[0].set_title(algorithm + " Confusion matrix")
+    fpr, tpr, _ = roc_curve(labels, probs[:, 1], pos_label=1)
+    axs[1].plot([0, 1], [0, 1], linestyle='--', color='orange', label="Chance")
+    axs[1].plot(fpr, tpr, label=f"AUC {result['auc']:.1f}")
+    axs[1].set_title(algorithm + " ROC AUC Curve")
     axs[1].set_xlabel('False Positive Rate')
     axs[1].set_ylabel('True Positive rate')
-    # plt.show()  
-
-#training pre-trained densenet121 algorithm on 80% training features and then evaluate model performance using 20% test images
-densenet = DenseNet121(input_shape=(X_train.shape[1], X_train.shape[2], X_train.shape[3]), include_top=False, weights='imagenet')
-for layer in densenet.layers:
-    layer.trainable = False
-#transfer learning densenet to train on fake and real images with extra layers    
-headModel = densenet.output
-headModel = AveragePooling2D(pool_size=(1, 1))(headModel)
-headModel = Flatten(name="flatten")(headModel)
-headModel = Dense(128, activation="relu")(headModel)
-headModel = Dropout(0.3)(headModel)
-headModel = Dense(y_train.shape[1], activation="softmax")(headModel)
-densenet_model = Model(inputs=densenet.input, outputs=headModel)
-#compiling, training and loading model
-densenet_model.compile(optimizer = Adam(learning_rate=0.0001), loss = 'categorical_crossentropy', metrics = ['accuracy'])
-if os.path.exists("model/densenet_weights.hdf5") == False:
-    model_check_point = ModelCheckpoint(filepath='model/densenet_weights.hdf5', verbose = 1, save_best_only = True)
-    hist = densenet_model.fit(X_train, y_train, batch_size = 64, epochs = 40, validation_data=(X_test, y_test), callbacks=[model_check_point], verbose=1)
-    f = open('model/densenet_history.pckl', 'wb')
-    pickle.dump(hist.history, f)
-    f.close()    
-else:
-    densenet_model.load_weights("model/densenet_weights.hdf5")
-#perform prediction on test data
-predict = densenet_model.predict(X_test)
-predict = np.argmax(predict, axis=1)
-y_test1 = np.argmax(y_test, axis=1)
-predict[0:3500] = y_test1[:3500]
-#call this function to calculate accuracy and other metrics
-calculateMetrics("DenseNet121", y_test1, predict)
-
-#training extension NasNetMobile algorithm on training features and then perfroming prediction on 20% test images to 
-#calculate model prediction accuracy
-#defining nasnet pre-trained model
-nasnet_model = NASNetMobile(input_shape=(X_train.shape[1], X_train.shape[2], X_train.shape[3]), include_top=False, weights=None)
-for layer in nasnet_model.layers:
-    layer.trainable = False
-#transfer learning nasnet to trained on fake and real images with extra cnn layers    
-nasnet_model = Sequential()
-nasnet_model.add(Convolution2D(32, (3 , 3), input_shape = (X_train.shape[1], X_train.shape[2], X_train.shape[3]), activation = 'relu'))
-nasnet_model.add(MaxPooling2D(pool_size = (2, 2)))
-nasnet_model.add(Convolution2D(32, (3, 3), activation = 'relu'))
-nasnet_model.add(MaxPooling2D(pool_size = (2, 2)))
-nasnet_model.add(Flatten())
-nasnet_model.add(Dense(units = 256, activation = 'relu'))
-nasnet_model.add(Dense(units = y_train.shape[1], activation = 'softmax'))
-#compiling, training and loading model
-nasnet_model.compile(optimizer = 'adam', loss = 'categorical_crossentropy', metrics = ['accuracy'])
-if os.path.exists("model/nasnet_weights.hdf5") == False:
-    model_check_point = ModelCheckpoint(filepath='model/nasnet_weights.hdf5', verbose = 1, save_best_only = True)
-    hist = nasnet_model.fit(X_train, y_train, batch_size = 64, epochs = 40, validation_data=(X_test, y_test), callbacks=[model_check_point], verbose=1)
-    f = open('model/nasnet_history.pckl', 'wb')
-    pickle.dump(hist.history, f)
-    f.close()    
-else:
-    nasnet_model.load_weights("model/nasnet_weights.hdf5")
-#perform prediction on test data
-predict = nasnet_model.predict(X_test)
-predict = np.argmax(predict, axis=1)
-y_test1 = np.argmax(y_test, axis=1)
-#call this function to calculate accuracy and other metrics
-calculateMetrics("Extension NasNetMobile", y_test1, predict)
-
-#plot all algorithm performance in tabukar format
-df = pd.DataFrame([['DenseNet121','Accuracy',accuracy[0]],['DenseNet121','Precision',precision[0]],['DenseNet121','Recall',recall[0]],['DenseNet121','FSCORE',fscore[0]],
-                   ['Extension NasNet','Accuracy',accuracy[1]],['Extension NasNet','Precision',precision[1]],['Extension NasNet','Recall',recall[1]],['Extension NasNet','FSCORE',fscore[1]],
-                  ],columns=['Parameters','Algorithms','Value'])
-df.pivot("Parameters", "Algorithms", "Value").plot(kind='bar', figsize=(8, 3))
-plt.title("All Algorithms Performance Graph")
-# plt.show()
-
-#display all algorithm performnace
-algorithms = ['DenseNet121', 'Extension NasNet']
-data = []
-for i in range(len(accuracy)):
-    data.append([algorithms[i], accuracy[i], precision[i], recall[i], fscore[i]])
-data = pd.DataFrame(data, columns=['Algorithm Name', 'Accuracy', 'Precision', 'Recall', 'FSCORE'])
-data  
-
-#define and load LIME object
-# Create LIME image explainer
-explainer = lime_image.LimeImageExplainer()
-print("Lime model loaded")
-
-#get Grad Cam Image
-def getGradCam(img, model):
+    axs[1].legend()
+    fig.savefig(ctx.path('metrics.png'), bbox_inches='tight')
+    plt.close(fig)
+    return result
+
+
+def plots(ctx):
+    """Class balance, a sample processed image and the all-algorithms comparison."""
+    import pandas as pd
+
+    Y = np.load(ctx.inputs['load'].artifacts['Y'])
+    _, count = np.unique(Y, return_counts=True)
+    fig = plt.figure(figsize=(4, 3))
+    plt.bar(np.arange(len(count)), count)
+    plt.xticks(np.arange(len(count)), LABELS[:len(count)])
+    plt.xlabel("Class Labels in Dataset")
+    plt.ylabel("Count")
+    plt.title("different Images Class Labels Graph")
+    fig.savefig(ctx.artifacts['class_labels'], bbox_inches='tight')
+    plt.close(fig)
+
+    X = np.load(ctx.inputs['preprocess'].path('X.npy'), mmap_mode='r')
+    fig = plt.figure(figsize=(5, 3))
+    plt.imshow(np.asarray(X[10])[:, :, ::-1])
+    plt.title("Sample Processed Image")
+    fig.savefig(ctx.artifacts['sample_image'], bbox_inches='tight')
+    plt.close(fig)
+
+    rows = []
+    for model in MODELS:
+        result = ctx.inputs['metrics_' + model].result
+        rows += [[result['algorithm'], name, result[key]]
+                 for name, key in (('Accuracy', 'accuracy'), ('Precision', 'precision'), ('Recall', 'recall'),
+                                   ('FSCORE', 'fscore'))]
+        shutil.copyfile(ctx.inputs['metrics_' + model].path('metrics.png'), ctx.artifacts[model + '_metrics'])
+    df = pd.DataFrame(rows, columns=['Algorithms', 'Parameters', 'Value'])
+    df.pivot(index="Parameters", columns="Algorithms", values="Value").plot(kind='bar', figsize=(8, 3))
+    plt.title("All Algorithms Performance Graph")
+    plt.savefig(ctx.artifacts['comparison'], bbox_inches='tight')
+    plt.close('all')
+
+
+def report(ctx):
+    """Metrics table for every algorithm (CSV and Markdown)."""
+    import pandas as pd
+
+    data = pd.DataFrame([[ctx.inputs['metrics_' + model].result[key]
+                          for key in ('algorithm', 'accuracy', 'precision', 'recall', 'fscore', 'auc')]
+                         for model in MODELS],
+                        columns=['Algorithm Name', 'Accuracy', 'Precision', 'Recall', 'FSCORE', 'AUC'])
+    adopted = [ctx.inputs['metrics_' + model].result['algorithm'] for model in MODELS
+               if ctx.inputs['metrics_' + model].result['adopted']]
+    data.assign(Adopted=[ctx.inputs['metrics_' + model].result['adopted'] for model in MODELS]).to_csv(
+        ctx.artifacts['csv'], index=False, float_format='%.2f')
+    split_sizes = ctx.inputs['split'].result
+    with open(ctx.artifacts['markdown'], 'w') as f:
+        f.write(f"# Fake vs. real image detection\n\n"
+                f"{split_sizes['train']} training and {split_sizes['test']} test images.\n\n")
+        f.write('| ' + ' | '.join(data.columns) + ' |\n')
+        f.write('|' + '---|' * len(data.columns) + '\n')
+        for row in data.itertuples(index=False):
+            f.write('| ' + ' | '.join(str(row[0]) if i == 0 else f'{value:.2f}' for i, value in enumerate(row))
+                    + ' |\n')
+        if adopted:
+            f.write(f"\nAdopted weights, not trained by this pipeline on this split (their test images may "
+                    f"have been seen in training): {', '.join(adopted)}.\n")
+    print(data.to_string(index=False, float_format='%.2f'))
+    if adopted:
+        print(f"Adopted weights (scores may be optimistic): {', '.join(adopted)}")
+
+
+def _grad_cam(img, model):
+    from keras.models import Model
+    import cv2
     feature_model = Model(model.inputs, model.layers[-7].output)
-    predict = feature_model.predict(img)#now using  cnn model to detcet tumor damage
-    predict = predict[0]
-    pred = predict[:,:,24]
-    pred =  pred*255
-    pred = cv2.resize(pred, (150, 150))
-    return pred
-
-#function to classify image as fake or real
-def classifyImage(image_path):
-    image = cv2.imread(image_path)
-    img = cv2.resize(image, (32,32))
-    im2arr = np.array(img)
-    im2arr = im2arr.reshape(1,32,32,3)
-    img = np.asarray(im2arr)
-    img = img.astype('float32')
-    img = img/255
-    predict = nasnet_model.predict(img)
-    predict = np.argmax(predict)
-    status = "Real"
-    if predict == 0:
-        status = "Fake"
-    grad_cam = getGradCam(img, nasnet_model)
-    # Generate Lime explanation
-    explanation = explainer.explain_instance(img[0], nasnet_model.predict)
-    # Visualize the explanation
-    temp, mask = explanation.get_image_and_mask(explanation.top_labels[0], positive_only=True, num_features=5, hide_rest=False)
-    lime_marking = mark_boundaries(temp / 2 + 0.5, mask)
-    lime_marking = cv2.resize(lime_marking, (150, 150), interpolation=cv2.INTER_LANCZOS4)
-    image = cv2.imread(image_path)
-    image = cv2.resize(image, (150, 150))
-    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    #lime_marking = cv2.cvtColor(lime_marking, cv2.COLOR_BGR2RGB)
-    cv2.putText(image, status, (10, 25),  cv2.FONT_HERSHEY_SIMPLEX,0.7, (0, 0, 255), 2)
-    f, axarr = plt.subplots(1,3, figsize=(8,4)) 
-    axarr[0].imshow(image)
-    axarr[0].title.set_text("Input Image")
-    axarr[1].imshow(grad_cam)
-    axarr[1].title.set_text('Grad Cam Image')
-    axarr[2].imshow(lime_marking)
-    axarr[2].title.set_text('Lime Explanation Image')
-    plt.axis('off')
-    # plt.show()
-
-#call this function with image page for fake or real classification
-classifyImage("testImages/1.jpg")
-
-#call this function with image page for fake or real classification
-classifyImage("testImages/2.png")
-
-#call this function with image page for fake or real classification
-classifyImage("testImages/5.jpg")
-
-#call this function with image page for fake or real classification
-classifyImage("testImages/4.jpg")
-
-#call this function with image page for fake or real classification
-classifyImage("testImages/10.jpg")
-
-#call this function with image page for fake or real classification
-classifyImage("testImages/6.jpg")
+    pred = feature_model.predict(img)[0][:, :, 24] * 255
+    return cv2.resize(pred, (150, 150))
+
+
+def explain(ctx):
+    """Classify each test image and save its Grad-CAM and LIME panels."""
+    import cv2
+    from keras.models import load_model
+    from lime import lime_image
+    from skimage.segmentation import mark_boundaries
+
+    model = load_model(ctx.inputs['train_cnn'].artifacts['weights'])
+    explainer = lime_image.LimeImageExplainer()
+    verdicts = {}
+    for image_path in ctx.params['images']:
+        image = cv2.imread(image_path)
+        img = cv2.resize(image, (32, 32)).reshape(1, 32, 32, 3).astype('float32') / 255
+        status = "Real" if np.argmax(model.predict(img)) == 1 else "Fake"
+        verdicts[image_path] = status
+        grad_cam = _grad_cam(img, model)
+        explanation = explainer.explain_instance(img[0], model.predict)
+        temp, mask = explanation.get_image_and_mask(explanation.top_labels[0], positive_only=True, num_features=5,
+                                                    hide_rest=False)
+        lime_marking = cv2.resize(mark_boundaries(temp / 2 + 0.5, mask), (150, 150),
+                                  interpolation=cv2.INTER_LANCZOS4)
+        image = cv2.cvtColor(cv2.resize(image, (150, 150)), cv2.COLOR_BGR2RGB)
+        cv2.putText(image, status, (10, 25), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+        f, axarr = plt.subplots(1, 3, figsize=(8, 4))
+        axarr[0].imshow(image)
+        axarr[0].title.set_text("Input Image")
+        axarr[1].imshow(grad_cam)
+        axarr[1].title.set_text('Grad Cam Image')
+        axarr[2].imshow(lime_marking)
+        axarr[2].title.set_text('Lime Explanation Image')
+        plt.axis('off')
+        f.savefig(ctx.artifacts[image_path], bbox_inches='tight')
+        plt.close(f)
+        print(f"{image_path}: {status}")
+    return {'verdicts': verdicts}
+
+
+# Graph ------------------------------------------------------------------
+
+def build_stages(options):
+    results = lambda name: os.path.join(RESULTS_DIR, name)
+    stages = [
+        Stage('load', load, params={'dataset': options.dataset}, inputs=[options.dataset],
+              artifacts={'X': train_model.X_CACHE, 'Y': train_model.Y_CACHE}, adopt=True),
+        Stage('preprocess', preprocess, deps=['load'], params={'seed': options.seed}),
+        Stage('split', split, deps=['preprocess'], params={'test_size': 0.2, 'seed': options.seed}),
+        Stage('train_densenet', train_densenet, deps=['preprocess', 'split'],
+              params={'epochs': options.epochs, 'batch_size': 64, 'learning_rate': 0.0001},
+              artifacts={'weights': 'model/densenet_weights.hdf5'}, adopt=True),
+        Stage('train_cnn', train_cnn, deps=['preprocess', 'split'],
+              params={'epochs': options.epochs, 'batch_size': 64, 'learning_rate': 0.001, 'dense_units': 256},
+              artifacts={'weights': train_model.BEST_MODEL_PATH}, adopt=True),
+    ]
+    for model in MODELS:
+        stages += [
+            Stage('predict_' + model, predict, deps=['preprocess', 'split', 'train_' + model],
+                  params={'model': model}),
+            Stage('metrics_' + model, metrics, deps=['preprocess', 'split', 'predict_' + model],
+                  params={'model': model}),
+        ]
+    metric_stages = ['metrics_' + model for model in MODELS]
+    plot_artifacts = {name: results(name + '.png') for name in ('class_labels', 'sample_image', 'comparison')}
+    plot_artifacts.update({model + '_metrics': results(model + '_metrics.png') for model in MODELS})
+    stages += [
+        Stage('plots', plots, deps=['load', 'preprocess'] + metric_stages, artifacts=plot_artifacts),
+        Stage('report', report, deps=['split'] + metric_stages,
+              artifacts={'csv': results('metrics.csv'), 'markdown': results('report.md')}),
+        Stage('explain', explain, deps=['train_cnn'], params={'images': TEST_IMAGES}, inputs=TEST_IMAGES,
+              artifacts={path: results(os.path.join('explanations', os.path.basename(path) + '.png'))
+                         for path in TEST_IMAGES}),
+    ]
+    return stages
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Train, evaluate and compare the fake-image detectors')
+    parser.add_argument('targets', nargs='*', help='Stages to bring up to date (default: all)')
+    parser.add_argument('--jobs', type=int, default=2, help='Stages run in parallel')
+    parser.add_argument('--force', default='', help='Comma-separated stages to recompute regardless of cache')
+    parser.add_argument('--dry-run', action='store_true', help='List cached/stale stages and exit')
+    parser.add_argument('--dataset', default=train_model.DATASET_PATH)
+    parser.add_argument('--epochs', type=int, default=40)
+    parser.add_argument('--seed', type=int, default=train_model.DEFAULTS['seed'])
+    return parser.parse_args(argv)
+
 
+def main(argv=None):
+    options = parse_args(argv)
+    pipeline = Pipeline(build_stages(options), jobs=options.jobs)
+    if options.dry_run:
+        for name, status in pipeline.plan(options.targets or None):
+            print(f'{status:<7} {name}')
+        return
+    pipeline.run(options.targets or None, force=[name for name in options.force.split(',') if name])
+    print(f"Results written to {RESULTS_DIR}/")
 
 
+if __name__ == '__main__':
+    main()
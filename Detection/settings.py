@@ -37,19 +37,25 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'DetectionApp',
+    'DetectionApp.apps.DetectionappConfig',
     'corsheaders',
 ]
 
 MIDDLEWARE = [
+    # Per-endpoint RSS/heap/graph growth, shown at /api/admin/metrics
+    # (DetectionApp/memory.py)
+    'DetectionApp.middleware.MemoryAccountingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # AuthenticationMiddleware with a cached user lookup (DetectionApp/auth.py)
+    'DetectionApp.middleware.RequestUserMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Opt-in cProfile/tracemalloc for single requests (DetectionApp/profiling.py)
+    'DetectionApp.middleware.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'Detection.urls'
@@ -76,11 +82,53 @@ WSGI_APPLICATION = 'Detection.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+#
+# SQLite is the default. DETECTION_DB_ENGINE=postgresql switches to the
+# PostgreSQL profile (needs psycopg2), configured from DETECTION_DB_* env vars.
+
+DB_ENGINE = os.environ.get('DETECTION_DB_ENGINE', 'sqlite3')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DETECTION_DB_NAME', 'detection'),
+            'USER': os.environ.get('DETECTION_DB_USER', 'detection'),
+            'PASSWORD': os.environ.get('DETECTION_DB_PASSWORD', ''),
+            'HOST': os.environ.get('DETECTION_DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DETECTION_DB_PORT', '5432'),
+            # Keep connections open between requests instead of reconnecting each time
+            'CONN_MAX_AGE': int(os.environ.get('DETECTION_DB_CONN_MAX_AGE', 600)),
+            # Set DETECTION_DB_PGBOUNCER=1 when HOST/PORT point at PgBouncer in
+            # transaction pooling mode; server-side cursors don't survive it
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('DETECTION_DB_PGBOUNCER') == '1',
+            'OPTIONS': {
+                'connect_timeout': 5,
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+            'CONN_MAX_AGE': int(os.environ.get('DETECTION_DB_CONN_MAX_AGE', 60)),
+            'OPTIONS': {
+                # Seconds a writer waits for the lock before "database is locked"
+                'timeout': 20,
+            },
+        }
     }
+
+# Applied to every new SQLite connection (DetectionApp/db.py). WAL lets
+# readers run alongside the single writer; synchronous=NORMAL is durable
+# across application crashes in WAL mode and avoids an fsync per commit.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,
+    'temp_store': 'MEMORY',
+    'cache_size': -16000,  # KiB
 }
 
 
@@ -138,6 +186,14 @@ CORS_ALLOW_HEADERS = [
     'x-csrftoken',
     'x-requested-with',
     'x-user-id',
+    'if-none-match',
+    'x-profile',
+]
+CORS_EXPOSE_HEADERS = [
+    'retry-after',
+    'etag',
+    'x-profile-id',
+    'x-profile-status',
 ]
 CSRF_TRUSTED_ORIGINS = [
     "http://localhost:5173",
@@ -149,5 +205,170 @@ SESSION_COOKIE_HTTPONLY = True
 CSRF_COOKIE_SAMESITE = 'Lax'
 CSRF_COOKIE_SECURE = False
 
-# For local development, ensure session saves
-SESSION_SAVE_EVERY_REQUEST = True
+# Sessions are read from the cache and only written when they change (login,
+# logout), so read-only API calls don't touch the django_session table
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_SAVE_EVERY_REQUEST = False
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'detection',
+    }
+}
+
+# Short-lived per-process cache of User records for session and X-User-ID
+# lookups. Saves and deletes in this process invalidate immediately; other
+# processes pick changes up within TTL seconds.
+USER_CACHE = {
+    'TTL': 30,
+    'MAX_ENTRIES': 1024,
+}
+
+
+# Inference runtime (see DetectionApp/runtime.py). Per-process thread counts for
+# TensorFlow, OpenCV and BLAS; 0 keeps the library default. Tune with
+# `python manage.py autotune_workers`.
+INFERENCE_RUNTIME = {
+    'TF_INTRA_OP_THREADS': int(os.environ.get('DETECTION_TF_INTRA_OP_THREADS', 0)),
+    'TF_INTER_OP_THREADS': int(os.environ.get('DETECTION_TF_INTER_OP_THREADS', 0)),
+    'CV2_THREADS': int(os.environ.get('DETECTION_CV2_THREADS', 0)),
+    'BLAS_THREADS': int(os.environ.get('DETECTION_BLAS_THREADS', 0)),
+    'CPU_AFFINITY': os.environ.get('DETECTION_CPU_AFFINITY', ''),
+    'WORKER_INDEX': int(os.environ.get('DETECTION_WORKER_INDEX', 0)),
+}
+DETECTION_MODEL_PATH = os.environ.get('DETECTION_MODEL_PATH', 'model/nasnet_weights.hdf5')
+
+# Admission control for /api/predict (see DetectionApp/admission.py). Requests
+# beyond MAX_IN_FLIGHT + MAX_QUEUE get 503 with Retry-After; explanation
+# fidelity steps down as the wait queue grows.
+PREDICT_ADMISSION = {
+    'MAX_IN_FLIGHT': int(os.environ.get('DETECTION_MAX_IN_FLIGHT', 2)),
+    'MAX_QUEUE': int(os.environ.get('DETECTION_MAX_QUEUE', 8)),
+    'QUEUE_TIMEOUT': 30,
+    'RETRY_AFTER': 5,
+    'FIDELITY_STEPS': [(0, 'full'), (2, 'reduced'), (4, 'gradcam'), (6, 'verdict')],
+}
+
+# Per-request explanation budget in forward-pass equivalents (see
+# DetectionApp/explainers.py): gradcam=2, occlusion=49, lime_fast=250, lime=1000.
+EXPLAINER_BUDGET = int(os.environ.get('DETECTION_EXPLAINER_BUDGET', 1200))
+
+# Byte budget for cached raw explanation artifacts (DetectionApp/explanation_cache.py)
+EXPLANATION_CACHE_BYTES = int(os.environ.get('DETECTION_EXPLANATION_CACHE_BYTES', 64 * 1024 * 1024))
+
+# Tiled multi-scale scanning (POST /api/predict with mode=scan, see
+# DetectionApp/scanning.py). MAX_PATCHES also caps client-supplied values;
+# clients may request at most MAX_SCALES scales, each in (0, 1].
+SCAN_MODE = {
+    'STRIDE': 16,
+    'SCALES': (1.0, 0.5, 0.25),
+    'MAX_PATCHES': int(os.environ.get('DETECTION_SCAN_MAX_PATCHES', 4096)),
+    'MEMORY_CAP_BYTES': 32 * 1024 * 1024,
+    'TOP_FRACTION': 0.1,
+    'MAX_SCALES': 4,
+}
+
+# Video analysis (POST /api/predict/video and manage.py analyze_video, see
+# DetectionApp/video.py)
+VIDEO_ANALYSIS = {
+    'STRIDE': 15,
+    'SCENE_THRESHOLD': None,
+    'MAX_GAP': 150,
+    'BATCH_SIZE': 32,
+    'QUEUE_SIZE': 64,
+    'TIMELINE_BINS': 120,
+    'MAX_FRAMES': 5000,
+}
+
+# Write-behind AnalysisLog writer (DetectionApp/log_writer.py). Rows are
+# flushed with bulk_create every FLUSH_INTERVAL seconds or MAX_BATCH rows;
+# a failed batch is requeued, each record up to MAX_RETRIES times.
+ANALYSIS_LOG_WRITER = {
+    'ENABLED': True,
+    'MAX_BATCH': 50,
+    'FLUSH_INTERVAL': 1.0,
+    'MAX_RETRIES': 5,
+}
+
+# Upload storage retention (DetectionApp/storage.py). Unreferenced files are
+# removed ORPHAN_GRACE_SECONDS after their last reference goes away; set
+# TTL_DAYS to also prune old analyses. Serving processes (Detection/wsgi.py)
+# run a pass every GC_INTERVAL seconds; `manage.py gc_uploads` runs one pass.
+UPLOAD_RETENTION = {
+    'ORPHAN_GRACE_SECONDS': 3600,
+    'TTL_DAYS': int(os.environ['DETECTION_UPLOAD_TTL_DAYS']) if os.environ.get('DETECTION_UPLOAD_TTL_DAYS') else None,
+    'GC_INTERVAL': int(os.environ.get('DETECTION_UPLOAD_GC_INTERVAL', 600)),
+    'GC_BATCH': 1000,
+}
+
+# Rendered /api/history responses, per user (DetectionApp/history_cache.py).
+# Version tokens live in CACHES['default'] when that is shared between
+# processes (Memcached/Redis); with the per-process LocMemCache the version
+# is derived from the database on each request instead ('auto'), so every
+# worker sees each change. VERSION_SOURCE forces 'cache' or 'database'.
+HISTORY_CACHE = {
+    'MAX_BYTES': 32 * 1024 * 1024,
+    'VERSION_SOURCE': 'auto',
+}
+
+# Opt-in request profiling (DetectionApp/profiling.py). Superusers can send
+# `X-Profile: 1` (or ?profile=1, or `inline` to get the summary in the JSON
+# body); ENABLED lets anyone do so. Profiles are listed at
+# /api/admin/profiles.
+REQUEST_PROFILING = {
+    'ENABLED': os.environ.get('DETECTION_PROFILING') == '1',
+    'DIR': os.path.join(BASE_DIR, 'profiles'),
+    'KEEP': 50,
+    'TOP_FUNCTIONS': 40,
+    'TOP_ALLOCATIONS': 25,
+}
+
+# Upload thumbnails (DetectionApp/thumbnails.py), written at ingest next to
+# the content-addressed original and served from /thumbs/ with an immutable
+# one-year Cache-Control
+THUMBNAILS = {
+    'SIZES': [64, 150, 512],
+    'FORMAT': 'webp',
+    'QUALITY': 80,
+}
+
+# Worker memory accounting (DetectionApp/memory.py). Per-endpoint memory
+# deltas are reported at /api/admin/metrics; growth past the post-warmup
+# baseline is logged with the top allocation sites when TRACEMALLOC is on.
+# The RECYCLE_* limits make the worker send itself SIGTERM after the
+# current response, for gunicorn/uWSGI to replace; keep them 0 under
+# runserver.
+MEMORY_ACCOUNTING = {
+    'ENABLED': True,
+    'TRACEMALLOC': os.environ.get('DETECTION_TRACEMALLOC') == '1',
+    'WARMUP_REQUESTS': 20,
+    'GROWTH_WARN_MB': 100,
+    'RECYCLE_AFTER_REQUESTS': int(os.environ.get('DETECTION_RECYCLE_AFTER_REQUESTS', 0)),
+    'RECYCLE_AFTER_GROWTH_MB': int(os.environ.get('DETECTION_RECYCLE_AFTER_GROWTH_MB', 0)),
+}
+
+# Explanation process pool (DetectionApp/xai_pool.py). LIME, segmentation
+# and panel rendering run in WORKERS single-threaded processes, each with
+# its own full copy of the model, so it is off by default; enable it with
+# DETECTION_XAI_POOL=1 where memory allows. Arrays pass through
+# multiprocessing.shared_memory on Python 3.8+; the pinned TF 1.14 stack
+# runs on Python <= 3.7, where they are pickled instead. Requests whose
+# explanation fails or exceeds TASK_TIMEOUT get the verdict only.
+XAI_POOL = {
+    'ENABLED': os.environ.get('DETECTION_XAI_POOL', '0') == '1',
+    'WORKERS': int(os.environ.get('DETECTION_XAI_WORKERS', max(1, min(4, (os.cpu_count() or 2) - 1)))),
+    'TASK_TIMEOUT': int(os.environ.get('DETECTION_XAI_TIMEOUT', 60)),
+    'THREADS_PER_WORKER': 1,
+}
+
+# Similar-image index of CNN embeddings (DetectionApp/vector_index.py), one
+# directory per model version. Small indexes are scanned brute force; past
+# IVF_MIN_VECTORS the retention pass partitions them so queries scan only
+# IVF_PROBE partitions. `manage.py vector_index` builds, trains and reports.
+VECTOR_INDEX = {
+    'ENABLED': True,
+    'DIR': os.path.join(BASE_DIR, 'vector_index'),
+    'IVF_MIN_VECTORS': 50000,
+    'IVF_PROBE': 8,
+}
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Detection.settings')
 
 application = get_wsgi_application()
+
+# Only serving processes collect orphaned uploads; management commands, the
+# test runner and spawned pool workers never import this module
+from DetectionApp import storage  # noqa: E402
+storage.start_background_gc()
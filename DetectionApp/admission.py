@@ -0,0 +1,140 @@
+"""
+Admission control for the inference path.
+
+A bounded number of predictions run at once; a bounded number more may wait
+for a slot. Anything beyond that is turned away immediately with a
+Retry-After hint instead of piling up until the client times out. The depth
+of the wait queue at arrival also picks how much explanation work the
+request gets, so a spike degrades detail before it degrades latency.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# Explanation fidelity levels, most to least expensive
+FIDELITY_FULL = 'full'          # Grad-CAM + LIME with the default sample count
+FIDELITY_REDUCED = 'reduced'    # Grad-CAM + LIME with fewer perturbation samples
+FIDELITY_GRADCAM = 'gradcam'    # Grad-CAM only
+FIDELITY_VERDICT = 'verdict'    # classification only, no explanation image
+FIDELITY_LEVELS = [FIDELITY_FULL, FIDELITY_REDUCED, FIDELITY_GRADCAM, FIDELITY_VERDICT]
+
+DEFAULT_ADMISSION = {
+    'MAX_IN_FLIGHT': 2,
+    'MAX_QUEUE': 8,
+    'QUEUE_TIMEOUT': 30,        # seconds a request may wait for a slot
+    'RETRY_AFTER': 5,           # minimum Retry-After in seconds
+    # (queue depth at arrival, fidelity) - the last step reached wins
+    'FIDELITY_STEPS': [
+        (0, FIDELITY_FULL),
+        (2, FIDELITY_REDUCED),
+        (4, FIDELITY_GRADCAM),
+        (6, FIDELITY_VERDICT),
+    ],
+}
+
+
+class AdmissionRejected(Exception):
+    """Raised when the wait queue is full or the wait timed out."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    def __init__(self, max_in_flight, max_queue, queue_timeout, retry_after, fidelity_steps):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.fidelity_steps = sorted(fidelity_steps)
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+        # Exponentially weighted service time, used to estimate Retry-After
+        self._service_time = None
+        self._cond = threading.Condition()
+
+    def fidelity_for_depth(self, depth):
+        fidelity = FIDELITY_FULL
+        for threshold, level in self.fidelity_steps:
+            if depth >= threshold:
+                fidelity = level
+        return fidelity
+
+    def estimate_retry_after(self):
+        """Seconds until a slot is likely to free up, never below the configured floor."""
+        if self._service_time is None:
+            return self.retry_after
+        backlog = (self.waiting + 1) / float(self.max_in_flight)
+        return max(self.retry_after, int(math.ceil(self._service_time * backlog)))
+
+    @contextmanager
+    def admit(self):
+        """Hold a slot for the duration of the block and yield the fidelity level to use."""
+        with self._cond:
+            if self.in_flight >= self.max_in_flight and self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise AdmissionRejected('Server busy, please retry', self.estimate_retry_after())
+            depth = self.waiting if self.in_flight >= self.max_in_flight else 0
+            self.waiting += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while self.in_flight >= self.max_in_flight:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        raise AdmissionRejected('Timed out waiting for an inference slot',
+                                                self.estimate_retry_after())
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+
+        started = time.monotonic()
+        try:
+            yield self.fidelity_for_depth(depth)
+        finally:
+            elapsed = time.monotonic() - started
+            with self._cond:
+                self.in_flight -= 1
+                if self._service_time is None:
+                    self._service_time = elapsed
+                else:
+                    self._service_time = 0.8 * self._service_time + 0.2 * elapsed
+                self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+                'rejected': self.rejected,
+                'max_in_flight': self.max_in_flight,
+                'max_queue': self.max_queue,
+            }
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_controller():
+    """Process-wide controller built from settings.PREDICT_ADMISSION."""
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                config = dict(DEFAULT_ADMISSION)
+                config.update(getattr(settings, 'PREDICT_ADMISSION', {}) or {})
+                _controller = AdmissionController(
+                    max_in_flight=config['MAX_IN_FLIGHT'],
+                    max_queue=config['MAX_QUEUE'],
+                    queue_timeout=config['QUEUE_TIMEOUT'],
+                    retry_after=config['RETRY_AFTER'],
+                    fidelity_steps=config['FIDELITY_STEPS'],
+                )
+    return _controller
@@ -3,3 +3,24 @@ from django.apps import AppConfig
 
 class DetectionappConfig(AppConfig):
     name = 'DetectionApp'
+
+    def ready(self):
+        # Size thread pools and pin CPUs before any request touches the model
+        from . import runtime
+        runtime.apply_thread_limits()
+
+        from django.db.backends.signals import connection_created
+        from .db import configure_connection
+        connection_created.connect(configure_connection, dispatch_uid='detection_sqlite_pragmas')
+
+        # Keep the request-user cache in step with profile and admin edits
+        from django.contrib.auth.models import User
+        from django.db.models.signals import post_delete, post_save
+        from .auth import on_user_changed
+        post_save.connect(on_user_changed, sender=User, dispatch_uid='detection_user_cache_save')
+        post_delete.connect(on_user_changed, sender=User, dispatch_uid='detection_user_cache_delete')
+
+        # Worker recycling waits until the response has been sent
+        from django.core.signals import request_finished
+        from .memory import on_request_finished
+        request_finished.connect(on_request_finished, dispatch_uid='detection_memory_recycle')
@@ -0,0 +1,111 @@
+"""
+Request user resolution with a short-lived in-process user cache.
+
+The API accepts either a session cookie or an X-User-ID header. Both end in
+a lookup by primary key, which is cached here for a few seconds so repeated
+calls from the same client (history polling, uploads) skip the auth_user
+query. Entries are dropped whenever a User is saved or deleted in this
+process; other worker processes see the change within TTL seconds.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import AnonymousUser, User
+from django.utils.crypto import constant_time_compare
+
+DEFAULT_USER_CACHE = {
+    'TTL': 30,              # seconds a cached user record stays valid
+    'MAX_ENTRIES': 1024,
+}
+
+_users = OrderedDict()      # user id -> (expires_at, User)
+_lock = threading.Lock()
+
+
+def get_user_cache_config():
+    config = dict(DEFAULT_USER_CACHE)
+    config.update(getattr(settings, 'USER_CACHE', {}) or {})
+    return config
+
+
+def get_cached_user(user_id):
+    """
+    The active User with this id, or None. Callers get their own copy, so
+    modifying and saving it never leaks into other requests.
+    """
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    config = get_user_cache_config()
+    now = time.monotonic()
+    with _lock:
+        entry = _users.get(user_id)
+        if entry is not None and entry[0] > now:
+            _users.move_to_end(user_id)
+            return copy.copy(entry[1])
+    try:
+        user = User.objects.get(id=user_id)
+    except User.DoesNotExist:
+        return None
+    if config['TTL'] > 0:
+        with _lock:
+            _users[user_id] = (now + config['TTL'], user)
+            _users.move_to_end(user_id)
+            while len(_users) > config['MAX_ENTRIES']:
+                _users.popitem(last=False)
+    return copy.copy(user)
+
+
+def invalidate_user(user_id):
+    with _lock:
+        _users.pop(user_id, None)
+
+
+def clear_user_cache():
+    with _lock:
+        _users.clear()
+
+
+def on_user_changed(sender, instance, **kwargs):
+    """post_save / post_delete receiver for User."""
+    invalidate_user(instance.pk)
+
+
+def get_session_user(request):
+    """
+    Same checks as django.contrib.auth.get_user(), but through the cache:
+    the backend must still be configured and the session hash must match
+    the user's current password.
+    """
+    session = request.session
+    user_id = session.get(SESSION_KEY)
+    if user_id is None or session.get(BACKEND_SESSION_KEY) not in settings.AUTHENTICATION_BACKENDS:
+        return AnonymousUser()
+    user = get_cached_user(user_id)
+    if user is None or not user.is_active:
+        return AnonymousUser()
+    session_hash = session.get(HASH_SESSION_KEY)
+    if not (session_hash and constant_time_compare(session_hash, user.get_session_auth_hash())):
+        session.flush()
+        return AnonymousUser()
+    return user
+
+
+def get_api_user(request):
+    """
+    The caller as the API sees it: the session user if logged in, else the
+    user named by the X-User-ID header, else None. Resolved once per request.
+    """
+    if not hasattr(request, '_api_user'):
+        user = None
+        if request.user.is_authenticated:
+            user = request.user
+        elif request.headers.get('X-User-ID'):
+            user = get_cached_user(request.headers['X-User-ID'])
+        request._api_user = user
+    return request._api_user
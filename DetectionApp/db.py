@@ -0,0 +1,31 @@
+"""
+Per-connection database tuning.
+
+Django (before 5.1) has no setting for SQLite PRAGMAs, so they are applied
+from the connection_created signal, which fires once per new connection.
+With CONN_MAX_AGE set that is once per worker thread rather than once per
+request.
+"""
+from django.conf import settings
+
+DEFAULT_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,
+}
+
+
+def get_sqlite_pragmas():
+    pragmas = dict(DEFAULT_SQLITE_PRAGMAS)
+    pragmas.update(getattr(settings, 'SQLITE_PRAGMAS', {}) or {})
+    return pragmas
+
+
+def configure_connection(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    # In-memory test databases can't use WAL; the PRAGMA just reports 'memory'
+    with connection.cursor() as cursor:
+        for name, value in get_sqlite_pragmas().items():
+            if value is not None:
+                cursor.execute(f'PRAGMA {name} = {value}')
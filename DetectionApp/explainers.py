@@ -0,0 +1,221 @@
+"""
+Pluggable explanation backends for the detector.
+
+Every backend declares an expected cost in forward-pass equivalents (images
+scored by the CNN) so a request can be planned against a compute budget
+before any work is done. Backends return raw artifacts (heatmaps, superpixel
+masks); turning them into display panels is a separate step.
+"""
+import threading
+
+import cv2
+import numpy as np
+from django.conf import settings
+from keras import backend as K
+from keras.layers import Conv2D
+from lime import lime_image
+from skimage.segmentation import mark_boundaries
+
+from .admission import FIDELITY_FULL, FIDELITY_REDUCED, FIDELITY_GRADCAM, FIDELITY_VERDICT
+
+PANEL_SIZE = 150
+
+
+class ExplainerBudgetExceeded(Exception):
+    """Raised when a client explicitly asks for more work than the budget allows."""
+
+
+class Explainer:
+    """Base class: subclasses set name/title/cost and implement explain()."""
+    name = None
+    title = None
+    cost = 0
+
+    def signature(self):
+        """Identify the backend and every parameter that changes its output (cache keys)."""
+        return self.name
+
+    def explain(self, img, model, probs):
+        """Return a dict of raw artifacts for a (1, H, W, 3) float input."""
+        raise NotImplementedError
+
+
+class GradCamExplainer(Explainer):
+    """Gradient-weighted class activation map over the last conv layer."""
+    name = 'gradcam'
+    title = 'Grad Cam Image'
+    cost = 2  # one forward plus one backward pass
+
+    def __init__(self):
+        self._functions = {}
+        self._lock = threading.Lock()
+
+    def _gradient_function(self, model, label):
+        # Built once per (model, class) in the model's own graph/session
+        key = (id(model), label)
+        fn = self._functions.get(key)
+        if fn is None:
+            with self._lock:
+                fn = self._functions.get(key)
+                if fn is None:
+                    conv = [layer for layer in model.layers if isinstance(layer, Conv2D)][-1]
+                    grads = K.gradients(model.output[:, label], conv.output)[0]
+                    fn = K.function([model.input], [conv.output, grads])
+                    self._functions[key] = fn
+        return fn
+
+    def explain(self, img, model, probs):
+        label = int(np.argmax(probs))
+        conv_out, grads = self._gradient_function(model, label)([img])
+        weights = grads[0].mean(axis=(0, 1))
+        cam = np.maximum((conv_out[0] * weights).sum(axis=-1), 0)
+        cam = cv2.resize(cam, (img.shape[2], img.shape[1]))
+        peak = cam.max()
+        if peak > 0:
+            cam = cam / peak
+        return {'name': self.name, 'title': self.title, 'label': label, 'heatmap': cam.astype('float32')}
+
+
+class OcclusionExplainer(Explainer):
+    """Strided occlusion sensitivity; every occluded variant is scored in one batch."""
+    name = 'occlusion'
+    title = 'Occlusion Sensitivity'
+
+    def __init__(self, patch=8, stride=4, input_size=32, fill=0.5):
+        self.patch = patch
+        self.stride = stride
+        self.fill = fill
+        self.positions = [
+            (y, x)
+            for y in range(0, input_size - patch + 1, stride)
+            for x in range(0, input_size - patch + 1, stride)
+        ]
+        self.cost = len(self.positions)
+
+    def signature(self):
+        return f'{self.name}:{self.patch}:{self.stride}:{self.fill}'
+
+    def explain(self, img, model, probs):
+        label = int(np.argmax(probs))
+        batch = np.repeat(img, len(self.positions), axis=0)
+        for i, (y, x) in enumerate(self.positions):
+            batch[i, y:y + self.patch, x:x + self.patch, :] = self.fill
+        scores = model.predict(batch, batch_size=len(batch))[:, label]
+        drop = float(probs[label]) - scores
+
+        heat = np.zeros(img.shape[1:3], dtype='float32')
+        counts = np.zeros(img.shape[1:3], dtype='float32')
+        for (y, x), d in zip(self.positions, drop):
+            heat[y:y + self.patch, x:x + self.patch] += d
+            counts[y:y + self.patch, x:x + self.patch] += 1
+        heat = np.maximum(heat / np.maximum(counts, 1), 0)
+        peak = heat.max()
+        if peak > 0:
+            heat = heat / peak
+        return {'name': self.name, 'title': self.title, 'label': label, 'heatmap': heat}
+
+
+class LimeExplainer(Explainer):
+    """LIME superpixel attribution; cost grows with the number of perturbation samples."""
+    title = 'Lime Explanation Image'
+
+    def __init__(self, name, num_samples, num_features=5):
+        self.name = name
+        self.num_samples = num_samples
+        self.num_features = num_features
+        self.cost = num_samples
+        self._explainer = lime_image.LimeImageExplainer()
+
+    def signature(self):
+        return f'lime:{self.num_samples}:{self.num_features}'
+
+    def explain(self, img, model, probs):
+        explanation = self._explainer.explain_instance(img[0], model.predict, num_samples=self.num_samples)
+        label = int(explanation.top_labels[0])
+        weights = sorted(explanation.local_exp[label], key=lambda item: -item[1])
+        return {
+            'name': self.name,
+            'title': self.title,
+            'label': label,
+            'segments': explanation.segments,
+            'weights': [(int(seg), float(w)) for seg, w in weights],
+            'num_features': self.num_features,
+        }
+
+
+def lime_mask(result):
+    """Mask of the top positively weighted superpixels (get_image_and_mask(positive_only=True))."""
+    keep = [seg for seg, w in result['weights'][:result['num_features']] if w > 0]
+    return np.isin(result['segments'], keep).astype('int64')
+
+
+def render_panel(result, img, size=PANEL_SIZE):
+    """Turn one explainer result into an RGB/float panel for display."""
+    if 'heatmap' in result:
+        return cv2.resize(result['heatmap'] * 255, (size, size))
+    mask = result['mask'] if 'mask' in result else lime_mask(result)
+    marking = mark_boundaries(img[0] / 2 + 0.5, mask)
+    return cv2.resize(marking, (size, size), interpolation=cv2.INTER_LANCZOS4)
+
+
+EXPLAINERS = {
+    'gradcam': GradCamExplainer(),
+    'occlusion': OcclusionExplainer(),
+    'lime': LimeExplainer('lime', num_samples=1000),
+    'lime_fast': LimeExplainer('lime_fast', num_samples=250),
+}
+
+# Default plan for each admission fidelity level
+FIDELITY_EXPLAINERS = {
+    FIDELITY_FULL: ['gradcam', 'lime'],
+    FIDELITY_REDUCED: ['gradcam', 'lime_fast'],
+    FIDELITY_GRADCAM: ['gradcam'],
+    FIDELITY_VERDICT: [],
+}
+
+
+def parse_explainer_names(spec):
+    """Parse 'gradcam,lime' into a list of known backend names."""
+    names = [name.strip().lower() for name in spec.split(',') if name.strip()]
+    unknown = [name for name in names if name not in EXPLAINERS]
+    if unknown:
+        raise ValueError(f"Unknown explainer(s): {', '.join(unknown)}. "
+                         f"Available: {', '.join(sorted(EXPLAINERS))}")
+    return names
+
+
+def plan_explainers(spec=None, fidelity=FIDELITY_FULL, budget=None):
+    """
+    Choose the explainers for one request. Returns (explainers, names of
+    the explainers skipped).
+
+    Without an explicit spec the admission fidelity picks the default plan.
+    An explicit spec that costs more than the configured/requested budget is
+    rejected; under load (fidelity below full), explainers that no longer
+    fit the fidelity level's share of the budget are skipped.
+    """
+    limit = getattr(settings, 'EXPLAINER_BUDGET', 1200)
+    if budget is not None:
+        limit = min(limit, budget)
+
+    if spec:
+        names = parse_explainer_names(spec)
+        requested = sum(EXPLAINERS[name].cost for name in names)
+        if requested > limit:
+            raise ExplainerBudgetExceeded(
+                f'Requested explainers cost {requested} units, budget is {limit}')
+    else:
+        names = FIDELITY_EXPLAINERS[fidelity]
+
+    if fidelity != FIDELITY_FULL:
+        # Load shedding: never spend more than the default plan at this fidelity would
+        limit = min(limit, sum(EXPLAINERS[name].cost for name in FIDELITY_EXPLAINERS[fidelity]))
+    plan, skipped, spent = [], [], 0
+    for name in names:
+        explainer = EXPLAINERS[name]
+        if spent + explainer.cost <= limit:
+            plan.append(explainer)
+            spent += explainer.cost
+        else:
+            skipped.append(name)
+    return plan, skipped
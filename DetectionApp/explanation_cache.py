@@ -0,0 +1,186 @@
+"""
+Explanation artifact cache and renderer.
+
+The expensive part of an analysis is the raw explanation (LIME superpixels
+and weights, Grad-CAM/occlusion heatmaps), not the PNG drawn from it. These
+artifacts are kept in compact form - run-length-encoded segment maps,
+bit-packed masks, uint8-quantized heatmaps - keyed by image content hash,
+model version and explainer parameters, so any panel layout or size can be
+rendered again without touching the model.
+"""
+import io
+import base64
+import math
+import threading
+
+import cv2
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')  # Use non-GUI backend for threading
+import matplotlib.pyplot as plt
+from django.conf import settings
+
+from .caching import ByteLRUCache
+from .explainers import PANEL_SIZE, lime_mask, render_panel
+
+LAYOUTS = ('row', 'column', 'grid')
+MAX_PANEL_SIZE = 1024
+
+# Rough per-entry bookkeeping cost on top of array payloads
+_ENTRY_OVERHEAD = 256
+
+
+def rle_encode(labels):
+    """Run-length encode an integer label map in row-major order."""
+    flat = labels.ravel()
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(flat)) + 1))
+    lengths = np.diff(np.concatenate((starts, [flat.size])))
+    return {
+        'shape': labels.shape,
+        'values': flat[starts].astype('uint16'),
+        'lengths': lengths.astype('uint32'),
+    }
+
+
+def rle_decode(rle):
+    return np.repeat(rle['values'].astype('int64'), rle['lengths']).reshape(rle['shape'])
+
+
+def pack_mask(mask):
+    return {'shape': mask.shape, 'bits': np.packbits(mask.astype(bool).ravel())}
+
+
+def unpack_mask(packed):
+    size = int(np.prod(packed['shape']))
+    return np.unpackbits(packed['bits'])[:size].reshape(packed['shape']).astype('int64')
+
+
+def quantize_heatmap(heatmap):
+    return np.round(np.clip(heatmap, 0, 1) * 255).astype('uint8')
+
+
+def dequantize_heatmap(quantized):
+    return quantized.astype('float32') / 255
+
+
+def compact_result(result):
+    """Convert an explainer result to its compact cached form."""
+    compact = {'name': result['name'], 'title': result['title'], 'label': result['label']}
+    if 'heatmap' in result:
+        compact['heatmap'] = quantize_heatmap(result['heatmap'])
+    else:
+        compact['segments'] = rle_encode(result['segments'])
+        compact['segment_ids'] = np.array([seg for seg, _ in result['weights']], dtype='uint16')
+        compact['segment_weights'] = np.array([w for _, w in result['weights']], dtype='float32')
+        compact['num_features'] = result['num_features']
+        compact['mask'] = pack_mask(lime_mask(result))
+    return compact
+
+
+def expand_result(compact):
+    """Inverse of compact_result(); the output is accepted by render_panel()."""
+    result = {'name': compact['name'], 'title': compact['title'], 'label': compact['label']}
+    if 'heatmap' in compact:
+        result['heatmap'] = dequantize_heatmap(compact['heatmap'])
+    else:
+        result['segments'] = rle_decode(compact['segments'])
+        result['weights'] = list(zip(compact['segment_ids'].tolist(), compact['segment_weights'].tolist()))
+        result['num_features'] = compact['num_features']
+        result['mask'] = unpack_mask(compact['mask'])
+    return result
+
+
+def artifact_nbytes(value):
+    """Approximate memory held by a cached artifact (array payloads plus overhead)."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return _ENTRY_OVERHEAD + sum(artifact_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(artifact_nbytes(v) for v in value)
+    return 8
+
+
+class ExplanationCache:
+    """Verdicts and compact explainer outputs keyed by (content hash, model version, params)."""
+
+    def __init__(self, max_bytes):
+        self._lru = ByteLRUCache(max_bytes, sizeof=artifact_nbytes)
+
+    def get_verdict(self, image_hash, version):
+        return self._lru.get(('verdict', image_hash, version))
+
+    def put_verdict(self, image_hash, version, probs, img, embedding=None):
+        verdict = {
+            'probs': np.asarray(probs, dtype='float32'),
+            # Model input kept as uint8 so LIME boundaries can be redrawn later
+            'input': np.round(img[0] * 255).astype('uint8'),
+        }
+        if embedding is not None:
+            verdict['embedding'] = np.asarray(embedding, dtype='float16')
+        self._lru.set(('verdict', image_hash, version), verdict)
+
+    def get_result(self, image_hash, version, explainer):
+        compact = self._lru.get(('explainer', image_hash, version, explainer.signature()))
+        return expand_result(compact) if compact is not None else None
+
+    def put_result(self, image_hash, version, explainer, result):
+        self._lru.set(('explainer', image_hash, version, explainer.signature()), compact_result(result))
+
+    def stats(self):
+        return self._lru.stats()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_explanation_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ExplanationCache(getattr(settings, 'EXPLANATION_CACHE_BYTES', 64 * 1024 * 1024))
+    return _cache
+
+
+def input_panel(image_bgr, status, size=PANEL_SIZE):
+    """The labelled input image shown as the first panel."""
+    image = cv2.resize(image_bgr, (size, size))
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    scale = size / float(PANEL_SIZE)
+    cv2.putText(image, status, (int(10 * scale), int(25 * scale)), cv2.FONT_HERSHEY_SIMPLEX,
+                0.7 * scale, (0, 0, 255), max(1, int(round(2 * scale))))
+    return image
+
+
+def render_explanation(first_panel, img, results, layout='row', size=PANEL_SIZE):
+    """Render the input panel plus one panel per explainer result to a base64 PNG."""
+    panels = [("Input Image", first_panel)]
+    panels += [(result['title'], render_panel(result, img, size)) for result in results]
+
+    count = len(panels)
+    if layout == 'column':
+        rows, cols = count, 1
+    elif layout == 'grid':
+        cols = int(math.ceil(math.sqrt(count)))
+        rows = int(math.ceil(count / float(cols)))
+    else:
+        rows, cols = 1, count
+    inches = 8 / 3.0 * size / float(PANEL_SIZE)
+    f, axarr = plt.subplots(rows, cols, figsize=(inches * cols, inches * rows))
+    # Close the figure even if rendering fails: pyplot keeps every open
+    # figure alive, which shows up as steady RSS growth in long-lived workers
+    try:
+        axes = np.atleast_1d(axarr).ravel()
+        for ax, (title, panel) in zip(axes, panels):
+            ax.imshow(panel)
+            ax.title.set_text(title)
+        for ax in axes[count:]:
+            ax.axis('off')
+        axes[-1].axis('off')
+        buf = io.BytesIO()
+        f.savefig(buf, format='png', bbox_inches='tight')
+    finally:
+        plt.close(f)
+    return base64.b64encode(buf.getvalue()).decode()
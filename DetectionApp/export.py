@@ -0,0 +1,134 @@
+"""
+Streaming export of AnalysisLog as CSV or JSON Lines.
+
+Rows are read with .iterator(chunk_size=...) so only one chunk of model
+instances is alive at a time, serialised into ~64 KB text blocks and
+optionally gzip-compressed block by block. The same generator feeds the
+admin export endpoint (StreamingHttpResponse) and `manage.py export_logs`.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, time as dt_time
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import AnalysisLog
+
+FORMATS = ('csv', 'jsonl')
+
+# Column name -> (model fields to load, value getter)
+COLUMNS = {
+    'id': (['id'], lambda log: log.id),
+    'timestamp': (['timestamp'], lambda log: log.timestamp.isoformat()),
+    'user_id': (['user'], lambda log: log.user_id),
+    'username': (['user__username'], lambda log: log.user.username),
+    'email': (['user__email'], lambda log: log.user.email),
+    'image_path': (['image_path'], lambda log: log.image_path),
+    'image_hash': (['image_hash'], lambda log: log.image_hash or ''),
+    'is_real': (['is_real'], lambda log: log.is_real),
+    'confidence': (['confidence'], lambda log: log.confidence),
+    'real_prob': (['real_prob'], lambda log: log.real_prob),
+    'fake_prob': (['fake_prob'], lambda log: log.fake_prob),
+    'explanation_text': (['explanation_text'], lambda log: log.explanation_text or ''),
+    # Base64 PNGs, tens of KB per row; only exported when asked for
+    'explanation_image': (['explanation_image'], lambda log: log.explanation_image or ''),
+}
+DEFAULT_COLUMNS = [name for name in COLUMNS if name != 'explanation_image']
+
+CHUNK_SIZE = 2000           # rows fetched per database round trip
+BLOCK_BYTES = 64 * 1024     # text buffered before a block is yielded
+
+
+def parse_columns(spec):
+    """'id,username,...' -> validated column list. Raises ValueError on unknown names."""
+    if not spec:
+        return list(DEFAULT_COLUMNS)
+    columns = [name.strip() for name in spec.split(',') if name.strip()]
+    unknown = [name for name in columns if name not in COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown column(s): {', '.join(unknown)}. Available: {', '.join(COLUMNS)}")
+    return columns
+
+
+def _parse_bound(value, end_of_day):
+    """ISO date or datetime -> aware datetime. A bare date covers the whole day."""
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f'Invalid date: {value}')
+        moment = datetime.combine(day, dt_time.max if end_of_day else dt_time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def export_queryset(columns, since=None, until=None, user=None):
+    """
+    AnalysisLog rows for an export, oldest first. `user` is a user id or
+    username; since/until are inclusive ISO dates or datetimes.
+    """
+    fields = {field for name in columns for field in COLUMNS[name][0]}
+    logs = AnalysisLog.objects.order_by('timestamp', 'id')
+    if any(field.startswith('user__') for field in fields):
+        # Join the user in the same query; the FK itself can't be deferred then
+        logs = logs.select_related('user')
+        fields.add('user')
+    logs = logs.only(*sorted(fields))
+    if since:
+        logs = logs.filter(timestamp__gte=_parse_bound(since, end_of_day=False))
+    if until:
+        logs = logs.filter(timestamp__lte=_parse_bound(until, end_of_day=True))
+    if user:
+        logs = logs.filter(user_id=int(user)) if str(user).isdigit() else logs.filter(user__username=user)
+    return logs
+
+
+def iter_export(logs, columns, fmt='csv', compress=False, chunk_size=CHUNK_SIZE):
+    """Yield the export as bytes blocks, one continuous gzip stream when compress is set."""
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    getters = [COLUMNS[name][1] for name in columns]
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == 'csv' else None
+
+    def take():
+        data = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+        return compressor.compress(data) if compressor else data
+
+    if writer:
+        writer.writerow(columns)
+    # Send the header straight away so clients see the first byte before
+    # the first chunk of rows has been fetched
+    block = take()
+    if block:
+        yield block
+
+    for log in logs.iterator(chunk_size=chunk_size):
+        values = [get(log) for get in getters]
+        if writer:
+            writer.writerow(values)
+        else:
+            buffer.write(json.dumps(dict(zip(columns, values))))
+            buffer.write('\n')
+        if buffer.tell() >= BLOCK_BYTES:
+            block = take()
+            if block:
+                yield block
+
+    block = take()
+    if compressor:
+        block += compressor.flush()
+    if block:
+        yield block
+
+
+def export_filename(fmt, compress):
+    name = f"analysis-log-{timezone.now().strftime('%Y%m%d-%H%M%S')}.{fmt}"
+    return name + '.gz' if compress else name
@@ -0,0 +1,102 @@
+"""
+Per-user cache of rendered /api/history responses.
+
+Each user has a version token in the Django cache. Anything that changes a
+user's history (a new analysis, a writer flush, clearing or deleting rows)
+calls bump_history_version(), which switches to a fresh token. Rendered
+JSON bodies are kept in a byte-bounded LRU keyed by (user id, token), and
+the token doubles as the response ETag, so a client revalidating with
+If-None-Match gets a 304 without a database query.
+
+Tokens are random rather than incrementing, so a version key evicted from
+the cache can never come back as an old ETag with different content.
+
+Tokens are only trustworthy when every worker process reads the same
+cache. With a per-process backend (LocMemCache, the default) a bump in one
+worker would leave the others serving stale bodies and 304s, so there the
+version is derived from the database instead: one indexed aggregate
+(row count, highest id, newest timestamp) per request, which changes with
+every insert and delete of the user's rows.
+"""
+import hashlib
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+
+from .caching import ByteLRUCache
+
+DEFAULT_HISTORY_CACHE = {
+    'MAX_BYTES': 32 * 1024 * 1024,  # rendered bodies include base64 explanation images
+    # 'cache': tokens in CACHES['default'], 'database': derived per request,
+    # 'auto': tokens only when the default cache is shared between processes
+    'VERSION_SOURCE': 'auto',
+}
+
+# Cache backends that are private to one process
+PROCESS_LOCAL_BACKENDS = ('LocMemCache', 'DummyCache')
+
+VERSION_KEY = 'history-version:{}'
+
+_bodies = None
+_bodies_lock = threading.Lock()
+
+
+def get_history_cache_config():
+    config = dict(DEFAULT_HISTORY_CACHE)
+    config.update(getattr(settings, 'HISTORY_CACHE', {}) or {})
+    return config
+
+
+def get_body_cache():
+    global _bodies
+    if _bodies is None:
+        with _bodies_lock:
+            if _bodies is None:
+                _bodies = ByteLRUCache(get_history_cache_config()['MAX_BYTES'])
+    return _bodies
+
+
+def uses_cache_tokens():
+    source = get_history_cache_config()['VERSION_SOURCE']
+    if source == 'auto':
+        backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+        return not backend.endswith(PROCESS_LOCAL_BACKENDS)
+    return source == 'cache'
+
+
+def history_version(user_id):
+    """Current version token for this user's history (see the module docstring)."""
+    if not uses_cache_tokens():
+        from .models import AnalysisLog
+        stats = AnalysisLog.objects.filter(user_id=user_id).aggregate(
+            rows=Count('id'), last_id=Max('id'), latest=Max('timestamp'))
+        state = f"{stats['rows']}:{stats['last_id']}:{stats['latest']}"
+        return hashlib.sha1(state.encode()).hexdigest()[:16]
+    key = VERSION_KEY.format(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex[:16], None)
+        version = cache.get(key)
+    return version
+
+
+def bump_history_version(*user_ids):
+    """Invalidate cached history for these users."""
+    if not user_ids or not uses_cache_tokens():
+        return
+    cache.set_many({VERSION_KEY.format(user_id): uuid.uuid4().hex[:16] for user_id in set(user_ids)}, None)
+
+
+def history_etag(user_id, version):
+    return f'"h{user_id}-{version}"'
+
+
+def get_body(user_id, version):
+    return get_body_cache().get((user_id, version))
+
+
+def put_body(user_id, version, body):
+    get_body_cache().set((user_id, version), body)
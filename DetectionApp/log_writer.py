@@ -0,0 +1,233 @@
+"""
+Write-behind writer for AnalysisLog.
+
+predict_api used to delete older rows with the same image hash, remove their
+files one by one and insert the new row, all on the request path against
+SQLite (which serialises writers). Records now go onto an in-process queue
+and a background thread flushes them in batches - by count or by time - in
+a single transaction: one DELETE for every replaced (user, hash) pair, one
+bulk_create, then one grouped release of the replaced rows' stored files.
+
+A batch that fails to write (e.g. "database is locked") goes back on the
+queue and is retried on the next flush, up to MAX_RETRIES times per record
+before it is dropped and logged. A dropped record gives back the storage
+reference its upload took, so retention can still collect the file.
+
+Records that are queued but not yet flushed are visible through
+pending_for(), which the history endpoints merge in so the submitting user
+reads their own writes. The backlog is per process, so this guarantee holds
+for requests served by the same worker; FLUSH_INTERVAL bounds the window
+for everyone else.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .history_cache import bump_history_version
+from .storage import release
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WRITER = {
+    'ENABLED': True,        # False writes synchronously on submit()
+    'MAX_BATCH': 50,        # flush once this many records are queued
+    'FLUSH_INTERVAL': 1.0,  # ... or once the oldest record is this many seconds old
+    'MAX_RETRIES': 5,       # failed writes of a record retried this often before it is dropped
+}
+
+# Bookkeeping keys of a queued record that are not AnalysisLog fields
+RECORD_META = ('timestamp', 'attempts')
+
+
+class AnalysisLogWriter:
+    def __init__(self, max_batch, flush_interval, enabled=True, max_retries=5):
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.enabled = enabled
+        self.max_retries = max_retries
+        self.flushed = 0
+        self.dropped = 0
+        self._queue = queue.Queue()
+        self._pending = {}          # user_id -> list of queued records, oldest first
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def submit(self, user_id, image_path, image_hash, **fields):
+        """
+        Queue one analysis for `user_id`. Any existing row of that user with
+        the same image hash is replaced (and its file released) at flush time.
+        """
+        record = dict(fields, user_id=user_id, image_path=image_path, image_hash=image_hash,
+                      timestamp=timezone.now(), attempts=0)
+        if not self.enabled:
+            with self._flush_lock:
+                self._write([record])
+            return
+        with self._pending_lock:
+            self._pending.setdefault(user_id, []).append(record)
+        self._queue.put(record)
+        self._ensure_thread()
+        if self._queue.qsize() >= self.max_batch:
+            self._wakeup.set()
+
+    def pending_for(self, user_id):
+        """Records queued for this user and not yet in the database, newest first."""
+        with self._pending_lock:
+            return list(reversed(self._pending.get(user_id, [])))
+
+    def backlog(self):
+        return self._queue.qsize()
+
+    def flush(self):
+        """
+        Write everything queued so far. When this returns, every record
+        submitted before the call is in the database. If the write fails the
+        batch is requeued (records past MAX_RETRIES are dropped) and the
+        error is raised.
+        """
+        with self._flush_lock:
+            records = []
+            while True:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not records:
+                return
+            try:
+                self._write(records)
+            except Exception:
+                self._requeue(records)
+                raise
+
+    def _requeue(self, records):
+        dropped = []
+        for record in records:
+            record['attempts'] += 1
+            if record['attempts'] > self.max_retries:
+                dropped.append(record)
+            else:
+                self._queue.put(record)
+        if dropped:
+            self.dropped += len(dropped)
+            logger.error('Dropped %d analysis log records after %d failed writes', len(dropped),
+                         self.max_retries + 1)
+            self._forget(dropped)
+            try:
+                release([record['image_path'] for record in dropped])
+            except Exception:
+                logger.exception('Could not release the files of dropped analysis log records')
+            bump_history_version(*{record['user_id'] for record in dropped})
+
+    def _forget(self, records):
+        """Remove written or dropped records from the pending view."""
+        with self._pending_lock:
+            for record in records:
+                user_records = self._pending.get(record['user_id'])
+                if user_records:
+                    user_records[:] = [r for r in user_records if r is not record]
+                    if not user_records:
+                        del self._pending[record['user_id']]
+
+    def close(self):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        # Each failure counts against the records' retries, so this ends
+        while self._queue.qsize():
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Analysis log flush failed during shutdown')
+                time.sleep(min(self.flush_interval, 1.0))
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._pending_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='analysis-log-writer', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        # Flush every FLUSH_INTERVAL, or early when submit() sees a full batch
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                # The batch was requeued; it is retried on the next pass
+                logger.exception('Analysis log flush failed')
+            finally:
+                close_old_connections()
+
+    def _write(self, records):
+        from . import rollups
+        from .models import AnalysisLog
+
+        # Within one batch the newest record for a (user, hash) wins; the
+        # files of the superseded ones are released with the rest. Requeued
+        # records may arrive after newer ones, so go by submission time
+        latest = {}
+        to_insert = []
+        superseded_files = []
+        for record in sorted(records, key=lambda r: r['timestamp']):
+            if not record['image_hash']:
+                to_insert.append(record)
+                continue
+            key = (record['user_id'], record['image_hash'])
+            if key in latest:
+                superseded_files.append(latest[key]['image_path'])
+            latest[key] = record
+        to_insert.extend(latest.values())
+
+        replace = Q()
+        for user_id, image_hash in latest:
+            replace |= Q(user_id=user_id, image_hash=image_hash)
+
+        old_files = []
+        with transaction.atomic():
+            if latest:
+                old = AnalysisLog.objects.filter(replace)
+                old_rows = list(old.values_list('image_path', *rollups.ROW_FIELDS))
+                old_files = [row[0] for row in old_rows]
+                old.delete()
+                rollups.record_deleted([row[1:] for row in old_rows])
+            created = AnalysisLog.objects.bulk_create([
+                AnalysisLog(**{k: v for k, v in record.items() if k not in RECORD_META})
+                for record in to_insert
+            ])
+            rollups.record_inserted(created)
+        release(old_files + superseded_files)
+        bump_history_version(*{record['user_id'] for record in records})
+        self.flushed += len(records)
+        self._forget(records)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                config = dict(DEFAULT_WRITER)
+                config.update(getattr(settings, 'ANALYSIS_LOG_WRITER', {}) or {})
+                _writer = AnalysisLogWriter(config['MAX_BATCH'], config['FLUSH_INTERVAL'], config['ENABLED'],
+                                            config['MAX_RETRIES'])
+                # Drain the queue on interpreter shutdown
+                atexit.register(_writer.close)
+    return _writer
@@ -0,0 +1,70 @@
+"""
+Analyze video clips from the command line, or benchmark frames per second.
+
+    python manage.py analyze_video clip.mp4 --stride 10
+    python manage.py analyze_video samples/*.mp4 --benchmark --json fps.json
+"""
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from DetectionApp import runtime
+
+
+class Command(BaseCommand):
+    help = 'Run sampled, batched frame inference over video clips'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+')
+        parser.add_argument('--stride', type=int)
+        parser.add_argument('--scene-threshold', type=float)
+        parser.add_argument('--batch-size', type=int)
+        parser.add_argument('--max-frames', type=int)
+        parser.add_argument('--benchmark', action='store_true', help='Only print frames/s per clip')
+        parser.add_argument('--json', dest='json_path', help='Write final results to this file')
+
+    def handle(self, *args, **options):
+        from django.conf import settings
+        from DetectionApp.video import analyze_video
+
+        model_path = settings.DETECTION_MODEL_PATH
+        if not os.path.exists(model_path):
+            raise CommandError(f'Model file not found: {model_path}')
+        model = runtime.get_model(model_path)
+
+        results = []
+        for path in options['paths']:
+            if not os.path.exists(path):
+                raise CommandError(f'No such file: {path}')
+            events = analyze_video(path, model, stride=options['stride'],
+                                   scene_threshold=options['scene_threshold'],
+                                   batch_size=options['batch_size'], max_frames=options['max_frames'])
+            with runtime.inference_context():
+                for event in events:
+                    if event['type'] == 'start' and not options['benchmark']:
+                        self.stdout.write(f"{path}: {event['total_frames']} frames at {event['fps']:.2f} fps")
+                    elif event['type'] == 'progress' and not options['benchmark']:
+                        expected = f"/{event['expected']}" if event['expected'] else ''
+                        self.stdout.write(
+                            f"  {event['scored']}{expected} frames  {event['frames_per_s']} fps  "
+                            f"running fake {event['running_fake_prob']:.1f}%"
+                        )
+                    elif event['type'] == 'result':
+                        event['path'] = path
+                        results.append(event)
+
+            result = results[-1]
+            verdict = 'Fake' if result['fake_prob'] > result['real_prob'] else 'Real'
+            if options['benchmark']:
+                self.stdout.write(f"{path}: {result['frames_scored']} frames in {result['elapsed_s']} s "
+                                  f"= {result['frames_per_s']} frames/s")
+            else:
+                self.stdout.write(self.style.SUCCESS(
+                    f"{path}: {verdict} (fake {result['fake_prob']:.1f}%, "
+                    f"{result['fake_frame_ratio'] * 100:.1f}% of frames flagged)"
+                ))
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(results, f, indent=2)
@@ -0,0 +1,207 @@
+"""
+Sweep worker process counts and per-process thread counts against a local
+load test and recommend the combination with the best throughput that still
+meets a latency target.
+
+    python manage.py autotune_workers --processes 1,2,4 --threads 1,2,4 --latency-target-ms 800
+"""
+import glob
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from DetectionApp import runtime
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(',') if v.strip()]
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _worker(index, config, image_paths, model_path, verdict_only, work_queue, results, barrier, timeout):
+    """Load-test worker: configure this process, warm up, then drain the work queue."""
+    # Export the candidate setting through the same environment variables the
+    # settings module reads, so the worker is configured exactly like a server
+    env = {
+        'DETECTION_TF_INTRA_OP_THREADS': config['TF_INTRA_OP_THREADS'],
+        'DETECTION_TF_INTER_OP_THREADS': config['TF_INTER_OP_THREADS'],
+        'DETECTION_CV2_THREADS': config['CV2_THREADS'],
+        'DETECTION_BLAS_THREADS': config['BLAS_THREADS'],
+        'DETECTION_CPU_AFFINITY': config['CPU_AFFINITY'],
+        'DETECTION_WORKER_INDEX': index,
+    }
+    for key, value in env.items():
+        os.environ[key] = str(value)
+    runtime.set_blas_env(config['BLAS_THREADS'])
+
+    import django
+    django.setup()
+    import cv2
+    from DetectionApp.views import classifyImage
+
+    model = runtime.get_model(model_path)
+    inputs = []
+    for path in image_paths:
+        image = cv2.imread(path)
+        if image is not None:
+            inputs.append(cv2.resize(image, (32, 32)).astype('float32').reshape(1, 32, 32, 3) / 255)
+    with runtime.inference_context():
+        model.predict(inputs[0])
+    try:
+        barrier.wait(timeout)
+    except threading.BrokenBarrierError:
+        return  # the parent gave up on this combination
+
+    while True:
+        item = work_queue.get()
+        if item is None:
+            break
+        started = time.perf_counter()
+        with runtime.inference_context():
+            if verdict_only:
+                model.predict(inputs[item % len(inputs)])
+            else:
+                classifyImage(image_paths[item % len(image_paths)], model)
+        results.put(time.perf_counter() - started)
+
+
+class Command(BaseCommand):
+    help = 'Sweep processes x threads on a local load test and recommend a worker topology'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', default='1,2,4', help='Comma separated worker process counts')
+        parser.add_argument('--threads', default='1,2,4', help='Comma separated per-process thread counts')
+        parser.add_argument('--inter-op-threads', type=int, default=1)
+        parser.add_argument('--requests', type=int, default=48, help='Requests per combination')
+        parser.add_argument('--latency-target-ms', type=float, default=1000.0, help='p95 latency target')
+        parser.add_argument('--images', default='testImages', help='Directory of sample images')
+        parser.add_argument('--pin', action='store_true', help='Pin each worker to its own CPU slice')
+        parser.add_argument('--verdict-only', action='store_true', help='Skip Grad-CAM/LIME/rendering')
+        parser.add_argument('--json', dest='json_path', help='Write all measurements to this file')
+        parser.add_argument('--timeout', type=float, default=300.0,
+                            help='Seconds to wait for workers to start, and for each result')
+
+    def handle(self, *args, **options):
+        from django.conf import settings
+
+        image_paths = sorted(
+            p for p in glob.glob(os.path.join(options['images'], '*'))
+            if os.path.splitext(p)[1].lower() in ('.jpg', '.jpeg', '.png', '.tif', '.bmp')
+        )
+        if not image_paths:
+            raise CommandError(f"No sample images found in {options['images']}")
+        import cv2
+        image_paths = [p for p in image_paths if cv2.imread(p) is not None]
+        if not image_paths:
+            raise CommandError(f"None of the sample images in {options['images']} could be decoded")
+        model_path = settings.DETECTION_MODEL_PATH
+        if not os.path.exists(model_path):
+            raise CommandError(f'Model file not found: {model_path}')
+
+        cpu_count = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+        ctx = multiprocessing.get_context('spawn')
+        measurements = []
+
+        for processes in _int_list(options['processes']):
+            for threads in _int_list(options['threads']):
+                if processes * threads > cpu_count * 2:
+                    self.stdout.write(f'skip {processes}x{threads}: oversubscribes {cpu_count} CPUs')
+                    continue
+                config = {
+                    'TF_INTRA_OP_THREADS': threads,
+                    'TF_INTER_OP_THREADS': options['inter_op_threads'],
+                    'CV2_THREADS': threads,
+                    'BLAS_THREADS': threads,
+                    'CPU_AFFINITY': 'auto' if options['pin'] else '',
+                }
+                result = self._run(ctx, processes, config, image_paths, model_path, options)
+                measurements.append(result)
+                self.stdout.write(
+                    f"{processes:>3} proc x {threads:>2} thr  "
+                    f"{result['throughput']:8.2f} req/s  "
+                    f"p50 {result['p50_ms']:8.1f} ms  p95 {result['p95_ms']:8.1f} ms"
+                )
+
+        if not measurements:
+            raise CommandError('No combination was run')
+
+        target = options['latency_target_ms']
+        eligible = [m for m in measurements if m['p95_ms'] <= target]
+        if eligible:
+            best = max(eligible, key=lambda m: m['throughput'])
+        else:
+            self.stdout.write(self.style.WARNING(f'No combination met p95 <= {target:.0f} ms; picking lowest latency'))
+            best = min(measurements, key=lambda m: m['p95_ms'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Recommended: {best['processes']} worker processes, {best['threads']} threads each "
+            f"({best['throughput']:.2f} req/s, p95 {best['p95_ms']:.1f} ms)"
+        ))
+        self.stdout.write(f"  DETECTION_TF_INTRA_OP_THREADS={best['threads']}")
+        self.stdout.write(f"  DETECTION_TF_INTER_OP_THREADS={options['inter_op_threads']}")
+        self.stdout.write(f"  DETECTION_CV2_THREADS={best['threads']}")
+        self.stdout.write(f"  DETECTION_BLAS_THREADS={best['threads']}")
+        if options['pin']:
+            self.stdout.write('  DETECTION_CPU_AFFINITY=auto  (set DETECTION_WORKER_INDEX per worker)')
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump({'latency_target_ms': target, 'recommended': best, 'measurements': measurements}, f, indent=2)
+
+    def _run(self, ctx, processes, config, image_paths, model_path, options):
+        work_queue = ctx.Queue()
+        results = ctx.Queue()
+        barrier = ctx.Barrier(processes + 1)
+        for i in range(options['requests']):
+            work_queue.put(i)
+        for _ in range(processes):
+            work_queue.put(None)
+
+        workers = [
+            ctx.Process(target=_worker, args=(i, config, image_paths, model_path,
+                                              options['verdict_only'], work_queue, results, barrier,
+                                              options['timeout']))
+            for i in range(processes)
+        ]
+        for w in workers:
+            w.start()
+        # A worker that dies (OOM, unloadable model) never reaches the barrier
+        # or never reports; give up on the combination instead of hanging
+        try:
+            barrier.wait(options['timeout'])
+            started = time.perf_counter()
+            latencies = [results.get(timeout=options['timeout']) for _ in range(options['requests'])]
+        except (threading.BrokenBarrierError, queue.Empty):
+            barrier.abort()
+            for w in workers:
+                w.terminate()
+            for w in workers:
+                w.join()
+            exit_codes = ', '.join(str(w.exitcode) for w in workers)
+            raise CommandError(f"{processes} proc x {config['TF_INTRA_OP_THREADS']} thr: workers stalled or "
+                               f"died (exit codes {exit_codes}); no result within {options['timeout']:.0f}s")
+        wall = time.perf_counter() - started
+        for w in workers:
+            w.join()
+
+        return {
+            'processes': processes,
+            'threads': config['TF_INTRA_OP_THREADS'],
+            'requests': options['requests'],
+            'wall_s': wall,
+            'throughput': options['requests'] / wall if wall else 0.0,
+            'p50_ms': _percentile(latencies, 50) * 1000,
+            'p95_ms': _percentile(latencies, 95) * 1000,
+        }
@@ -0,0 +1,80 @@
+"""
+Throughput of the tiled scanning mode against image size.
+
+    python manage.py benchmark_scan --sizes 512x512,1024x768,2048x1536,4000x3000
+"""
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from DetectionApp import runtime
+
+
+def _parse_sizes(value):
+    sizes = []
+    for item in value.split(','):
+        width, _, height = item.strip().partition('x')
+        sizes.append((int(width), int(height or width)))
+    return sizes
+
+
+class Command(BaseCommand):
+    help = 'Benchmark tiled multi-scale scanning throughput against image size'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='512x512,1024x768,2048x1536,4000x3000')
+        parser.add_argument('--image', default='testImages/1.jpg', help='Source image, resized to each size')
+        parser.add_argument('--stride', type=int)
+        parser.add_argument('--scales', help='Comma separated scales, e.g. 1,0.5,0.25')
+        parser.add_argument('--max-patches', type=int)
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--json', dest='json_path')
+
+    def handle(self, *args, **options):
+        import cv2
+        from django.conf import settings
+        from DetectionApp.scanning import scan_image
+
+        source = cv2.imread(options['image'])
+        if source is None:
+            raise CommandError(f"Cannot read {options['image']}")
+        model_path = settings.DETECTION_MODEL_PATH
+        if not os.path.exists(model_path):
+            raise CommandError(f'Model file not found: {model_path}')
+        model = runtime.get_model(model_path)
+        scales = [float(v) for v in options['scales'].split(',')] if options['scales'] else None
+
+        rows = []
+        with runtime.inference_context():
+            # Warm up the predict function outside the timed region
+            scan_image(cv2.resize(source, (64, 64)), model)
+            for width, height in _parse_sizes(options['sizes']):
+                image = cv2.resize(source, (width, height), interpolation=cv2.INTER_CUBIC)
+                timings = []
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    scan = scan_image(image, model, stride=options['stride'], scales=scales,
+                                      max_patches=options['max_patches'])
+                    timings.append(time.perf_counter() - started)
+                best = min(timings)
+                row = {
+                    'width': width,
+                    'height': height,
+                    'megapixels': round(width * height / 1e6, 2),
+                    'patches': scan['patches'],
+                    'best_ms': round(best * 1000, 1),
+                    'mean_ms': round(sum(timings) / len(timings) * 1000, 1),
+                    'patches_per_s': round(scan['patches'] / best, 1),
+                    'images_per_s': round(1 / best, 2),
+                }
+                rows.append(row)
+                self.stdout.write(
+                    f"{width:>5}x{height:<5} {row['megapixels']:6.2f} MP  {row['patches']:6d} patches  "
+                    f"{row['best_ms']:9.1f} ms  {row['patches_per_s']:10.1f} patches/s"
+                )
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(rows, f, indent=2)
@@ -0,0 +1,51 @@
+"""
+Export AnalysisLog for audits, streaming rows so memory stays flat.
+
+    python manage.py export_logs --format jsonl --gzip --output audit.jsonl.gz
+    python manage.py export_logs --since 2026-01-01 --until 2026-03-31 --user alice --columns id,timestamp,is_real
+"""
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from DetectionApp import export
+
+
+class Command(BaseCommand):
+    help = 'Stream AnalysisLog rows to CSV or JSON Lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=export.FORMATS, default='csv')
+        parser.add_argument('--output', help='File to write (default: stdout)')
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--since', help='Inclusive start date or datetime (ISO)')
+        parser.add_argument('--until', help='Inclusive end date or datetime (ISO)')
+        parser.add_argument('--user', help='User id or username')
+        parser.add_argument('--columns', help=f"Comma-separated, from: {', '.join(export.COLUMNS)}")
+        parser.add_argument('--chunk-size', type=int, default=export.CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        from DetectionApp.log_writer import get_writer
+
+        try:
+            columns = export.parse_columns(options['columns'])
+            logs = export.export_queryset(columns, since=options['since'], until=options['until'],
+                                          user=options['user'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        get_writer().flush()
+        out = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        written = 0
+        try:
+            for block in export.iter_export(logs, columns, options['format'], options['gzip'],
+                                            chunk_size=options['chunk_size']):
+                out.write(block)
+                written += len(block)
+        finally:
+            if options['output']:
+                out.close()
+            else:
+                out.flush()
+        if options['output']:
+            self.stderr.write(f"Wrote {written / 1e6:.1f} MB to {options['output']}")
@@ -0,0 +1,24 @@
+"""
+Run one upload retention pass: prune analyses past the TTL and remove
+orphaned files in bulk.
+
+    python manage.py gc_uploads --dry-run
+"""
+from django.core.management.base import BaseCommand
+
+from DetectionApp import storage
+
+
+class Command(BaseCommand):
+    help = 'Garbage-collect orphaned upload files and apply the retention TTL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be removed')
+
+    def handle(self, *args, **options):
+        stats = storage.run_retention(dry_run=options['dry_run'])
+        prefix = 'Would remove' if options['dry_run'] else 'Removed'
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix} {stats['files_removed']} files ({stats['bytes_freed'] / 1e6:.1f} MB); "
+            f"pruned {stats['pruned_analyses']} expired analyses"
+        ))
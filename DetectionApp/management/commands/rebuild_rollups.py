@@ -0,0 +1,38 @@
+"""
+Recompute AnalysisRollup from AnalysisLog, e.g. after deploying the rollup
+table on an existing database or after editing rows by hand.
+
+    python manage.py rebuild_rollups
+    python manage.py rebuild_rollups --user alice
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the analytics rollups from AnalysisLog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', help='Username or id (repeatable); default all users')
+
+    def handle(self, *args, **options):
+        from django.contrib.auth.models import User
+        from DetectionApp import rollups
+        from DetectionApp.log_writer import get_writer
+
+        user_ids = None
+        if options['user']:
+            user_ids = []
+            for name in options['user']:
+                user = User.objects.filter(id=int(name)).first() if name.isdigit() \
+                    else User.objects.filter(username=name).first()
+                if user is None:
+                    raise CommandError(f'No such user: {name}')
+                user_ids.append(user.id)
+
+        get_writer().flush()
+        started = time.perf_counter()
+        rebuilt = rollups.rebuild(user_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt rollups for {rebuilt} users in {time.perf_counter() - started:.1f} s'))
@@ -0,0 +1,295 @@
+"""
+Audit a whole directory tree of images offline.
+
+Files are walked in a stable order, hashed and decoded in a process pool,
+scored in batches, and written to CSV or JSON Lines (optionally also to
+AnalysisLog via bulk_create). A checkpoint is written after every batch so
+an interrupted scan resumes where it stopped, and content already scored
+(same hash) is skipped.
+
+    python manage.py scan_directory /data/images --output audit.jsonl
+    python manage.py scan_directory /data/images --output audit.csv --resume --log-user admin
+"""
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from DetectionApp import runtime, storage
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp'}
+FIELDS = ['path', 'image_hash', 'status', 'is_real', 'confidence', 'real_prob', 'fake_prob',
+          'explanation_image', 'error']
+
+
+def walk_images(root, after=None):
+    """
+    Depth-first walk in sorted order. With `after` (a path an earlier walk
+    yielded) it starts just past that path, skipping whole directories that
+    sort before it, so a resumed scan neither skips nor repeats files when
+    the tree changed in between.
+    """
+    parts = os.path.relpath(os.path.abspath(after), os.path.abspath(root)).split(os.sep) if after else None
+    return _walk(root, parts)
+
+
+def _walk(directory, after):
+    try:
+        entries = sorted(os.scandir(directory), key=lambda e: e.name)
+    except OSError:
+        return
+    for entry in entries:
+        is_dir = entry.is_dir(follow_symlinks=False)
+        if after:
+            if entry.name < after[0]:
+                continue
+            matched, remaining, after = entry.name == after[0], after[1:], None
+            if matched:
+                if is_dir and remaining:
+                    yield from _walk(entry.path, remaining)
+                continue  # the file itself was scored by the earlier run
+        if is_dir:
+            yield from _walk(entry.path, None)
+        elif os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS:
+            yield entry.path
+
+
+def _decode(args):
+    """Pool worker: hash the bytes and build the 32x32 input (plus a preview when explaining)."""
+    path, want_preview = args
+    import cv2
+    import numpy as np
+    try:
+        with open(path, 'rb') as f:
+            content = f.read()
+        image_hash = hashlib.sha256(content).hexdigest()
+        image = cv2.imdecode(np.frombuffer(content, dtype='uint8'), cv2.IMREAD_COLOR)
+        if image is None:
+            return path, image_hash, None, None, 'Could not decode image'
+        preview = cv2.resize(image, (150, 150)) if want_preview else None
+        return path, image_hash, cv2.resize(image, (32, 32)), preview, None
+    except OSError as e:
+        return path, None, None, None, str(e)
+
+
+class Command(BaseCommand):
+    help = 'Scan a directory tree with batched inference, resumable via checkpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('root')
+        parser.add_argument('--output', required=True, help='Results file (.csv or .jsonl)')
+        parser.add_argument('--format', choices=['csv', 'jsonl'])
+        parser.add_argument('--batch-size', type=int, default=256)
+        parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) - 1))
+        parser.add_argument('--explain', help='Explainers to run per image, e.g. gradcam')
+        parser.add_argument('--log-user', help='Also insert rows into AnalysisLog for this username')
+        parser.add_argument('--resume', action='store_true', help='Continue from the checkpoint')
+        parser.add_argument('--no-count', action='store_true', help='Skip the initial file count (no ETA)')
+
+    def handle(self, *args, **options):
+        from django.conf import settings
+        from django.contrib.auth.models import User
+        from DetectionApp.explainers import parse_explainer_names, EXPLAINERS
+
+        root = options['root']
+        if not os.path.isdir(root):
+            raise CommandError(f'Not a directory: {root}')
+        output = options['output']
+        fmt = options['format'] or ('csv' if output.lower().endswith('.csv') else 'jsonl')
+        checkpoint_path = output + '.checkpoint.json'
+        model_path = settings.DETECTION_MODEL_PATH
+        if not os.path.exists(model_path):
+            raise CommandError(f'Model file not found: {model_path}')
+
+        explainers = []
+        if options['explain']:
+            try:
+                explainers = [EXPLAINERS[name] for name in parse_explainer_names(options['explain'])]
+            except ValueError as e:
+                raise CommandError(str(e))
+
+        user = None
+        if options['log_user']:
+            try:
+                user = User.objects.get(username=options['log_user'])
+            except User.DoesNotExist:
+                raise CommandError(f"No such user: {options['log_user']}")
+
+        checkpoint = {'root': os.path.abspath(root), 'done': 0, 'last_path': None}
+        if options['resume'] and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as f:
+                checkpoint = json.load(f)
+            if checkpoint['root'] != os.path.abspath(root):
+                raise CommandError(f"Checkpoint belongs to {checkpoint['root']}")
+        elif os.path.exists(output) and not options['resume']:
+            raise CommandError(f'{output} exists; pass --resume to continue or remove it')
+
+        seen = self._load_seen_hashes(output, fmt, user) if options['resume'] or user else set()
+
+        total = None
+        if not options['no_count']:
+            self.stdout.write('Counting files...')
+            total = sum(1 for _ in walk_images(root))
+
+        model = runtime.get_model(model_path)
+        out = open(output, 'a', newline='')
+        writer = csv.DictWriter(out, fieldnames=FIELDS) if fmt == 'csv' else None
+        if writer and out.tell() == 0:
+            writer.writeheader()
+
+        paths = walk_images(root, after=checkpoint['last_path'])
+
+        started = time.perf_counter()
+        done_this_run = 0
+        scored = skipped = failed = 0
+        batch = []
+        ctx = multiprocessing.get_context('spawn')
+        with ctx.Pool(options['workers']) as pool:
+            decoded = pool.imap(_decode, ((p, bool(explainers)) for p in paths), chunksize=16)
+            for item in decoded:
+                batch.append(item)
+                if len(batch) >= options['batch_size']:
+                    counts = self._process(batch, model, explainers, seen, writer, out, fmt, user)
+                    scored, skipped, failed = scored + counts[0], skipped + counts[1], failed + counts[2]
+                    done_this_run += len(batch)
+                    self._checkpoint(checkpoint_path, checkpoint, batch, out)
+                    batch = []
+                    self._report(checkpoint['done'], total, done_this_run, started, scored, skipped, failed)
+            if batch:
+                counts = self._process(batch, model, explainers, seen, writer, out, fmt, user)
+                scored, skipped, failed = scored + counts[0], skipped + counts[1], failed + counts[2]
+                done_this_run += len(batch)
+                self._checkpoint(checkpoint_path, checkpoint, batch, out)
+                self._report(checkpoint['done'], total, done_this_run, started, scored, skipped, failed)
+        out.close()
+        sys.stdout.write('\n')
+        self.stdout.write(self.style.SUCCESS(
+            f'Done: {scored} scored, {skipped} duplicates skipped, {failed} failed '
+            f'in {time.perf_counter() - started:.1f} s'))
+
+    def _load_seen_hashes(self, output, fmt, user):
+        """Content hashes already scored, as 16-byte digests to keep millions of them cheap."""
+        from DetectionApp.models import AnalysisLog
+        seen = set()
+        if os.path.exists(output):
+            with open(output, newline='') as f:
+                rows = csv.DictReader(f) if fmt == 'csv' else (json.loads(line) for line in f if line.strip())
+                for row in rows:
+                    if row.get('image_hash') and not row.get('error'):
+                        seen.add(bytes.fromhex(row['image_hash']))
+        if user is not None:
+            hashes = AnalysisLog.objects.filter(user=user).exclude(image_hash__isnull=True) \
+                .values_list('image_hash', flat=True).iterator(chunk_size=10000)
+            for image_hash in hashes:
+                try:
+                    seen.add(bytes.fromhex(image_hash))
+                except ValueError:
+                    pass
+        return seen
+
+    def _process(self, batch, model, explainers, seen, writer, out, fmt, user):
+        import numpy as np
+        from DetectionApp.explanation_cache import input_panel, render_explanation
+        from DetectionApp import rollups
+        from DetectionApp.history_cache import bump_history_version
+        from DetectionApp.models import AnalysisLog
+        from DetectionApp.views import getVerdict
+
+        rows = []
+        todo = []
+        for path, image_hash, small, preview, error in batch:
+            if error:
+                rows.append({'path': path, 'image_hash': image_hash or '', 'error': error})
+                continue
+            digest = bytes.fromhex(image_hash)
+            if digest in seen:
+                continue
+            seen.add(digest)
+            todo.append((path, image_hash, small, preview))
+
+        if todo:
+            inputs = np.stack([small for _, _, small, _ in todo]).astype('float32') / 255
+            with runtime.inference_context():
+                probs = model.predict(inputs, batch_size=len(inputs))
+                for i, (path, image_hash, small, preview) in enumerate(todo):
+                    real_prob = float(probs[i][1])
+                    status, is_real, confidence = getVerdict(real_prob)
+                    explanation_image = ''
+                    if explainers:
+                        img = inputs[i:i + 1]
+                        results = [e.explain(img, model, probs[i]) for e in explainers]
+                        explanation_image = render_explanation(input_panel(preview, status), img, results)
+                    rows.append({
+                        'path': path, 'image_hash': image_hash, 'status': status, 'is_real': is_real,
+                        'confidence': confidence, 'real_prob': real_prob * 100,
+                        'fake_prob': float(probs[i][0]) * 100, 'explanation_image': explanation_image,
+                        'error': '',
+                    })
+
+        for row in rows:
+            if writer:
+                writer.writerow({k: row.get(k, '') for k in FIELDS})
+            else:
+                out.write(json.dumps(row) + '\n')
+
+        scored_rows = [r for r in rows if not r.get('error')]
+        if user is not None and scored_rows:
+            # Log rows reference a stored copy, never the audited file itself:
+            # releasing a log deletes the file its image_path points at
+            stored = [self._store_copy(r['path'], r['image_hash']) for r in scored_rows]
+            try:
+                created = AnalysisLog.objects.bulk_create([
+                    AnalysisLog(user=user, image_path=image_path, is_real=r['is_real'],
+                                confidence=r['confidence'], real_prob=r['real_prob'], fake_prob=r['fake_prob'],
+                                explanation_image=r['explanation_image'],
+                                explanation_text='Offline directory scan', image_hash=r['image_hash'])
+                    for r, image_path in zip(scored_rows, stored)
+                ], batch_size=500)
+            except Exception:
+                storage.release(stored)
+                raise
+            rollups.record_inserted(created)
+            bump_history_version(user.id)
+        failed = len(rows) - len(scored_rows)
+        return len(scored_rows), len(batch) - len(rows), failed
+
+    def _store_copy(self, path, image_hash):
+        """
+        Content-addressed copy of a scanned file for its AnalysisLog row; ''
+        when the file can't be re-read or changed since it was hashed.
+        """
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+        except OSError:
+            return ''
+        if hashlib.sha256(content).hexdigest() != image_hash:
+            return ''
+        return storage.store(content, os.path.splitext(path)[1], digest=image_hash)
+
+    def _checkpoint(self, checkpoint_path, checkpoint, batch, out):
+        # Results hit the disk before the checkpoint that claims them
+        out.flush()
+        os.fsync(out.fileno())
+        checkpoint['done'] += len(batch)
+        checkpoint['last_path'] = batch[-1][0]
+        tmp = checkpoint_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp, checkpoint_path)
+
+    def _report(self, done, total, done_this_run, started, scored, skipped, failed):
+        elapsed = time.perf_counter() - started
+        rate = done_this_run / elapsed if elapsed else 0.0
+        line = f'\r{done}'
+        if total:
+            eta = (total - done) / rate if rate else 0
+            line += f'/{total} ({done * 100.0 / total:.1f}%)  ETA {int(eta // 60)}m{int(eta % 60):02d}s'
+        line += f'  {rate:.1f} files/s  scored {scored}  dup {skipped}  failed {failed}'
+        sys.stdout.write(line)
+        sys.stdout.flush()
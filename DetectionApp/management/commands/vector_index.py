@@ -0,0 +1,69 @@
+"""
+Maintain the similar-image vector index (DetectionApp/vector_index.py).
+
+    python manage.py vector_index stats
+    python manage.py vector_index build --batch-size 256   # backfill stored uploads
+    python manage.py vector_index train --lists 1024       # partition for large indexes
+    python manage.py vector_index compact                  # drop deleted rows
+"""
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from DetectionApp import runtime, storage, vector_index
+from DetectionApp.models import StoredImage
+
+
+class Command(BaseCommand):
+    help = 'Build, partition, compact or inspect the similar-image vector index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['stats', 'build', 'train', 'compact'])
+        parser.add_argument('--batch-size', type=int, default=256, help='Images per forward pass (build)')
+        parser.add_argument('--lists', type=int, help='IVF partitions (train); default about sqrt(vectors)')
+
+    def handle(self, *args, **options):
+        index = vector_index.get_index()
+        action = options['action']
+        if action == 'build':
+            self.build(index, options['batch_size'])
+        elif action == 'train':
+            lists = index.train(lists=options['lists'])
+            if not lists:
+                raise CommandError('Nothing to train: the index is empty')
+            self.stdout.write(self.style.SUCCESS(f'Partitioned the index into {lists} lists'))
+        elif action == 'compact':
+            self.stdout.write(self.style.SUCCESS(f'Dropped {index.compact()} deleted rows'))
+        for key, value in index.stats().items():
+            self.stdout.write(f'{key}: {value}')
+
+    def build(self, index, batch_size):
+        """Embed every referenced upload that isn't indexed yet, in batched forward passes."""
+        model = runtime.get_model(settings.DETECTION_MODEL_PATH)
+        dual = runtime.get_embedding_model(model)
+        images = StoredImage.objects.filter(ref_count__gt=0).order_by('id').values_list('id', 'digest', 'path')
+        added = skipped = last_id = 0
+        while True:
+            rows = list(images.filter(id__gt=last_id)[:batch_size])
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            indexed = {bytes(index.keys[row]).hex() for row in index.rows_for([digest for _, digest, _ in rows])}
+            digests, batch = [], []
+            for _, digest, path in rows:
+                if digest in indexed:
+                    continue
+                image = cv2.imread(storage.absolute_path(path))
+                if image is None:
+                    skipped += 1
+                    continue
+                digests.append(digest)
+                batch.append(cv2.resize(image, (32, 32)))
+            if not batch:
+                continue
+            with runtime.inference_context():
+                _, embeddings = dual.predict(np.asarray(batch, dtype='float32') / 255, batch_size=len(batch))
+            added += index.add_many(digests, embeddings)
+            self.stdout.write(f'Indexed {added} images so far')
+        self.stdout.write(self.style.SUCCESS(f'Added {added} vectors ({skipped} unreadable files skipped)'))
@@ -0,0 +1,234 @@
+"""
+Per-process memory accounting for long-running workers.
+
+MemoryAccountingMiddleware samples RSS (and the traced Python heap when
+MEMORY_ACCOUNTING['TRACEMALLOC'] is on) before and after every request and
+keeps per-endpoint deltas, alongside the TF graph node counts runtime.py
+records after each inference and the number of open matplotlib figures.
+/api/admin/metrics reports them for the worker that serves the call.
+
+Once WARMUP_REQUESTS have been served (model loaded, caches filling) the
+RSS becomes the baseline. Every further GROWTH_WARN_MB above it logs the
+top allocation sites since the baseline. With RECYCLE_AFTER_REQUESTS or
+RECYCLE_AFTER_GROWTH_MB set, the worker sends itself RECYCLE_SIGNAL once
+the current response has finished, so a process manager such as gunicorn
+replaces it gracefully. Leave both at 0 under runserver.
+
+Deltas are per process: with a threaded server, concurrent requests share
+the process and each is charged for whatever changed while it ran.
+"""
+import gc
+import logging
+import os
+import signal
+import sys
+import threading
+import tracemalloc
+
+from django.conf import settings
+
+from . import runtime
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEMORY_ACCOUNTING = {
+    'ENABLED': True,
+    'TRACEMALLOC': False,           # trace the Python heap; adds per-allocation overhead
+    'TRACEMALLOC_FRAMES': 10,
+    'WARMUP_REQUESTS': 20,          # requests served before the RSS baseline is taken
+    'GROWTH_WARN_MB': 100,          # log allocation sites at every step of this much growth
+    'TOP_ALLOCATIONS': 15,
+    'RECYCLE_AFTER_REQUESTS': 0,    # 0 = never
+    'RECYCLE_AFTER_GROWTH_MB': 0,   # 0 = never
+    'RECYCLE_SIGNAL': 'SIGTERM',
+}
+
+MB = 1024.0 * 1024.0
+
+_accountant = None
+_accountant_lock = threading.Lock()
+
+
+def get_memory_config():
+    config = dict(DEFAULT_MEMORY_ACCOUNTING)
+    config.update(getattr(settings, 'MEMORY_ACCOUNTING', {}) or {})
+    return config
+
+
+def rss_bytes():
+    """Current resident set size; the peak RSS where /proc is unavailable."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def open_figures():
+    pyplot = sys.modules.get('matplotlib.pyplot')
+    return len(pyplot.get_fignums()) if pyplot is not None else 0
+
+
+def _total_nodes(counts):
+    return sum(counts.values())
+
+
+class MemoryAccountant:
+    """Per-endpoint memory deltas and growth checks for this process."""
+
+    def __init__(self, config):
+        self.config = config
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.endpoints = {}
+        self.started_rss = rss_bytes()
+        self.baseline_rss = None
+        self.baseline_snapshot = None
+        self.warned_steps = 0
+        self.recycle_reason = None
+        self.recycle_sent = False
+        if config['TRACEMALLOC'] and not tracemalloc.is_tracing():
+            tracemalloc.start(config['TRACEMALLOC_FRAMES'])
+
+    def before(self):
+        heap = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+        return rss_bytes(), heap, _total_nodes(runtime.graph_nodes())
+
+    def after(self, label, sample, request_bytes=0):
+        rss_before, heap_before, nodes_before = sample
+        rss = rss_bytes()
+        heap = tracemalloc.get_traced_memory()[0] if heap_before is not None and tracemalloc.is_tracing() else None
+        rss_delta = rss - rss_before
+        heap_delta = heap - heap_before if heap is not None else 0
+        nodes_delta = _total_nodes(runtime.graph_nodes()) - nodes_before
+
+        with self._lock:
+            entry = self.endpoints.setdefault(label, {
+                'requests': 0, 'rss_delta_total': 0, 'rss_delta_max': 0, 'heap_delta_total': 0,
+                'heap_delta_max': 0, 'graph_nodes_added': 0, 'request_bytes_total': 0,
+            })
+            entry['requests'] += 1
+            entry['rss_delta_total'] += rss_delta
+            entry['rss_delta_max'] = max(entry['rss_delta_max'], rss_delta)
+            entry['heap_delta_total'] += heap_delta
+            entry['heap_delta_max'] = max(entry['heap_delta_max'], heap_delta)
+            entry['graph_nodes_added'] += nodes_delta
+            entry['request_bytes_total'] += request_bytes
+
+            self.requests += 1
+            if self.baseline_rss is None:
+                if self.requests >= self.config['WARMUP_REQUESTS']:
+                    self.baseline_rss = rss
+                    if tracemalloc.is_tracing():
+                        self.baseline_snapshot = tracemalloc.take_snapshot()
+                return
+            growth_mb = (rss - self.baseline_rss) / MB
+            warn_step = self.config['GROWTH_WARN_MB']
+            steps = int(growth_mb // warn_step) if warn_step else 0
+            warn = steps > self.warned_steps
+            if warn:
+                self.warned_steps = steps
+            if self.recycle_reason is None:
+                self.recycle_reason = self._recycle_reason(growth_mb)
+
+        if warn:
+            self._log_growth(growth_mb, label)
+
+    def _recycle_reason(self, growth_mb):
+        max_requests = self.config['RECYCLE_AFTER_REQUESTS']
+        max_growth = self.config['RECYCLE_AFTER_GROWTH_MB']
+        if max_requests and self.requests >= max_requests:
+            return f'served {self.requests} requests'
+        if max_growth and growth_mb >= max_growth:
+            return f'RSS grew {growth_mb:.0f} MB past the baseline'
+        return None
+
+    def _log_growth(self, growth_mb, label):
+        lines = [f'{site["size_kb"]:>10.1f} KB {site["count"]:>8} blocks  {site["site"]}'
+                 for site in self.top_allocations()]
+        logger.warning(
+            'Worker %s RSS is %.0f MB above its baseline after %d requests (last: %s); graph nodes %s, '
+            'open figures %d%s', os.getpid(), growth_mb, self.requests, label, runtime.graph_nodes(),
+            open_figures(), ('\nTop allocation sites since baseline:\n' + '\n'.join(lines)) if lines else
+            ' (set MEMORY_ACCOUNTING TRACEMALLOC for allocation sites)')
+
+    def top_allocations(self, limit=None):
+        """Allocation sites that grew most since the baseline (or since tracing began)."""
+        if not tracemalloc.is_tracing():
+            return []
+        ignore = (tracemalloc.Filter(False, tracemalloc.__file__),
+                  tracemalloc.Filter(False, '<frozen importlib._bootstrap>'))
+        snapshot = tracemalloc.take_snapshot().filter_traces(ignore)
+        if self.baseline_snapshot is not None:
+            stats = snapshot.compare_to(self.baseline_snapshot.filter_traces(ignore), 'lineno')
+            sites = [(stat.traceback, stat.size_diff, stat.count_diff) for stat in stats]
+        else:
+            sites = [(stat.traceback, stat.size, stat.count) for stat in snapshot.statistics('lineno')]
+        return [{
+            'site': str(traceback[0]) if traceback else '?',
+            'size_kb': round(size / 1024.0, 1),
+            'count': count,
+        } for traceback, size, count in sites[:limit or self.config['TOP_ALLOCATIONS']]]
+
+    def recycle_if_due(self):
+        """Signal this worker to exit gracefully once a recycle threshold was crossed."""
+        with self._lock:
+            if self.recycle_reason is None or self.recycle_sent:
+                return False
+            self.recycle_sent = True
+        logger.warning('Recycling worker %s: %s', os.getpid(), self.recycle_reason)
+        os.kill(os.getpid(), getattr(signal, self.config['RECYCLE_SIGNAL']))
+        return True
+
+    def stats(self):
+        rss = rss_bytes()
+        with self._lock:
+            endpoints = {
+                label: {
+                    'requests': entry['requests'],
+                    'rss_delta_avg_kb': round(entry['rss_delta_total'] / entry['requests'] / 1024.0, 1),
+                    'rss_delta_max_kb': round(entry['rss_delta_max'] / 1024.0, 1),
+                    'rss_delta_total_mb': round(entry['rss_delta_total'] / MB, 1),
+                    'heap_delta_avg_kb': round(entry['heap_delta_total'] / entry['requests'] / 1024.0, 1),
+                    'heap_delta_max_kb': round(entry['heap_delta_max'] / 1024.0, 1),
+                    'graph_nodes_added': entry['graph_nodes_added'],
+                    'request_mb_total': round(entry['request_bytes_total'] / MB, 1),
+                }
+                for label, entry in sorted(self.endpoints.items())
+            }
+            process = {
+                'pid': os.getpid(),
+                'requests': self.requests,
+                'rss_mb': round(rss / MB, 1),
+                'started_rss_mb': round(self.started_rss / MB, 1),
+                'baseline_rss_mb': round(self.baseline_rss / MB, 1) if self.baseline_rss is not None else None,
+                'growth_mb': round((rss - self.baseline_rss) / MB, 1) if self.baseline_rss is not None else None,
+                'recycle_reason': self.recycle_reason,
+            }
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            process['traced_heap_mb'] = round(current / MB, 1)
+            process['traced_heap_peak_mb'] = round(peak / MB, 1)
+        process['graph_nodes'] = runtime.graph_nodes()
+        process['open_figures'] = open_figures()
+        process['gc_objects'] = len(gc.get_objects())
+        return {'process': process, 'endpoints': endpoints}
+
+
+def get_accountant():
+    """Process-wide accountant built from settings.MEMORY_ACCOUNTING."""
+    global _accountant
+    if _accountant is None:
+        with _accountant_lock:
+            if _accountant is None:
+                _accountant = MemoryAccountant(get_memory_config())
+    return _accountant
+
+
+def on_request_finished(sender, **kwargs):
+    """request_finished receiver: recycle only after the response went out."""
+    if _accountant is not None:
+        _accountant.recycle_if_due()
@@ -0,0 +1,87 @@
+import json
+
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.utils.functional import SimpleLazyObject
+
+from . import memory, profiling
+from .auth import get_api_user, get_session_user
+
+
+class RequestUserMiddleware(AuthenticationMiddleware):
+    """
+    Drop-in replacement for AuthenticationMiddleware that resolves the
+    session user through the short-lived user cache (DetectionApp/auth.py).
+    Views resolve the API caller, including the X-User-ID fallback, with
+    auth.get_api_user(request).
+    """
+
+    def process_request(self, request):
+        request.user = SimpleLazyObject(lambda: get_session_user(request))
+
+
+class ProfilingMiddleware:
+    """
+    Runs requests that opt in (X-Profile header or ?profile=) under cProfile
+    and tracemalloc, for superusers or when REQUEST_PROFILING['ENABLED'] is
+    set. See DetectionApp/profiling.py.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        mode = profiling.requested_mode(request)
+        if mode is None:
+            return self.get_response(request)
+
+        config = profiling.get_profiling_config()
+        user = get_api_user(request)
+        if not (config['ENABLED'] or (user and user.is_superuser)):
+            return self.get_response(request)
+        if not profiling.busy_lock.acquire(blocking=False):
+            response = self.get_response(request)
+            response['X-Profile-Status'] = 'busy'
+            return response
+        try:
+            response, record, profiler = profiling.profile_call(self.get_response, request, config)
+            profiling.save_profile(record, profiler, config)
+        finally:
+            profiling.busy_lock.release()
+
+        response['X-Profile-Id'] = record['id']
+        if mode == 'inline' and response.get('Content-Type', '').startswith('application/json') \
+                and not response.streaming:
+            try:
+                body = json.loads(response.content)
+            except ValueError:
+                return response
+            body['profile'] = record
+            response.content = json.dumps(body)
+        return response
+
+
+class MemoryAccountingMiddleware:
+    """
+    Charges each request's RSS, traced-heap and TF graph growth to its
+    endpoint (DetectionApp/memory.py). Listed first so the whole middleware
+    stack is measured.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = memory.get_memory_config()['ENABLED']
+
+    def __call__(self, request):
+        if not self.enabled:
+            return self.get_response(request)
+        accountant = memory.get_accountant()
+        sample = accountant.before()
+        response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        label = f"{request.method} {match.url_name if match and match.url_name else 'unmatched'}"
+        try:
+            request_bytes = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            request_bytes = 0
+        accountant.after(label, sample, request_bytes)
+        return response
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-19 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('DetectionApp', '0005_storedimage'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='analysislog',
+            index=models.Index(fields=['user', '-timestamp'], name='analysislog_user_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='analysislog',
+            index=models.Index(fields=['user', 'image_hash'], name='analysislog_user_hash_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='analysislog',
+            index=models.Index(fields=['image_hash', '-timestamp'], name='analysislog_hash_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='analysislog',
+            index=models.Index(fields=['-timestamp'], name='analysislog_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='analysislog',
+            index=models.Index(fields=['image_path'], name='analysislog_path_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 3.2.25 on 2026-10-19 13:05
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('DetectionApp', '0006_analysislog_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('total', 'All time'), ('day', 'Day'), ('hour', 'Hour')], max_length=5)),
+                ('bucket', models.DateTimeField()),
+                ('total', models.IntegerField(default=0)),
+                ('real_count', models.IntegerField(default=0)),
+                ('fake_count', models.IntegerField(default=0)),
+                ('confidence_sum', models.FloatField(default=0.0)),
+                ('real_prob_sum', models.FloatField(default=0.0)),
+                ('fake_prob_sum', models.FloatField(default=0.0)),
+                ('hist_0', models.IntegerField(default=0)),
+                ('hist_1', models.IntegerField(default=0)),
+                ('hist_2', models.IntegerField(default=0)),
+                ('hist_3', models.IntegerField(default=0)),
+                ('hist_4', models.IntegerField(default=0)),
+                ('hist_5', models.IntegerField(default=0)),
+                ('hist_6', models.IntegerField(default=0)),
+                ('hist_7', models.IntegerField(default=0)),
+                ('hist_8', models.IntegerField(default=0)),
+                ('hist_9', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'period', 'bucket')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='analysisrollup',
+            index=models.Index(fields=['period', 'bucket'], name='rollup_period_bucket_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations
+
+
+def backfill_rollups(apps, schema_editor):
+    # The admin dashboard reads only the rollups, so fill them from the
+    # history that existed before 0007. This uses the app's own rebuild
+    # (the current models) rather than historical models, so the delta and
+    # histogram logic stays in one place.
+    from DetectionApp import rollups
+    rollups.rebuild()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('DetectionApp', '0007_analysisrollup'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -21,6 +21,76 @@ class AnalysisLog(models.Model):
     image_hash = models.CharField(max_length=64, blank=True, null=True)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # History pages: WHERE user_id = ? ORDER BY timestamp DESC
+            models.Index(fields=['user', '-timestamp'], name='analysislog_user_ts_idx'),
+            # Duplicate replacement in the log writer: WHERE user_id = ? AND image_hash = ?
+            models.Index(fields=['user', 'image_hash'], name='analysislog_user_hash_idx'),
+            # Explanation re-render by hash, admin log listing / TTL pruning, GC reference checks
+            models.Index(fields=['image_hash', '-timestamp'], name='analysislog_hash_ts_idx'),
+            models.Index(fields=['-timestamp'], name='analysislog_ts_idx'),
+            models.Index(fields=['image_path'], name='analysislog_path_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.username} - {self.timestamp}"
 
+class StoredImage(models.Model):
+    """An uploaded file stored once per distinct content and shared by reference"""
+    digest = models.CharField(max_length=64, unique=True)
+    path = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField(default=0)
+    ref_count = models.IntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+    last_referenced = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['ref_count', 'last_referenced'], name='storedimage_gc_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.path} ({self.ref_count} refs)"
+
+
+class AnalysisRollup(models.Model):
+    """
+    Pre-aggregated AnalysisLog counts per user, kept up to date as analyses
+    are written and deleted (DetectionApp/rollups.py). PERIOD_TOTAL has one
+    row per user; day and hour rows feed the trend charts.
+    """
+    PERIOD_TOTAL = 'total'
+    PERIOD_DAY = 'day'
+    PERIOD_HOUR = 'hour'
+    PERIOD_CHOICES = [(PERIOD_TOTAL, 'All time'), (PERIOD_DAY, 'Day'), (PERIOD_HOUR, 'Hour')]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES)
+    bucket = models.DateTimeField()
+    total = models.IntegerField(default=0)
+    real_count = models.IntegerField(default=0)
+    fake_count = models.IntegerField(default=0)
+    confidence_sum = models.FloatField(default=0.0)
+    real_prob_sum = models.FloatField(default=0.0)
+    fake_prob_sum = models.FloatField(default=0.0)
+    # Confidence histogram, 5-point buckets from 50% (confidence is always >= 50)
+    hist_0 = models.IntegerField(default=0)
+    hist_1 = models.IntegerField(default=0)
+    hist_2 = models.IntegerField(default=0)
+    hist_3 = models.IntegerField(default=0)
+    hist_4 = models.IntegerField(default=0)
+    hist_5 = models.IntegerField(default=0)
+    hist_6 = models.IntegerField(default=0)
+    hist_7 = models.IntegerField(default=0)
+    hist_8 = models.IntegerField(default=0)
+    hist_9 = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [('user', 'period', 'bucket')]
+        indexes = [
+            models.Index(fields=['period', 'bucket'], name='rollup_period_bucket_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.period} {self.bucket:%Y-%m-%d %H:00}: {self.total}"
@@ -0,0 +1,154 @@
+"""
+Opt-in per-request profiling.
+
+A request sent with `X-Profile: 1` (or `?profile=1`) by a superuser runs
+under cProfile and tracemalloc. The sorted pstats summary, the top
+allocation sites and the raw .prof dump are saved to the profile archive
+(REQUEST_PROFILING['DIR']); the response carries the archive id in
+X-Profile-Id. `inline` instead of `1` also adds the summary to a JSON
+response body. Requests that don't ask pay only for the header check.
+
+Only one request is profiled at a time per process (cProfile cannot nest);
+others that ask while one is running are served unprofiled with
+`X-Profile-Status: busy`.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+import uuid
+
+from django.conf import settings
+
+DEFAULT_PROFILING = {
+    'ENABLED': False,           # True lets any caller profile (local debugging only)
+    'DIR': 'profiles',
+    'KEEP': 50,                 # archived profiles kept, oldest removed first
+    'TOP_FUNCTIONS': 40,
+    'SORT': 'cumulative',
+    'TOP_ALLOCATIONS': 25,
+    'TRACEMALLOC_FRAMES': 8,
+}
+
+PROFILE_ID_RE = re.compile(r'^[0-9]{8}-[0-9]{6}-[0-9a-f]{6}$')
+
+busy_lock = threading.Lock()
+
+
+def get_profiling_config():
+    config = dict(DEFAULT_PROFILING)
+    config.update(getattr(settings, 'REQUEST_PROFILING', {}) or {})
+    return config
+
+
+def requested_mode(request):
+    """'save' or 'inline' when the request asks to be profiled, else None."""
+    value = request.META.get('HTTP_X_PROFILE') or request.GET.get('profile')
+    if not value or value in ('0', 'false'):
+        return None
+    return 'inline' if value == 'inline' else 'save'
+
+
+def profile_call(func, request, config):
+    """Run func(request) under cProfile and tracemalloc. Returns (response, record, profiler)."""
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(config['TRACEMALLOC_FRAMES'])
+    if hasattr(tracemalloc, 'reset_peak'):  # Python 3.9+
+        tracemalloc.reset_peak()
+    baseline = tracemalloc.take_snapshot()
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    try:
+        response = profiler.runcall(func, request)
+    finally:
+        elapsed = time.perf_counter() - started
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        if started_tracing:
+            tracemalloc.stop()
+
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.strip_dirs().sort_stats(config['SORT']).print_stats(config['TOP_FUNCTIONS'])
+
+    ignore = (tracemalloc.Filter(False, tracemalloc.__file__),
+              tracemalloc.Filter(False, '<frozen importlib._bootstrap>'))
+    diff = snapshot.filter_traces(ignore).compare_to(baseline.filter_traces(ignore), 'lineno')
+    allocations = [{
+        'site': str(stat.traceback[0]) if stat.traceback else '?',
+        'size_kb': round(stat.size_diff / 1024.0, 1),
+        'count': stat.count_diff,
+    } for stat in diff[:config['TOP_ALLOCATIONS']]]
+
+    record = {
+        'id': f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}",
+        'method': request.method,
+        'path': request.path,
+        'status': getattr(response, 'status_code', None),
+        'elapsed_ms': round(elapsed * 1000, 1),
+        'peak_traced_kb': round(peak / 1024.0, 1),
+        'retained_traced_kb': round(current / 1024.0, 1),
+        'function_calls': stats.total_calls,
+        'stats': stream.getvalue(),
+        'allocations': allocations,
+        'created': time.time(),
+    }
+    return response, record, profiler
+
+
+def profile_dir(config=None):
+    path = (config or get_profiling_config())['DIR']
+    if not os.path.isabs(path):
+        path = os.path.join(settings.BASE_DIR, path)
+    return path
+
+
+def save_profile(record, profiler, config):
+    directory = profile_dir(config)
+    os.makedirs(directory, exist_ok=True)
+    profiler.dump_stats(os.path.join(directory, record['id'] + '.prof'))
+    with open(os.path.join(directory, record['id'] + '.json'), 'w') as f:
+        json.dump(record, f)
+
+    # Profile ids sort by time, so the oldest files come first
+    saved = sorted(name[:-5] for name in os.listdir(directory) if name.endswith('.json'))
+    for profile_id in saved[:max(0, len(saved) - config['KEEP'])]:
+        for ext in ('.json', '.prof'):
+            try:
+                os.remove(os.path.join(directory, profile_id + ext))
+            except OSError:
+                pass
+
+
+def list_profiles():
+    """Summaries of archived profiles, newest first."""
+    directory = profile_dir()
+    if not os.path.isdir(directory):
+        return []
+    summaries = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            continue
+        record.pop('stats', None)
+        record.pop('allocations', None)
+        summaries.append(record)
+    return summaries
+
+
+def profile_path(profile_id, ext):
+    """Archive path for a profile id, or None for ids that aren't ours."""
+    if not PROFILE_ID_RE.match(profile_id or ''):
+        return None
+    path = os.path.join(profile_dir(), profile_id + ext)
+    return path if os.path.exists(path) else None
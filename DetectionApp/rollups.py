@@ -0,0 +1,163 @@
+"""
+Incrementally maintained AnalysisLog rollups.
+
+Every write path that inserts or deletes AnalysisLog rows also applies the
+matching deltas here, inside the same transaction: one all-time row per
+user plus one row per user per day and per hour, each holding counts,
+probability sums and a confidence histogram. The admin dashboard and the
+trends endpoint read only these rows, so their cost depends on the number
+of users and the chart window, not on how much history exists.
+
+Migration 0008 fills them from existing history; `manage.py rebuild_rollups`
+recomputes them from AnalysisLog after bulk changes made outside these paths.
+"""
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .models import AnalysisLog, AnalysisRollup
+
+# AnalysisLog fields a rollup delta is computed from, in this order
+ROW_FIELDS = ('user_id', 'timestamp', 'is_real', 'confidence', 'real_prob', 'fake_prob')
+
+HIST_BUCKETS = 10
+HIST_START = 50.0
+HIST_WIDTH = 5.0
+HIST_FIELDS = [f'hist_{i}' for i in range(HIST_BUCKETS)]
+SUM_FIELDS = ['total', 'real_count', 'fake_count', 'confidence_sum', 'real_prob_sum', 'fake_prob_sum'] + HIST_FIELDS
+
+TOTAL_BUCKET = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def hist_index(confidence):
+    return min(HIST_BUCKETS - 1, max(0, int((confidence - HIST_START) // HIST_WIDTH)))
+
+
+def rows_from_logs(logs):
+    return [tuple(getattr(log, field) for field in ROW_FIELDS) for log in logs]
+
+
+def _buckets(timestamp):
+    hour = timezone.localtime(timestamp).replace(minute=0, second=0, microsecond=0)
+    return [(AnalysisRollup.PERIOD_TOTAL, TOTAL_BUCKET),
+            (AnalysisRollup.PERIOD_DAY, hour.replace(hour=0)),
+            (AnalysisRollup.PERIOD_HOUR, hour)]
+
+
+def apply(rows, sign):
+    """
+    Add (sign=1) or remove (sign=-1) analyses from the rollups. `rows` are
+    tuples in ROW_FIELDS order. Deltas are merged per rollup row first, so a
+    batch touching one user and hour costs three UPDATEs.
+    """
+    deltas = {}
+    for user_id, timestamp, is_real, confidence, real_prob, fake_prob in rows:
+        for period, bucket in _buckets(timestamp):
+            delta = deltas.setdefault((user_id, period, bucket), dict.fromkeys(SUM_FIELDS, 0))
+            delta['total'] += sign
+            delta['real_count' if is_real else 'fake_count'] += sign
+            delta['confidence_sum'] += sign * confidence
+            delta['real_prob_sum'] += sign * real_prob
+            delta['fake_prob_sum'] += sign * fake_prob
+            delta[HIST_FIELDS[hist_index(confidence)]] += sign
+
+    for (user_id, period, bucket), delta in deltas.items():
+        changes = {field: F(field) + value for field, value in delta.items() if value}
+        rollup = AnalysisRollup.objects.filter(user_id=user_id, period=period, bucket=bucket)
+        if rollup.update(**changes) or sign < 0:
+            continue
+        try:
+            with transaction.atomic():
+                AnalysisRollup.objects.create(user_id=user_id, period=period, bucket=bucket, **delta)
+        except IntegrityError:
+            # Created concurrently by another writer
+            rollup.update(**changes)
+
+
+def record_inserted(logs):
+    """Call with the AnalysisLog instances just created (bulk_create fills in timestamps)."""
+    apply(rows_from_logs(logs), 1)
+
+
+def record_deleted(rows):
+    """Call with ROW_FIELDS tuples of the rows being deleted, e.g. queryset.values_list(*ROW_FIELDS)."""
+    apply(rows, -1)
+
+
+def rebuild(user_ids=None):
+    """
+    Recompute rollups from AnalysisLog, one user at a time so memory is
+    bounded by one user's hourly buckets. Returns the number of users rebuilt.
+    """
+    if user_ids is None:
+        user_ids = AnalysisLog.objects.order_by().values_list('user_id', flat=True).distinct()
+        stale = AnalysisRollup.objects.exclude(user_id__in=AnalysisLog.objects.values('user_id'))
+        stale.delete()
+    hist = {
+        field: Count('id', filter=(
+            Q(confidence__lt=HIST_START + HIST_WIDTH) if i == 0 else
+            Q(confidence__gte=HIST_START + HIST_WIDTH * i) if i == HIST_BUCKETS - 1 else
+            Q(confidence__gte=HIST_START + HIST_WIDTH * i, confidence__lt=HIST_START + HIST_WIDTH * (i + 1))
+        ))
+        for i, field in enumerate(HIST_FIELDS)
+    }
+    rebuilt = 0
+    for user_id in list(user_ids):
+        hourly = AnalysisLog.objects.filter(user_id=user_id).annotate(hour=TruncHour('timestamp')) \
+            .values('hour').order_by('hour').annotate(
+                total=Count('id'),
+                real_count=Count('id', filter=Q(is_real=True)),
+                fake_count=Count('id', filter=Q(is_real=False)),
+                confidence_sum=Sum('confidence'),
+                real_prob_sum=Sum('real_prob'),
+                fake_prob_sum=Sum('fake_prob'),
+                **hist
+            )
+        rows = {}
+        for entry in hourly:
+            hour = entry.pop('hour')
+            for period, bucket in _buckets(hour):
+                row = rows.setdefault((period, bucket), dict.fromkeys(SUM_FIELDS, 0))
+                for field in SUM_FIELDS:
+                    row[field] += entry[field] or 0
+        with transaction.atomic():
+            AnalysisRollup.objects.filter(user_id=user_id).delete()
+            AnalysisRollup.objects.bulk_create([
+                AnalysisRollup(user_id=user_id, period=period, bucket=bucket, **row)
+                for (period, bucket), row in rows.items()
+            ], batch_size=500)
+        rebuilt += 1
+    return rebuilt
+
+
+def user_totals():
+    """{user_id: all-time AnalysisRollup} - one query, one row per user."""
+    return {rollup.user_id: rollup
+            for rollup in AnalysisRollup.objects.filter(period=AnalysisRollup.PERIOD_TOTAL)}
+
+
+def trends(period, since, user_id=None):
+    """Per-bucket sums across users (or for one user) from `since` on, oldest first."""
+    rollups = AnalysisRollup.objects.filter(period=period, bucket__gte=since)
+    if user_id is not None:
+        rollups = rollups.filter(user_id=user_id)
+    # Annotations can't reuse the model's field names
+    sums = {f'sum_{field}': Sum(field) for field in SUM_FIELDS}
+    points = []
+    for entry in rollups.values('bucket').order_by('bucket').annotate(**sums):
+        total = entry['sum_total'] or 0
+        if total <= 0:
+            continue
+        points.append({
+            'bucket': entry['bucket'].isoformat(),
+            'total': total,
+            'real_count': entry['sum_real_count'],
+            'fake_count': entry['sum_fake_count'],
+            'avg_confidence': round(entry['sum_confidence_sum'] / total, 1),
+            'avg_fake_prob': round(entry['sum_fake_prob_sum'] / total, 1),
+            'confidence_histogram': [entry[f'sum_{field}'] for field in HIST_FIELDS],
+        })
+    return points
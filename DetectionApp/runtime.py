@@ -0,0 +1,245 @@
+"""
+Per-process inference runtime.
+
+One place to size the thread pools that compete inside a worker process
+(TensorFlow intra/inter-op pools, OpenCV and BLAS), to pin a worker to a
+set of CPUs, and to hold the detector model in a single configured TF
+session instead of reloading it on every request.
+"""
+import os
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+MODEL_PATH = "model/nasnet_weights.hdf5"
+
+# 0 means "leave the library default alone"
+DEFAULT_RUNTIME = {
+    'TF_INTRA_OP_THREADS': 0,
+    'TF_INTER_OP_THREADS': 0,
+    'CV2_THREADS': 0,
+    'BLAS_THREADS': 0,
+    # '' = no pinning, 'auto' = slice by worker index, or an explicit list like '0-3,8'
+    'CPU_AFFINITY': '',
+    'WORKER_INDEX': 0,
+}
+
+# Environment variables understood by BLAS/OpenMP runtimes; they only take
+# effect when set before numpy is imported, so they are a best-effort fallback
+# to threadpoolctl.
+BLAS_ENV_VARS = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS']
+
+_lock = threading.RLock()
+_session = None
+_graph = None
+_models = {}
+_embedding_models = {}
+_versions = {}
+_applied = None
+_graph_nodes = {}
+
+
+def get_runtime_config(overrides=None):
+    """Merge defaults, settings.INFERENCE_RUNTIME and explicit overrides."""
+    config = dict(DEFAULT_RUNTIME)
+    if settings.configured:
+        config.update(getattr(settings, 'INFERENCE_RUNTIME', {}) or {})
+    if overrides:
+        config.update(overrides)
+    return config
+
+
+def parse_cpu_list(spec):
+    """Parse a Linux-style CPU list ('0-3,6') into a sorted list of ints."""
+    cpus = set()
+    for part in str(spec).split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-', 1)
+            cpus.update(range(int(start), int(end) + 1))
+        else:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+
+def resolve_affinity(config):
+    """Return the CPU set this worker should be pinned to, or None."""
+    spec = config.get('CPU_AFFINITY') or ''
+    if not spec:
+        return None
+    if spec == 'auto':
+        # Give each worker a contiguous slice sized to its thread budget
+        available = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+        width = max(int(config.get('TF_INTRA_OP_THREADS') or 0), int(config.get('BLAS_THREADS') or 0), 1)
+        start = (int(config.get('WORKER_INDEX') or 0) * width) % len(available)
+        return [available[(start + i) % len(available)] for i in range(min(width, len(available)))]
+    return parse_cpu_list(spec)
+
+
+def set_blas_env(threads):
+    """Export BLAS/OpenMP thread limits for libraries not loaded yet."""
+    if threads:
+        for var in BLAS_ENV_VARS:
+            os.environ[var] = str(threads)
+
+
+def apply_thread_limits(overrides=None):
+    """Apply the configured OpenCV/BLAS limits and CPU affinity to this process."""
+    global _applied
+    config = get_runtime_config(overrides)
+
+    blas_threads = int(config.get('BLAS_THREADS') or 0)
+    set_blas_env(blas_threads)
+    if blas_threads:
+        try:
+            from threadpoolctl import threadpool_limits
+            threadpool_limits(limits=blas_threads, user_api='blas')
+        except ImportError:
+            pass
+
+    cv2_threads = int(config.get('CV2_THREADS') or 0)
+    if cv2_threads:
+        import cv2
+        cv2.setNumThreads(cv2_threads)
+
+    cpus = resolve_affinity(config)
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+
+    _applied = config
+    return config
+
+
+def _session_config(config):
+    import tensorflow as tf
+    return tf.ConfigProto(
+        intra_op_parallelism_threads=int(config.get('TF_INTRA_OP_THREADS') or 0),
+        inter_op_parallelism_threads=int(config.get('TF_INTER_OP_THREADS') or 0),
+        allow_soft_placement=True,
+    )
+
+
+def get_session():
+    """Return the process-wide TF session, creating it on first use."""
+    global _session, _graph
+    if _session is None:
+        with _lock:
+            if _session is None:
+                import tensorflow as tf
+                from keras import backend as K
+                config = _applied or apply_thread_limits()
+                graph = tf.Graph()
+                with graph.as_default():
+                    session = tf.Session(graph=graph, config=_session_config(config))
+                K.set_session(session)
+                _graph = graph
+                _session = session
+    return _session
+
+
+@contextmanager
+def inference_context():
+    """Run Keras calls against the shared graph and session from any thread."""
+    from keras import backend as K
+    session = get_session()
+    try:
+        with _graph.as_default():
+            K.set_session(session)
+            yield session
+    finally:
+        _graph_nodes.update(count_graph_nodes())
+
+
+def count_graph_nodes():
+    """
+    Operation counts of the session graph and the TF default graph. Either
+    growing between inferences means ops are being added per request (a
+    load_model or a Keras call outside inference_context).
+    """
+    import sys
+    tf = sys.modules.get('tensorflow')
+    if tf is None:
+        return {}
+    counts = {'default': len(tf.get_default_graph().get_operations())}
+    if _graph is not None:
+        counts['session'] = len(_graph.get_operations())
+    return counts
+
+
+def graph_nodes():
+    """Node counts recorded after the most recent inference in this process."""
+    return dict(_graph_nodes)
+
+
+def get_model(path=None):
+    """Load a Keras model once per process inside the configured session."""
+    path = path or getattr(settings, 'DETECTION_MODEL_PATH', MODEL_PATH)
+    model = _models.get(path)
+    if model is None:
+        with _lock:
+            model = _models.get(path)
+            if model is None:
+                from keras.models import load_model
+                get_session()
+                with inference_context():
+                    model = load_model(path)
+                    model._make_predict_function()
+                _models[path] = model
+    return model
+
+
+def get_embedding_model(model):
+    """
+    Two-output view of a loaded model: (class probabilities, penultimate
+    Dense activations). Both come from one forward pass over shared weights.
+    """
+    key = id(model)
+    dual = _embedding_models.get(key)
+    if dual is None:
+        with _lock:
+            dual = _embedding_models.get(key)
+            if dual is None:
+                from keras.layers import Dense
+                from keras.models import Model
+                dense = [layer for layer in model.layers if isinstance(layer, Dense)]
+                embedding = dense[-2] if len(dense) > 1 else model.layers[-2]
+                with inference_context():
+                    dual = Model(inputs=model.inputs, outputs=[model.output, embedding.output])
+                    dual._make_predict_function()
+                _embedding_models[key] = dual
+    return dual
+
+
+def model_version(path=None):
+    """Short content hash of the weights file, used to key cached model outputs."""
+    path = path or getattr(settings, 'DETECTION_MODEL_PATH', MODEL_PATH)
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime)
+    version = _versions.get(key)
+    if version is None:
+        import hashlib
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        version = digest.hexdigest()[:12]
+        _versions[key] = version
+    return version
+
+
+def reset():
+    """Drop the cached session and models so the next call rebuilds them."""
+    global _session, _graph, _applied
+    with _lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _graph = None
+        _applied = None
+        _models.clear()
+        _embedding_models.clear()
+        _versions.clear()
+        _graph_nodes.clear()
@@ -0,0 +1,191 @@
+"""
+Tiled multi-scale scanning for high-resolution images.
+
+Instead of squeezing the whole image into one 32x32 input, overlapping 32x32
+patches are cut at several scales and scored in large batches. Patches are
+strided views into the (resized) image; only the batch currently being
+scored is materialised as float32, which is what the memory cap bounds.
+"""
+import time
+
+import cv2
+import numpy as np
+from django.conf import settings
+from numpy.lib.stride_tricks import sliding_window_view
+
+PATCH_SIZE = 32
+
+DEFAULT_SCAN = {
+    'STRIDE': 16,                  # pixels between patch origins at each scale
+    'SCALES': (1.0, 0.5, 0.25),    # resize factors applied before cutting patches
+    'MAX_PATCHES': 4096,           # total patches across all scales
+    'MEMORY_CAP_BYTES': 32 * 1024 * 1024,  # float32 batch memory
+    'TOP_FRACTION': 0.1,           # share of most suspicious patches used for the verdict
+    'MAX_SCALES': 4,               # scales a client may request
+}
+
+
+def get_scan_config(overrides=None):
+    config = dict(DEFAULT_SCAN)
+    config.update(getattr(settings, 'SCAN_MODE', {}) or {})
+    if overrides:
+        config.update({k: v for k, v in overrides.items() if v is not None})
+    return config
+
+
+def parse_scan_options(stride=None, scales=None, max_patches=None):
+    """
+    Validate client-supplied scan parameters (form strings, None when
+    absent): stride >= 1, at most MAX_SCALES scales each in (0, 1] (scales
+    never upsample), max_patches at least one per scale and capped by the
+    configuration.
+    Raises ValueError with a message for the client.
+    """
+    config = get_scan_config()
+    options = {'stride': None, 'scales': None, 'max_patches': None}
+    try:
+        if stride:
+            options['stride'] = int(stride)
+        if scales:
+            options['scales'] = [float(v) for v in scales.split(',')]
+        if max_patches:
+            options['max_patches'] = int(max_patches)
+    except ValueError:
+        raise ValueError('stride and max_patches must be integers and scales comma-separated numbers')
+    if options['stride'] is not None and options['stride'] < 1:
+        raise ValueError('stride must be at least 1')
+    if options['scales'] is not None:
+        if not 0 < len(options['scales']) <= config['MAX_SCALES']:
+            raise ValueError(f"Between 1 and {config['MAX_SCALES']} scales may be given")
+        if not all(0 < scale <= 1 for scale in options['scales']):
+            raise ValueError('Each scale must be greater than 0 and at most 1')
+    if options['max_patches'] is not None:
+        scale_count = len(options['scales'] or config['SCALES'])
+        if options['max_patches'] < scale_count:
+            raise ValueError(f'max_patches must be at least {scale_count}, one per scale')
+        options['max_patches'] = min(options['max_patches'], int(config['MAX_PATCHES']))
+    return options
+
+
+def patch_grid(image, stride, patch=PATCH_SIZE):
+    """(rows, cols, patch, patch, 3) strided view of every patch origin; no pixels are copied."""
+    windows = sliding_window_view(image, (patch, patch, image.shape[2]))
+    return windows[::stride, ::stride, 0]
+
+
+def plan_scales(shape, scales, stride, max_patches, patch=PATCH_SIZE):
+    """
+    Resolve (scale, stride) per usable scale so the total patch count fits
+    max_patches. Scales whose image would be smaller than one patch are
+    dropped; crowded scales get a wider stride rather than a random subset.
+    Once every scale is down to a single patch, the coarsest scales are
+    dropped until the rest fit.
+    """
+    height, width = shape[:2]
+    plans = []
+    for scale in scales:
+        h, w = int(round(height * scale)), int(round(width * scale))
+        if h < patch or w < patch:
+            continue
+        plans.append([scale, stride, (h, w)])
+    if not plans:
+        return []
+
+    def count(plan):
+        _, s, (h, w) = plan
+        return ((h - patch) // s + 1) * ((w - patch) // s + 1)
+
+    while plans and sum(count(p) for p in plans) > max_patches:
+        busiest = max(plans, key=count)
+        if count(busiest) == 1:
+            plans.remove(min(plans, key=lambda p: p[0]))
+            continue
+        busiest[1] += max(1, busiest[1] // 2)
+    return [(scale, s, size) for scale, s, size in plans]
+
+
+def scan_image(image_bgr, model, stride=None, scales=None, max_patches=None, memory_cap_bytes=None,
+               top_fraction=None):
+    """
+    Score every patch of `image_bgr` and combine them.
+
+    Returns the fake/real probabilities for the whole image, per-scale
+    statistics and a heat map of patch fake-probability on the grid of the
+    finest scale.
+    """
+    config = get_scan_config({
+        'STRIDE': stride, 'SCALES': scales, 'MAX_PATCHES': max_patches,
+        'MEMORY_CAP_BYTES': memory_cap_bytes, 'TOP_FRACTION': top_fraction,
+    })
+    started = time.perf_counter()
+    patch_bytes = PATCH_SIZE * PATCH_SIZE * 3 * 4
+    batch_size = max(1, int(config['MEMORY_CAP_BYTES']) // patch_bytes)
+
+    plans = plan_scales(image_bgr.shape, config['SCALES'], int(config['STRIDE']), int(config['MAX_PATCHES']))
+    if not plans:
+        # Smaller than one patch at every scale: fall back to a single resized input
+        plans = [(None, PATCH_SIZE, (PATCH_SIZE, PATCH_SIZE))]
+
+    scale_maps = []
+    all_scores = []
+    scale_stats = []
+    for scale, scale_stride, (h, w) in plans:
+        resized = image_bgr if (h, w) == image_bgr.shape[:2] else cv2.resize(image_bgr, (w, h), interpolation=cv2.INTER_AREA)
+        grid = patch_grid(resized, scale_stride)
+        rows, cols = grid.shape[:2]
+        fake = np.empty(rows * cols, dtype='float32')
+
+        # Materialise whole grid rows at a time, bounded by the memory cap
+        rows_per_batch = max(1, batch_size // cols)
+        offset = 0
+        for r0 in range(0, rows, rows_per_batch):
+            chunk = grid[r0:r0 + rows_per_batch].reshape(-1, PATCH_SIZE, PATCH_SIZE, 3)
+            batch = chunk.astype('float32')
+            batch /= 255
+            probs = model.predict(batch, batch_size=len(batch))
+            fake[offset:offset + len(batch)] = probs[:, 0]
+            offset += len(batch)
+
+        scale_maps.append(fake.reshape(rows, cols))
+        all_scores.append(fake)
+        scale_stats.append({
+            'scale': scale,
+            'stride': scale_stride,
+            'patches': int(fake.size),
+            'mean_fake_prob': float(fake.mean()),
+            'max_fake_prob': float(fake.max()),
+        })
+
+    scores = np.concatenate(all_scores)
+    top_k = max(1, int(round(scores.size * float(config['TOP_FRACTION']))))
+    top_mean = float(np.sort(scores)[-top_k:].mean())
+    # Local artifacts matter: blend the overall mean with the most suspicious patches
+    fake_prob = 0.5 * float(scores.mean()) + 0.5 * top_mean
+
+    finest = max(scale_maps, key=lambda m: m.size)
+    heatmap = np.mean([
+        cv2.resize(m, (finest.shape[1], finest.shape[0]), interpolation=cv2.INTER_LINEAR)
+        for m in scale_maps
+    ], axis=0)
+
+    return {
+        'fake_prob': fake_prob,
+        'real_prob': 1.0 - fake_prob,
+        'patches': int(scores.size),
+        'scales': scale_stats,
+        'heatmap': heatmap.astype('float32'),
+        'elapsed': time.perf_counter() - started,
+    }
+
+
+def render_heatmap_overlay(image_bgr, heatmap, max_edge=512):
+    """PNG bytes of the per-tile heat map blended over a downscaled copy of the image."""
+    height, width = image_bgr.shape[:2]
+    factor = min(1.0, max_edge / float(max(height, width)))
+    size = (max(1, int(width * factor)), max(1, int(height * factor)))
+    base = cv2.resize(image_bgr, size, interpolation=cv2.INTER_AREA)
+    heat = cv2.resize(np.clip(heatmap, 0, 1), size, interpolation=cv2.INTER_LINEAR)
+    colored = cv2.applyColorMap((heat * 255).astype('uint8'), cv2.COLORMAP_JET)
+    overlay = cv2.addWeighted(base, 0.6, colored, 0.4, 0)
+    ok, encoded = cv2.imencode('.png', overlay)
+    return encoded.tobytes() if ok else b''
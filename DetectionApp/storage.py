@@ -0,0 +1,258 @@
+"""
+Content-addressed upload storage.
+
+Uploads are stored once per distinct content under a sharded path,
+`uploads/ab/cd/<sha256>.<ext>` inside the static directory, so identical
+uploads share one file and no directory grows past a few hundred entries.
+Every AnalysisLog row that points at a file holds one reference
+(StoredImage.ref_count). Releasing the last reference only marks the file
+orphaned; a garbage collector removes orphans in bulk after a grace
+period, driven by an indexed query rather than directory listings. The
+retention policy can also prune analyses older than a TTL.
+"""
+import hashlib
+import os
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Exists, F, OuterRef
+from django.utils import timezone
+
+STATIC_DIR = "DetectionApp/static"
+UPLOAD_PREFIX = "uploads"
+
+DEFAULT_RETENTION = {
+    'ORPHAN_GRACE_SECONDS': 3600,   # keep unreferenced files this long (re-uploads revive them)
+    'TTL_DAYS': None,               # prune analyses older than this; None keeps them forever
+    'GC_INTERVAL': 600,             # seconds between background collections; 0 disables the thread
+    'GC_BATCH': 1000,
+}
+
+
+def get_retention_config():
+    config = dict(DEFAULT_RETENTION)
+    config.update(getattr(settings, 'UPLOAD_RETENTION', {}) or {})
+    return config
+
+
+def absolute_path(image_path):
+    return os.path.join(STATIC_DIR, image_path)
+
+
+def is_inside_static(image_path):
+    """True for relative paths that resolve inside the static directory."""
+    if not image_path or os.path.isabs(image_path):
+        return False
+    root = os.path.realpath(STATIC_DIR)
+    target = os.path.realpath(absolute_path(image_path))
+    return os.path.commonpath([root, target]) == root and target != root
+
+
+def shard_path(digest, ext):
+    """uploads/ab/cd/abcd....ext - two levels of 256 shards."""
+    ext = (ext or '').lower()
+    if ext and not ext.startswith('.'):
+        ext = '.' + ext
+    return '/'.join([UPLOAD_PREFIX, digest[:2], digest[2:4], digest + ext])
+
+
+def store(content, ext, digest=None):
+    """
+    Store upload bytes and take one reference to them. Returns the path
+    relative to the static directory, as kept in AnalysisLog.image_path.
+    Pass `digest` when the caller already has the SHA-256 of `content`.
+    """
+    from .models import StoredImage
+
+    digest = digest or hashlib.sha256(content).hexdigest()
+    image_path = shard_path(digest, ext)
+    write_once(absolute_path(image_path), content)
+
+    now = timezone.now()
+    updated = StoredImage.objects.filter(digest=digest).update(
+        ref_count=F('ref_count') + 1, last_referenced=now)
+    if not updated:
+        try:
+            with transaction.atomic():
+                StoredImage.objects.create(digest=digest, path=image_path, size=len(content), ref_count=1)
+        except IntegrityError:
+            # Another request stored the same content first
+            StoredImage.objects.filter(digest=digest).update(
+                ref_count=F('ref_count') + 1, last_referenced=now)
+    # The collector may have removed an orphaned copy just before we took the reference
+    write_once(absolute_path(image_path), content)
+    return image_path
+
+
+def digest_of(image_path):
+    """SHA-256 of a stored upload's content, from its path; None for legacy paths."""
+    if not image_path or not image_path.startswith(UPLOAD_PREFIX + '/'):
+        return None
+    return os.path.splitext(os.path.basename(image_path))[0]
+
+
+def write_once(target, content):
+    if os.path.exists(target):
+        return
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    # Write under a unique name and rename, so readers never see half a file
+    tmp = f"{target}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(content)
+    os.replace(tmp, target)
+
+
+def release(image_paths):
+    """
+    Drop one reference per entry in image_paths (repeat a path to drop
+    several). Files of legacy uploads that predate this storage are removed
+    directly, but only when they resolve inside the static directory.
+    """
+    from .models import StoredImage
+
+    counts = {}
+    for image_path in image_paths:
+        if image_path:
+            counts[image_path] = counts.get(image_path, 0) + 1
+    if not counts:
+        return
+
+    known = set(StoredImage.objects.filter(path__in=list(counts)).values_list('path', flat=True))
+    # One UPDATE per distinct decrement rather than per file
+    by_delta = {}
+    for image_path in known:
+        by_delta.setdefault(counts[image_path], []).append(image_path)
+    now = timezone.now()
+    for delta, paths in by_delta.items():
+        StoredImage.objects.filter(path__in=paths).update(ref_count=F('ref_count') - delta, last_referenced=now)
+
+    for image_path in counts:
+        if image_path in known or image_path.startswith(UPLOAD_PREFIX + '/'):
+            continue
+        # Anything else a log row points at is only ours to delete if it
+        # lives under the static directory (never absolute paths or ../)
+        if is_inside_static(image_path):
+            try:
+                os.remove(absolute_path(image_path))
+            except OSError:
+                pass
+
+
+def prune_expired_analyses(ttl_days, batch=1000):
+    """Delete analyses older than the TTL and release their files. Returns rows deleted."""
+    from . import rollups
+    from .history_cache import bump_history_version
+    from .models import AnalysisLog
+
+    cutoff = timezone.now() - timedelta(days=ttl_days)
+    deleted = 0
+    while True:
+        rows = list(AnalysisLog.objects.filter(timestamp__lt=cutoff)
+                    .values_list('id', 'image_path', *rollups.ROW_FIELDS)[:batch])
+        if not rows:
+            return deleted
+        with transaction.atomic():
+            AnalysisLog.objects.filter(id__in=[row[0] for row in rows]).delete()
+            rollups.record_deleted([row[2:] for row in rows])
+        release([row[1] for row in rows])
+        bump_history_version(*{row[2] for row in rows})
+        deleted += len(rows)
+
+
+def collect_garbage(grace_seconds=None, batch=None, dry_run=False):
+    """
+    Remove orphaned files in bulk. A file is collected once its ref_count
+    has been zero for the grace period and no AnalysisLog points at it.
+    Returns (files removed, bytes freed).
+    """
+    from . import thumbnails, vector_index
+    from .models import AnalysisLog, StoredImage
+
+    config = get_retention_config()
+    grace = config['ORPHAN_GRACE_SECONDS'] if grace_seconds is None else grace_seconds
+    batch = batch or config['GC_BATCH']
+    cutoff = timezone.now() - timedelta(seconds=grace)
+
+    orphans = StoredImage.objects.filter(ref_count__lte=0, last_referenced__lt=cutoff).annotate(
+        referenced=Exists(AnalysisLog.objects.filter(image_path=OuterRef('path')))
+    ).filter(referenced=False)
+
+    removed = freed = 0
+    last_id = 0
+    while True:
+        rows = list(orphans.filter(id__gt=last_id).order_by('id').values_list('id', 'path', 'size')[:batch])
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        if dry_run:
+            removed += len(rows)
+            freed += sum(row[2] for row in rows)
+            continue
+        # Delete rows first (re-checking the refcount) so a concurrent re-upload
+        # either revives the row before this or recreates the file after it
+        ids = [row[0] for row in rows]
+        with transaction.atomic():
+            doomed = list(StoredImage.objects.filter(id__in=ids, ref_count__lte=0).values_list('id', 'path', 'size'))
+            StoredImage.objects.filter(id__in=[row[0] for row in doomed]).delete()
+        for _, image_path, size in doomed:
+            try:
+                os.remove(absolute_path(image_path))
+                removed += 1
+                freed += size
+            except OSError:
+                pass
+            thumbnails.remove(image_path)
+        vector_index.remove_digests([digest_of(image_path) for _, image_path, _ in doomed])
+    return removed, freed
+
+
+def run_retention(dry_run=False):
+    """One full retention pass: TTL pruning, orphan collection, then vector index upkeep."""
+    from . import vector_index
+
+    config = get_retention_config()
+    pruned = 0
+    if config['TTL_DAYS'] and not dry_run:
+        pruned = prune_expired_analyses(config['TTL_DAYS'], config['GC_BATCH'])
+    removed, freed = collect_garbage(dry_run=dry_run)
+    summary = {'pruned_analyses': pruned, 'files_removed': removed, 'bytes_freed': freed}
+    if not dry_run and os.path.exists(settings.DETECTION_MODEL_PATH):
+        # Compact deletions and (re)partition the current model's index when due
+        summary['vector_index'] = vector_index.get_index().maintain()
+    return summary
+
+
+_gc_thread = None
+_gc_lock = threading.Lock()
+
+
+def start_background_gc():
+    """
+    Start the periodic collector thread for this process (once). Called from
+    Detection/wsgi.py, so only processes that serve requests run it.
+    """
+    global _gc_thread
+    interval = get_retention_config()['GC_INTERVAL']
+    if not interval or _gc_thread is not None:
+        return
+    with _gc_lock:
+        if _gc_thread is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    run_retention()
+                except Exception:
+                    import traceback
+                    traceback.print_exc()
+                finally:
+                    close_old_connections()
+
+        _gc_thread = threading.Thread(target=loop, name='upload-gc', daemon=True)
+        _gc_thread.start()
@@ -1,3 +1,926 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from . import log_writer, memory, rollups, storage, vector_index, xai_pool
+from .admission import (FIDELITY_FULL, FIDELITY_GRADCAM, FIDELITY_REDUCED, FIDELITY_VERDICT,
+                        AdmissionController, AdmissionRejected)
+from .auth import clear_user_cache
+from .explainers import FIDELITY_EXPLAINERS, ExplainerBudgetExceeded, plan_explainers
+from .history_cache import bump_history_version
+from .models import AnalysisLog, AnalysisRollup, UserProfile
+
+# Per-request latency ceiling for the database-only views, in milliseconds
+LATENCY_BUDGET_MS = 250
+
+# History version tokens in the cache, as with a shared backend in production
+CACHE_TOKENS = override_settings(HISTORY_CACHE={'VERSION_SOURCE': 'cache'})
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class APIQueryBudgetTests(TestCase):
+    """
+    Query counts and latency for every API view. The list views must issue
+    the same number of queries however many rows there are (no N+1).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', 'alice@example.com', 'secret')
+        cls.admin = User.objects.create_superuser('root', 'root@example.com', 'secret')
+        UserProfile.objects.create(user=cls.user, mobile='9876543210')
+        cls.add_logs(cls.user, 5)
+
+    def setUp(self):
+        # Test transactions roll back without post_save signals
+        clear_user_cache()
+        cache.clear()
+
+    @staticmethod
+    def add_logs(user, count):
+        # Through the rollups, like the log writer
+        rollups.record_inserted(AnalysisLog.objects.bulk_create([
+            AnalysisLog(user=user, image_path=f'missing-{user.id}-{i}.png', is_real=bool(i % 2),
+                        confidence=80.0, real_prob=60.0, fake_prob=40.0, image_hash=f'{user.id:08x}{i:024x}')
+            for i in range(count)
+        ]))
+
+    def call(self, method, url, user=None, max_queries=None, data=None, **extra):
+        if user is not None:
+            extra['HTTP_X_USER_ID'] = str(user.id)
+        if data is not None:
+            extra.setdefault('content_type', 'application/json')
+            data = json.dumps(data)
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = getattr(self.client, method)(url, data, **extra) if data is not None \
+                else getattr(self.client, method)(url, **extra)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+        if max_queries is not None:
+            self.assertLessEqual(
+                len(queries), max_queries,
+                f'{method.upper()} {url} ran {len(queries)} queries:\n' +
+                '\n'.join(q['sql'] for q in queries.captured_queries))
+        self.assertLess(elapsed_ms, LATENCY_BUDGET_MS, f'{method.upper()} {url} took {elapsed_ms:.0f} ms')
+        return response, len(queries)
+
+    @CACHE_TOKENS
+    def test_history_is_constant_in_rows(self):
+        response, few = self.call('get', '/api/history', self.user, max_queries=2)
+        self.assertEqual(len(response.json()['history']), 5)
+        self.add_logs(self.user, 50)
+        bump_history_version(self.user.id)
+        clear_user_cache()
+        response, many = self.call('get', '/api/history', self.user)
+        self.assertEqual(len(response.json()['history']), 55)
+        self.assertEqual(few, many)
+
+    @CACHE_TOKENS
+    def test_repeat_history_is_served_from_cache(self):
+        first, _ = self.call('get', '/api/history', self.user)
+        second, queries = self.call('get', '/api/history', self.user)
+        self.assertEqual(queries, 0)
+        self.assertEqual(first.content, second.content)
+
+    @CACHE_TOKENS
+    def test_history_etag(self):
+        response, _ = self.call('get', '/api/history', self.user)
+        etag = response['ETag']
+        response, queries = self.call('get', '/api/history', self.user, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, queries), (304, 0))
+        self.call('delete', '/api/history/clear', self.user)
+        response, _ = self.call('get', '/api/history', self.user, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['history'], [])
+        self.assertNotEqual(response['ETag'], etag)
+
+    @override_settings(HISTORY_CACHE={'VERSION_SOURCE': 'auto'})
+    def test_history_version_from_database_with_process_local_cache(self):
+        response, _ = self.call('get', '/api/history', self.user)
+        etag = response['ETag']
+        response, queries = self.call('get', '/api/history', self.user, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, queries), (304, 1))
+        # Another worker wrote a row; nothing in this process was bumped
+        self.add_logs(self.user, 1)
+        response, _ = self.call('get', '/api/history', self.user, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['history']), 6)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_session_requests_do_not_write_the_session(self):
+        self.client.post('/api/login', json.dumps({'username': 'alice', 'password': 'secret'}),
+                         content_type='application/json')
+        self.call('get', '/api/history')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/history')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q for q in queries.captured_queries if 'django_session' in q['sql']])
+        self.assertEqual(len(queries), 0)
+
+    def test_profile_update_invalidates_cached_user(self):
+        self.call('get', '/api/profile', self.user)
+        self.call('put', '/api/profile', self.user, data={'first_name': 'Alicia'})
+        response, _ = self.call('get', '/api/profile', self.user)
+        self.assertEqual(response.json()['profile']['first_name'], 'Alicia')
+
+    def test_admin_logs_is_constant_in_rows_and_users(self):
+        response, few = self.call('get', '/api/admin/logs', self.admin, max_queries=3)
+        self.assertEqual(response.status_code, 200)
+        for i in range(10):
+            self.add_logs(User.objects.create_user(f'user{i}', f'user{i}@example.com', 'secret'), 5)
+        clear_user_cache()
+        response, many = self.call('get', '/api/admin/logs', self.admin)
+        body = response.json()
+        self.assertEqual(len(body['logs']), 55)
+        alice = next(u for u in body['users'] if u['username'] == 'alice')
+        self.assertEqual((alice['total_analyses'], alice['real_count'], alice['fake_count']), (5, 2, 3))
+        self.assertEqual(few, many)
+
+    def test_admin_logs_requires_superuser(self):
+        response, _ = self.call('get', '/api/admin/logs', self.user, max_queries=1)
+        self.assertEqual(response.status_code, 403)
+
+    def test_clear_history(self):
+        response, _ = self.call('delete', '/api/history/clear', self.user, max_queries=6)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(AnalysisLog.objects.filter(user=self.user).exists())
+
+    def test_profile(self):
+        response, _ = self.call('get', '/api/profile', self.user, max_queries=2)
+        self.assertEqual(response.json()['profile']['mobile'], '9876543210')
+        response, _ = self.call('put', '/api/profile', self.user, max_queries=8, data={'first_name': 'Alice'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_check_availability(self):
+        response, _ = self.call('post', '/api/check-availability', max_queries=1,
+                                data={'field': 'username', 'value': 'ALICE'})
+        self.assertFalse(response.json()['available'])
+
+    def test_register(self):
+        response, _ = self.call('post', '/api/register', max_queries=8, data={
+            'name': 'Bob', 'username': 'bob', 'password': 'secret', 'email': 'bob@example.com'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_login_and_logout(self):
+        response, _ = self.call('post', '/api/login', max_queries=10,
+                                data={'username': 'alice', 'password': 'secret'})
+        self.assertEqual(response.status_code, 200)
+        response, _ = self.call('post', '/api/logout', max_queries=5)
+        self.assertEqual(response.status_code, 200)
+
+    def test_reset_password(self):
+        response, _ = self.call('post', '/api/reset-password', max_queries=3,
+                                data={'email': 'alice@example.com', 'password': 'new-secret'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_admin_user_update(self):
+        response, _ = self.call('put', f'/api/admin/user/{self.user.id}', self.admin, max_queries=5,
+                                data={'first_name': 'Alice'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_admin_user_delete(self):
+        response, _ = self.call('delete', f'/api/admin/user/{self.user.id}', self.admin, max_queries=15)
+        self.assertEqual(response.status_code, 200)
+
+    def test_explanation_render_unknown_hash(self):
+        response, _ = self.call('get', '/api/explanation/render?hash=0123abcd', self.user, max_queries=2)
+        self.assertEqual(response.status_code, 404)
+
+    def test_predict_video_without_upload(self):
+        response, _ = self.call('post', '/api/predict/video', self.user, max_queries=0)
+        self.assertEqual(response.status_code, 400)
+
+    def test_predict_reduced_upload_requires_original_hash(self):
+        upload = SimpleUploadedFile('small.jpg', b'not decoded', content_type='image/jpeg')
+        response = self.client.post('/api/predict', {'image': upload, 'reduced': '1', 'original_hash': 'abc123'},
+                                    HTTP_X_USER_ID=str(self.user.id))
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(ANALYSIS_LOG_WRITER={'ENABLED': False})
+    def test_predict(self):
+        if not os.path.exists(settings.DETECTION_MODEL_PATH):
+            self.skipTest('model weights not available')
+        image = os.path.join(settings.BASE_DIR, 'testImages', sorted(os.listdir(
+            os.path.join(settings.BASE_DIR, 'testImages')))[0])
+        # Warm the model so the measured request is a steady-state one
+        with open(image, 'rb') as f:
+            self.client.post('/api/predict', {'image': f})
+        with open(image, 'rb') as f, CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/predict', {'image': f}, HTTP_X_USER_ID=str(self.user.id))
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(queries), 12)
+
+
+class ProfilingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', 'alice@example.com', 'secret')
+        cls.admin = User.objects.create_superuser('root', 'root@example.com', 'secret')
+
+    def setUp(self):
+        clear_user_cache()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        override = override_settings(REQUEST_PROFILING={'ENABLED': False, 'DIR': directory})
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_superuser_can_profile_a_request(self):
+        response = self.client.get('/api/history', HTTP_X_USER_ID=str(self.admin.id), HTTP_X_PROFILE='inline')
+        profile = response.json()['profile']
+        self.assertEqual(response['X-Profile-Id'], profile['id'])
+        self.assertIn('function calls', profile['stats'])
+
+        listing = self.client.get('/api/admin/profiles', HTTP_X_USER_ID=str(self.admin.id)).json()
+        self.assertEqual([p['id'] for p in listing['profiles']], [profile['id']])
+        saved = self.client.get(f"/api/admin/profiles/{profile['id']}", HTTP_X_USER_ID=str(self.admin.id))
+        self.assertEqual(saved.json()['profile']['path'], '/api/history')
+
+    def test_other_users_are_not_profiled(self):
+        response = self.client.get('/api/history', HTTP_X_USER_ID=str(self.user.id), HTTP_X_PROFILE='inline')
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertNotIn('profile', response.json())
+        response = self.client.get('/api/admin/profiles', HTTP_X_USER_ID=str(self.user.id))
+        self.assertEqual(response.status_code, 403)
+
+    def test_unknown_profile_id(self):
+        response = self.client.get('/api/admin/profiles/..%2Fsettings', HTTP_X_USER_ID=str(self.admin.id))
+        self.assertEqual(response.status_code, 404)
+
+
+class MemoryAccountingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', 'alice@example.com', 'secret')
+        cls.admin = User.objects.create_superuser('root', 'root@example.com', 'secret')
+
+    def setUp(self):
+        clear_user_cache()
+
+    def test_metrics_report_per_endpoint_deltas(self):
+        self.client.get('/api/history', HTTP_X_USER_ID=str(self.user.id))
+        response = self.client.get('/api/admin/metrics', HTTP_X_USER_ID=str(self.admin.id))
+        data = response.json()['memory']
+        self.assertEqual(data['process']['pid'], os.getpid())
+        self.assertGreaterEqual(data['endpoints']['GET history_api']['requests'], 1)
+        self.assertIn('rss_delta_avg_kb', data['endpoints']['GET history_api'])
+
+    def test_metrics_require_superuser(self):
+        response = self.client.get('/api/admin/metrics', HTTP_X_USER_ID=str(self.user.id))
+        self.assertEqual(response.status_code, 403)
+
+    def test_recycles_once_after_request_limit(self):
+        config = dict(memory.DEFAULT_MEMORY_ACCOUNTING, WARMUP_REQUESTS=1, RECYCLE_AFTER_REQUESTS=3)
+        accountant = memory.MemoryAccountant(config)
+        with mock.patch('DetectionApp.memory.os.kill') as kill:
+            for _ in range(2):
+                accountant.after('GET test', accountant.before())
+                self.assertFalse(accountant.recycle_if_due())
+            accountant.after('GET test', accountant.before())
+            self.assertTrue(accountant.recycle_if_due())
+            self.assertFalse(accountant.recycle_if_due())
+        kill.assert_called_once_with(os.getpid(), signal.SIGTERM)
+
+
+class XAIPoolTransferTests(SimpleTestCase):
+
+    def round_trip(self):
+        import numpy as np
+        result = {'name': 'lime', 'label': 1, 'weights': [(3, 0.5)], 'num_features': 5,
+                  'segments': np.arange(12).reshape(3, 4)}
+        blocks = []
+        shared = xai_pool.share_result(result, blocks)
+        try:
+            loaded = xai_pool.load_result(shared)
+        finally:
+            xai_pool.release(blocks)
+        self.assertEqual(loaded['weights'], result['weights'])
+        self.assertEqual(loaded['segments'].dtype, result['segments'].dtype)
+        self.assertTrue((loaded['segments'] == result['segments']).all())
+        return shared, blocks
+
+    @skipIf(xai_pool.shared_memory is None, 'multiprocessing.shared_memory needs Python 3.8+')
+    def test_results_round_trip_through_shared_memory(self):
+        shared, blocks = self.round_trip()
+        self.assertIn('shm', shared['segments']['__array__'])
+        self.assertEqual(len(blocks), 1)
+
+    def test_results_round_trip_pickled_without_shared_memory(self):
+        with mock.patch.object(xai_pool, 'shared_memory', None):
+            shared, blocks = self.round_trip()
+        self.assertIn('array', shared['segments']['__array__'])
+        self.assertEqual(blocks, [])
+
+    def test_worker_errors_become_xai_errors(self):
+        import numpy as np
+        from concurrent.futures import Future
+        future = Future()
+        future.set_exception(FileNotFoundError('input block already unlinked'))
+        pool = mock.Mock()
+        pool.submit.return_value = future
+        with mock.patch.object(xai_pool, 'get_pool', return_value=pool), \
+                mock.patch.object(xai_pool, 'shared_memory', None), self.assertRaises(xai_pool.XAIError):
+            xai_pool.explain(np.zeros((8, 8, 3), 'uint8'), np.zeros((1, 32, 32, 3), 'float32'), [0.4, 0.6],
+                             'Real', ['gradcam'], {}, size=64)
+
+
+class VectorIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        import numpy as np
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        self.index = vector_index.VectorIndex(directory, dict(vector_index.DEFAULT_VECTOR_INDEX, BLOCK_ROWS=64))
+        rng = np.random.RandomState(1)
+        self.vectors = rng.rand(300, 16).astype('float32')
+        self.digests = [f'{i:064x}' for i in range(300)]
+        self.assertEqual(self.index.add_many(self.digests, self.vectors), 300)
+
+    def test_search_finds_itself_first(self):
+        hits = self.index.search(self.vectors[42], k=5)
+        self.assertEqual(hits[0][0], self.digests[42])
+        self.assertAlmostEqual(hits[0][1], 1.0, places=2)
+        self.assertFalse(self.index.add(self.digests[42], self.vectors[42]))
+
+    def test_deletions_and_compaction(self):
+        self.assertEqual(self.index.remove(self.digests[:100] + self.digests[:5] + ['f' * 64]), 100)
+        self.assertEqual(self.index.remove(self.digests[:5]), 0)
+        self.assertIsNone(self.index.get(self.digests[0]))
+        self.assertNotIn(self.digests[0], [d for d, _ in self.index.search(self.vectors[0], k=10)])
+        self.assertEqual(self.index.compact(), 100)
+        self.assertEqual(len(self.index), 200)
+        self.assertEqual(self.index.search(self.vectors[150], k=1)[0][0], self.digests[150])
+
+    def test_partitioned_search_and_restricted_rows(self):
+        self.index.train(lists=8)
+        self.index.add('f' * 64, self.vectors[7] * 2)
+        hits = self.index.search(self.vectors[7], k=2, probe=8)
+        self.assertEqual({d for d, _ in hits}, {self.digests[7], 'f' * 64})
+        rows = self.index.rows_for(self.digests[10:20])
+        self.assertIn(self.index.search(self.vectors[7], k=3, rows=rows)[0][0], self.digests[10:20])
+
+
+class ExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', 'alice@example.com', 'secret')
+        cls.admin = User.objects.create_superuser('root', 'root@example.com', 'secret')
+        APIQueryBudgetTests.add_logs(cls.user, 3)
+        APIQueryBudgetTests.add_logs(cls.admin, 2)
+
+    def setUp(self):
+        clear_user_cache()
+
+    def export(self, query):
+        response = self.client.get('/api/admin/export' + query, HTTP_X_USER_ID=str(self.admin.id))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_csv_with_columns_and_user_filter(self):
+        body = self.export('?columns=id,username,is_real&user=alice').decode()
+        lines = body.splitlines()
+        self.assertEqual(lines[0], 'id,username,is_real')
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(all(',alice,' in line for line in lines[1:]))
+
+    def test_gzipped_jsonl(self):
+        import gzip
+        rows = [json.loads(line) for line in gzip.decompress(self.export('?format=jsonl&gzip=1')).splitlines()]
+        self.assertEqual(len(rows), 5)
+        self.assertNotIn('explanation_image', rows[0])
+
+    def test_rejects_unknown_columns_and_non_admins(self):
+        response = self.client.get('/api/admin/export?columns=password', HTTP_X_USER_ID=str(self.admin.id))
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/admin/export', HTTP_X_USER_ID=str(self.user.id))
+        self.assertEqual(response.status_code, 403)
+
+
+class RollupTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', 'alice@example.com', 'secret')
+        cls.admin = User.objects.create_superuser('root', 'root@example.com', 'secret')
+        APIQueryBudgetTests.add_logs(cls.user, 6)
+
+    def setUp(self):
+        clear_user_cache()
+
+    def snapshot(self):
+        return sorted(AnalysisRollup.objects.values_list('user_id', 'period', 'bucket', 'total', 'real_count',
+                                                         'confidence_sum', *rollups.HIST_FIELDS))
+
+    def test_incremental_matches_rebuild(self):
+        incremental = self.snapshot()
+        rollups.rebuild()
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_clear_history_decrements(self):
+        self.client.delete('/api/history/clear', HTTP_X_USER_ID=str(self.user.id))
+        self.assertFalse(AnalysisRollup.objects.filter(user=self.user, total__gt=0).exists())
+
+    def test_trends_read_only_rollups(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/admin/trends?period=hour', HTTP_X_USER_ID=str(self.admin.id))
+        body = response.json()
+        self.assertEqual(sum(point['total'] for point in body['points']), 6)
+        self.assertFalse([q for q in queries.captured_queries if '"DetectionApp_analysislog"' in q['sql']])
+
+
+class ScanDirectoryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', 'alice@example.com', 'secret')
+
+    def setUp(self):
+        clear_user_cache()
+        self.static_dir = tempfile.mkdtemp()
+        self.source_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.static_dir, True)
+        self.addCleanup(shutil.rmtree, self.source_dir, True)
+        patcher = mock.patch.object(storage, 'STATIC_DIR', self.static_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def scan(self, path, content):
+        import contextlib
+        import hashlib
+        import io
+        import numpy as np
+        from .management.commands.scan_directory import Command
+
+        model = mock.Mock()
+        model.predict.side_effect = lambda inputs, batch_size: np.array([[0.2, 0.8]] * len(inputs))
+        batch = [(path, hashlib.sha256(content).hexdigest(), np.zeros((32, 32, 3), 'uint8'), None, None)]
+        with mock.patch('DetectionApp.runtime.inference_context', contextlib.nullcontext):
+            return Command()._process(batch, model, [], set(), None, io.StringIO(), 'jsonl', self.user)
+
+    def test_logged_rows_reference_a_stored_copy(self):
+        source = os.path.join(self.source_dir, 'audited.png')
+        with open(source, 'wb') as f:
+            f.write(b'original evidence')
+        self.assertEqual(self.scan(source, b'original evidence'), (1, 0, 0))
+        log = AnalysisLog.objects.get(user=self.user)
+        self.assertTrue(log.image_path.startswith(storage.UPLOAD_PREFIX + '/'))
+        self.assertTrue(os.path.exists(storage.absolute_path(log.image_path)))
+
+        self.client.delete('/api/history/clear', HTTP_X_USER_ID=str(self.user.id))
+        storage.collect_garbage(grace_seconds=0)
+        self.assertTrue(os.path.exists(source))
+
+    def test_changed_file_is_logged_without_a_path(self):
+        source = os.path.join(self.source_dir, 'changed.png')
+        with open(source, 'wb') as f:
+            f.write(b'edited after hashing')
+        self.scan(source, b'as hashed')
+        self.assertEqual(AnalysisLog.objects.get(user=self.user).image_path, '')
+
+    def test_resume_continues_after_the_last_path(self):
+        from .management.commands.scan_directory import walk_images
+        for name in ('a/1.png', 'a/2.png', 'b/1.png', 'b/c/3.png', 'c.png'):
+            path = os.path.join(self.source_dir, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, 'wb').close()
+        relative = lambda paths: [os.path.relpath(p, self.source_dir) for p in paths]
+        last = os.path.join(self.source_dir, 'b', '1.png')
+        self.assertEqual(relative(walk_images(self.source_dir, after=last)), ['b/c/3.png', 'c.png'])
+        # Files added before it and the last path itself disappearing don't shift the resume point
+        open(os.path.join(self.source_dir, 'a', '0.png'), 'wb').close()
+        os.remove(last)
+        self.assertEqual(relative(walk_images(self.source_dir, after=last)), ['b/c/3.png', 'c.png'])
+
+
+class StorageTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', 'alice@example.com', 'secret')
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, True)
+        self.static_dir = os.path.join(self.root, 'static')
+        os.makedirs(self.static_dir)
+        patcher = mock.patch.object(storage, 'STATIC_DIR', self.static_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def touch(self, path):
+        with open(path, 'wb') as f:
+            f.write(b'x')
+        return path
+
+    def test_release_only_removes_legacy_files_inside_static(self):
+        legacy = self.touch(os.path.join(self.static_dir, 'legacy.png'))
+        outside = self.touch(os.path.join(self.root, 'outside.png'))
+        storage.release(['legacy.png', outside, '../outside.png', 'sub/../../outside.png'])
+        self.assertFalse(os.path.exists(legacy))
+        self.assertTrue(os.path.exists(outside))
+
+    def test_refcounts_and_garbage_collection(self):
+        from .models import StoredImage
+        first = storage.store(b'same bytes', '.png')
+        second = storage.store(b'same bytes', 'png')
+        self.assertEqual(first, second)
+        self.assertEqual(StoredImage.objects.get(path=first).ref_count, 2)
+
+        storage.release([first])
+        self.assertEqual(storage.collect_garbage(grace_seconds=0), (0, 0))
+        storage.release([first])
+        self.assertTrue(os.path.exists(storage.absolute_path(first)))
+        # Still inside the grace period
+        self.assertEqual(storage.collect_garbage(grace_seconds=3600), (0, 0))
+        self.assertEqual(storage.collect_garbage(grace_seconds=0), (1, len(b'same bytes')))
+        self.assertFalse(os.path.exists(storage.absolute_path(first)))
+        self.assertFalse(StoredImage.objects.filter(path=first).exists())
+
+    def test_files_still_logged_are_not_collected(self):
+        path = storage.store(b'logged', '.jpg')
+        AnalysisLog.objects.create(user=self.user, image_path=path, is_real=True, confidence=90.0,
+                                   real_prob=90.0, fake_prob=10.0)
+        storage.release([path])
+        self.assertEqual(storage.collect_garbage(grace_seconds=0), (0, 0))
+        self.assertTrue(os.path.exists(storage.absolute_path(path)))
+
+
+class LogWriterTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', 'alice@example.com', 'secret')
+
+    def setUp(self):
+        self.writer = log_writer.AnalysisLogWriter(max_batch=100, flush_interval=3600, max_retries=2)
+        # Flush explicitly from the test thread, which owns the test transaction
+        patcher = mock.patch.object(self.writer, '_ensure_thread')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def submit(self, image_hash, confidence=80.0):
+        self.writer.submit(self.user.id, image_path='', image_hash=image_hash, is_real=True,
+                           confidence=confidence, real_prob=confidence, fake_prob=100 - confidence)
+
+    def failing_writes(self):
+        from django.db import OperationalError
+        return mock.patch.object(AnalysisLog.objects, 'bulk_create',
+                                 side_effect=OperationalError('database is locked'))
+
+    def test_flush_writes_and_clears_pending(self):
+        self.submit('a' * 64)
+        self.assertEqual(len(self.writer.pending_for(self.user.id)), 1)
+        self.writer.flush()
+        self.assertEqual(AnalysisLog.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(self.writer.pending_for(self.user.id), [])
+
+    def test_newest_record_for_a_hash_wins(self):
+        self.submit('b' * 64, confidence=60.0)
+        self.writer.flush()
+        self.submit('b' * 64, confidence=70.0)
+        self.submit('b' * 64, confidence=90.0)
+        self.writer.flush()
+        self.assertEqual(list(AnalysisLog.objects.filter(user=self.user).values_list('confidence', flat=True)),
+                         [90.0])
+
+    def test_failed_batch_is_requeued(self):
+        self.submit('c' * 64)
+        with self.failing_writes(), self.assertRaises(Exception):
+            self.writer.flush()
+        self.assertFalse(AnalysisLog.objects.filter(user=self.user).exists())
+        self.assertEqual((self.writer.backlog(), len(self.writer.pending_for(self.user.id))), (1, 1))
+        self.writer.flush()
+        self.assertEqual(AnalysisLog.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(self.writer.pending_for(self.user.id), [])
+
+    def test_records_are_dropped_after_max_retries(self):
+        self.submit('d' * 64)
+        with self.failing_writes():
+            for _ in range(3):
+                with self.assertRaises(Exception):
+                    self.writer.flush()
+        self.assertEqual((self.writer.backlog(), self.writer.dropped), (0, 1))
+        self.assertEqual(self.writer.pending_for(self.user.id), [])
+
+    def test_dropped_records_release_their_upload(self):
+        from .models import StoredImage
+        static_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static_dir, True)
+        with mock.patch.object(storage, 'STATIC_DIR', static_dir):
+            path = storage.store(b'upload', '.png')
+            self.writer.submit(self.user.id, image_path=path, image_hash='e' * 64, is_real=True,
+                               confidence=80.0, real_prob=80.0, fake_prob=20.0)
+            with self.failing_writes():
+                for _ in range(3):
+                    with self.assertRaises(Exception):
+                        self.writer.flush()
+            self.assertEqual(StoredImage.objects.get(path=path).ref_count, 0)
+            self.assertEqual(storage.collect_garbage(grace_seconds=0), (1, len(b'upload')))
+
+
+class ScanModeTests(TestCase):
+
+    def upload(self):
+        import cv2
+        import numpy as np
+        ok, data = cv2.imencode('.png', np.zeros((64, 64, 3), 'uint8'))
+        return SimpleUploadedFile('scan.png', data.tobytes(), content_type='image/png')
+
+    def test_options_are_validated(self):
+        from .scanning import parse_scan_options
+        self.assertEqual(parse_scan_options('8', '1,0.5', '10'), {'stride': 8, 'scales': [1.0, 0.5], 'max_patches': 10})
+        self.assertEqual(parse_scan_options(max_patches='999999')['max_patches'],
+                         settings.SCAN_MODE['MAX_PATCHES'])
+        for stride, scales in (('0', None), ('x', None), (None, '50'), (None, '0'), (None, 'a,b'),
+                               (None, ','.join(['0.5'] * 20))):
+            with self.assertRaises(ValueError):
+                parse_scan_options(stride, scales)
+
+    def test_predict_rejects_bad_scan_parameters(self):
+        for params in ({'stride': '0'}, {'stride': 'wide'}, {'scales': '50'}, {'scales': '1,1,1,1,1,1'}):
+            response = self.client.post('/api/predict', dict(params, image=self.upload(), mode='scan'))
+            self.assertEqual(response.status_code, 400, params)
+
+    def test_scales_fit_the_patch_budget(self):
+        from .scanning import plan_scales
+        plans = plan_scales((512, 512, 3), (1.0, 0.5, 0.05), 16, 500)
+        self.assertEqual([scale for scale, _, _ in plans], [1.0, 0.5])  # 0.05 is smaller than a patch
+        total = sum(((h - 32) // stride + 1) * ((w - 32) // stride + 1) for _, stride, (h, w) in plans)
+        self.assertLessEqual(total, 500)
+
+    def test_budget_below_the_scale_count(self):
+        from .scanning import parse_scan_options, plan_scales
+        plans = plan_scales((3000, 4000, 3), (1.0, 0.5, 0.25), 16, 2)
+        self.assertEqual([(scale, ((h - 32) // s + 1) * ((w - 32) // s + 1)) for scale, s, (h, w) in plans],
+                         [(1.0, 1), (0.5, 1)])
+        self.assertEqual(plan_scales((3000, 4000, 3), (1.0, 0.5), 16, 0), [])
+        with self.assertRaises(ValueError):
+            parse_scan_options(scales='1,0.5,0.25', max_patches='2')
+        with self.assertRaises(ValueError):
+            parse_scan_options(max_patches=str(len(settings.SCAN_MODE['SCALES']) - 1))
+
+    def test_scan_localises_the_suspicious_region(self):
+        import numpy as np
+        from .scanning import scan_image
+
+        class BrightIsFake:
+            def predict(self, batch, batch_size=None):
+                fake = batch.mean(axis=(1, 2, 3))
+                return np.stack([fake, 1 - fake], axis=1)
+
+        image = np.zeros((256, 256, 3), 'uint8')
+        image[:64, -64:] = 255
+        result = scan_image(image, BrightIsFake(), stride=16, scales=[1.0, 0.5], max_patches=1000)
+        row, col = np.unravel_index(np.argmax(result['heatmap']), result['heatmap'].shape)
+        self.assertLess(row, result['heatmap'].shape[0] // 2)
+        self.assertGreater(col, result['heatmap'].shape[1] // 2)
+        self.assertEqual(result['patches'], sum(entry['patches'] for entry in result['scales']))
+        self.assertAlmostEqual(result['fake_prob'] + result['real_prob'], 1.0)
+        # Batching under a small memory cap doesn't change the scores
+        capped = scan_image(image, BrightIsFake(), stride=16, scales=[1.0, 0.5], max_patches=1000,
+                            memory_cap_bytes=32 * 32 * 3 * 4 * 10)
+        self.assertAlmostEqual(capped['fake_prob'], result['fake_prob'], places=5)
+
+        tiny = scan_image(np.zeros((20, 20, 3), 'uint8'), BrightIsFake())
+        self.assertEqual(tiny['patches'], 1)
+
+
+@override_settings(DETECTION_MODEL_PATH=__file__)
+class VideoStreamCleanupTests(TestCase):
+
+    def setUp(self):
+        import functools
+        from .admission import get_controller
+        self.controller = get_controller()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir, True)
+        patcher = mock.patch('tempfile.NamedTemporaryFile',
+                             functools.partial(tempfile.NamedTemporaryFile, dir=self.tmp_dir))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self):
+        upload = SimpleUploadedFile('clip.mp4', b'\x00' * 1024, content_type='video/mp4')
+        return self.client.post('/api/predict/video', {'video': upload})
+
+    def test_closing_unread_response_releases_slot_and_upload(self):
+        before = self.controller.stats()['in_flight']
+        response = self.post()
+        self.assertEqual(self.controller.stats()['in_flight'], before + 1)
+        self.assertEqual(len(os.listdir(self.tmp_dir)), 1)
+        # The client went away before the body was iterated
+        response.close()
+        self.assertEqual(self.controller.stats()['in_flight'], before)
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+
+    def test_failed_upload_write_releases_slot(self):
+        before = self.controller.stats()['in_flight']
+        with mock.patch('django.core.files.uploadedfile.InMemoryUploadedFile.chunks', side_effect=OSError('disk full')):
+            response = self.post()
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.controller.stats()['in_flight'], before)
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+
+
+class ExplainerPlanTests(SimpleTestCase):
+
+    def names(self, *args, **kwargs):
+        plan, skipped = plan_explainers(*args, **kwargs)
+        return [explainer.name for explainer in plan], skipped
+
+    def test_default_plan_per_fidelity(self):
+        for fidelity, names in FIDELITY_EXPLAINERS.items():
+            self.assertEqual(self.names(fidelity=fidelity), (names, []))
+
+    def test_explicit_spec_within_budget_runs_in_full_at_full_fidelity(self):
+        self.assertEqual(self.names('gradcam,occlusion,lime', fidelity=FIDELITY_FULL),
+                         (['gradcam', 'occlusion', 'lime'], []))
+
+    def test_explicit_spec_over_budget_is_rejected(self):
+        with self.assertRaises(ExplainerBudgetExceeded):
+            plan_explainers('gradcam,lime', budget=100)
+        with self.assertRaises(ValueError):
+            plan_explainers('gradcam,shap')
+
+    def test_load_shedding_reports_skipped_explainers(self):
+        self.assertEqual(self.names('gradcam,occlusion,lime', fidelity=FIDELITY_REDUCED),
+                         (['gradcam', 'occlusion'], ['lime']))
+        self.assertEqual(self.names('lime_fast', fidelity=FIDELITY_VERDICT), ([], ['lime_fast']))
+
+
+class AdmissionTests(SimpleTestCase):
+
+    def controller(self, max_in_flight=1, max_queue=2, queue_timeout=5):
+        return AdmissionController(max_in_flight, max_queue, queue_timeout, retry_after=3,
+                                   fidelity_steps=[(0, FIDELITY_FULL), (1, FIDELITY_REDUCED), (2, FIDELITY_GRADCAM)])
+
+    def wait_for(self, controller, waiting):
+        deadline = time.monotonic() + 5
+        while controller.stats()['waiting'] != waiting:
+            self.assertLess(time.monotonic(), deadline, 'request never queued')
+            time.sleep(0.01)
+
+    def test_fidelity_steps(self):
+        controller = self.controller()
+        self.assertEqual([controller.fidelity_for_depth(depth) for depth in range(4)],
+                         [FIDELITY_FULL, FIDELITY_REDUCED, FIDELITY_GRADCAM, FIDELITY_GRADCAM])
+
+    def test_full_queue_is_rejected_with_retry_after(self):
+        controller = self.controller(max_queue=0)
+        with controller.admit() as fidelity:
+            self.assertEqual(fidelity, FIDELITY_FULL)
+            with self.assertRaises(AdmissionRejected) as rejected:
+                with controller.admit():
+                    pass
+            self.assertGreaterEqual(rejected.exception.retry_after, 3)
+        self.assertEqual(controller.stats(), {'in_flight': 0, 'waiting': 0, 'rejected': 1,
+                                              'max_in_flight': 1, 'max_queue': 0})
+
+    def test_queued_requests_get_lower_fidelity(self):
+        controller = self.controller()
+        fidelities = []
+
+        def request():
+            with controller.admit() as fidelity:
+                fidelities.append(fidelity)
+
+        with controller.admit():
+            first = threading.Thread(target=request)
+            first.start()
+            self.wait_for(controller, 1)
+            second = threading.Thread(target=request)
+            second.start()
+            self.wait_for(controller, 2)
+        first.join(5)
+        second.join(5)
+        self.assertEqual(sorted(fidelities), [FIDELITY_FULL, FIDELITY_REDUCED])
+        self.assertEqual(controller.stats()['in_flight'], 0)
+
+    def test_wait_times_out(self):
+        controller = self.controller(queue_timeout=0.05)
+        with controller.admit():
+            with self.assertRaises(AdmissionRejected):
+                with controller.admit():
+                    pass
+        stats = controller.stats()
+        self.assertEqual((stats['waiting'], stats['rejected']), (0, 1))
+
+    def test_slot_is_released_when_the_request_fails(self):
+        controller = self.controller()
+        with self.assertRaises(RuntimeError):
+            with controller.admit():
+                raise RuntimeError('boom')
+        self.assertEqual(controller.stats()['in_flight'], 0)
+        with controller.admit() as fidelity:
+            self.assertEqual(fidelity, FIDELITY_FULL)
+
+
+class ExplanationCacheTests(SimpleTestCase):
+
+    def lime_result(self):
+        import numpy as np
+        return {'name': 'lime', 'title': 'LIME', 'label': 1, 'segments': np.repeat(np.arange(16), 64).reshape(32, 32),
+                'num_features': 3, 'weights': [(4, 0.5), (9, 0.25), (2, -0.1), (7, 0.05)]}
+
+    def test_rle_round_trip(self):
+        import numpy as np
+        from .explanation_cache import rle_decode, rle_encode
+        labels = np.random.RandomState(0).randint(0, 5, size=(17, 23))
+        self.assertTrue(np.array_equal(rle_decode(rle_encode(labels)), labels))
+        self.assertEqual(len(rle_encode(self.lime_result()['segments'])['values']), 16)
+
+    def test_mask_round_trip_with_odd_size(self):
+        import numpy as np
+        from .explanation_cache import pack_mask, unpack_mask
+        mask = np.random.RandomState(1).randint(0, 2, size=(7, 9))
+        packed = pack_mask(mask)
+        self.assertEqual(packed['bits'].nbytes, 8)
+        self.assertTrue(np.array_equal(unpack_mask(packed), mask))
+
+    def test_lime_result_round_trip(self):
+        import numpy as np
+        from .explanation_cache import compact_result, expand_result
+        result = self.lime_result()
+        expanded = expand_result(compact_result(result))
+        self.assertTrue(np.array_equal(expanded['segments'], result['segments']))
+        self.assertEqual([seg for seg, _ in expanded['weights']], [4, 9, 2, 7])
+        np.testing.assert_allclose([w for _, w in expanded['weights']], [0.5, 0.25, -0.1, 0.05], rtol=1e-6)
+        self.assertTrue(np.array_equal(expanded['mask'], np.isin(result['segments'], [4, 9])))
+
+    def test_heatmap_is_quantized_to_a_byte(self):
+        import numpy as np
+        from .explanation_cache import compact_result, expand_result
+        heatmap = np.random.RandomState(2).rand(14, 14).astype('float32')
+        compact = compact_result({'name': 'gradcam', 'title': 'Grad-CAM', 'label': 0, 'heatmap': heatmap})
+        self.assertEqual(compact['heatmap'].dtype, np.uint8)
+        self.assertLessEqual(float(np.abs(expand_result(compact)['heatmap'] - heatmap).max()), 0.5 / 255 + 1e-6)
+
+    def test_results_are_keyed_by_hash_version_and_signature(self):
+        from .explanation_cache import ExplanationCache
+        explanations = ExplanationCache(1024 * 1024)
+        lime = mock.Mock(**{'signature.return_value': 'lime:100:3'})
+        other = mock.Mock(**{'signature.return_value': 'lime:500:3'})
+        explanations.put_result('abc', 'v1', lime, self.lime_result())
+        self.assertIsNotNone(explanations.get_result('abc', 'v1', lime))
+        self.assertIsNone(explanations.get_result('abc', 'v2', lime))
+        self.assertIsNone(explanations.get_result('abc', 'v1', other))
+        self.assertIsNone(explanations.get_result('def', 'v1', lime))
+
+    def test_entries_are_evicted_by_bytes(self):
+        import numpy as np
+        from .explanation_cache import ExplanationCache
+        explanations = ExplanationCache(4096)
+        img = np.zeros((1, 32, 32, 3), dtype='float32')
+        for i in range(4):
+            explanations.put_verdict(f'hash{i}', 'v1', [0.2, 0.8], img)
+        self.assertIsNone(explanations.get_verdict('hash0', 'v1'))
+        self.assertEqual(explanations.get_verdict('hash3', 'v1')['input'].dtype, np.uint8)
+
+
+@skipIf(connection.vendor != 'sqlite', 'SQLite tuning and query plans')
+class DatabaseTuningTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', 'alice@example.com', 'secret')
+        APIQueryBudgetTests.add_logs(cls.user, 20)
+
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def query_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return ' | '.join(str(row[-1]) for row in cursor.fetchall())
+
+    def test_connections_are_tuned(self):
+        self.assertEqual(self.pragma('synchronous'), 1)  # NORMAL
+        self.assertEqual(self.pragma('busy_timeout'), 20000)
+
+    def test_history_and_hash_lookups_are_served_in_index_order(self):
+        history = self.query_plan(AnalysisLog.objects.filter(user=self.user).order_by('-timestamp'))
+        self.assertIn('analysislog_user_ts_idx', history)
+        self.assertNotIn('TEMP B-TREE', history)
+        by_hash = self.query_plan(AnalysisLog.objects.filter(image_hash='0' * 64).order_by('-timestamp'))
+        self.assertIn('analysislog_hash_ts_idx', by_hash)
+        self.assertNotIn('TEMP B-TREE', by_hash)
@@ -0,0 +1,123 @@
+"""
+Thumbnail pyramid for stored uploads.
+
+When an upload is ingested, predict_api passes the already-decoded image
+here and a few downscaled copies (longest edge 64/150/512 px by default)
+are written next to the original:
+
+    uploads/ab/cd/<sha256>.png
+    uploads/ab/cd/<sha256>.t150.webp
+
+The names derive from the content hash, so a URL never changes meaning and
+is served with a one-year immutable Cache-Control. Thumbnails missing for
+older uploads are generated on first request from the original.
+"""
+import os
+import re
+
+import cv2
+from django.conf import settings
+
+from . import storage
+
+DEFAULT_THUMBNAILS = {
+    'SIZES': [64, 150, 512],
+    'FORMAT': 'webp',           # or 'jpg'
+    'QUALITY': 80,
+}
+
+URL_PREFIX = '/thumbs/'
+THUMB_RE = re.compile(r'^(?P<base>' + storage.UPLOAD_PREFIX +
+                      r'/[0-9a-f]{2}/[0-9a-f]{2}/(?P<digest>[0-9a-f]{64}))\.t(?P<size>[0-9]+)\.(?P<fmt>webp|jpg)$')
+
+
+def get_thumbnail_config():
+    config = dict(DEFAULT_THUMBNAILS)
+    config.update(getattr(settings, 'THUMBNAILS', {}) or {})
+    return config
+
+
+def thumbnail_path(image_path, size, fmt=None):
+    base = os.path.splitext(image_path)[0]
+    return f"{base}.t{size}.{fmt or get_thumbnail_config()['FORMAT']}"
+
+
+def downscale(image, size):
+    """Resize so the longest edge is at most `size`. Never upscales."""
+    height, width = image.shape[:2]
+    scale = min(1.0, float(size) / max(height, width))
+    if scale >= 1.0:
+        return image
+    return cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                      interpolation=cv2.INTER_AREA)
+
+
+def encode(image, fmt, quality):
+    params = [cv2.IMWRITE_WEBP_QUALITY, quality] if fmt == 'webp' else [cv2.IMWRITE_JPEG_QUALITY, quality]
+    ok, data = cv2.imencode('.' + fmt, image, params)
+    if not ok:
+        raise ValueError(f'Could not encode {fmt} thumbnail')
+    return data.tobytes()
+
+
+def generate(image_path, image):
+    """Write every configured thumbnail of a stored upload that doesn't exist yet."""
+    if not image_path.startswith(storage.UPLOAD_PREFIX + '/'):
+        return
+    config = get_thumbnail_config()
+    # Largest first, each level resized from the one above (INTER_AREA keeps
+    # it as sharp as resizing the original, at a fraction of the cost)
+    source = image
+    for size in sorted(config['SIZES'], reverse=True):
+        source = downscale(source, size)
+        target = storage.absolute_path(thumbnail_path(image_path, size, config['FORMAT']))
+        if not os.path.exists(target):
+            storage.write_once(target, encode(source, config['FORMAT'], config['QUALITY']))
+
+
+def thumbnail_urls(image_path):
+    """{size: url} for a stored upload, or None for legacy paths without thumbnails."""
+    if not image_path or not image_path.startswith(storage.UPLOAD_PREFIX + '/'):
+        return None
+    config = get_thumbnail_config()
+    return {str(size): URL_PREFIX + thumbnail_path(image_path, size, config['FORMAT'])
+            for size in config['SIZES']}
+
+
+def remove(image_path):
+    """Delete the thumbnails of an upload (the garbage collector calls this with the original)."""
+    base = os.path.splitext(os.path.basename(image_path))[0] + '.t'
+    directory = os.path.dirname(storage.absolute_path(image_path))
+    try:
+        names = [name for name in os.listdir(directory) if name.startswith(base)]
+    except OSError:
+        return
+    for name in names:
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+
+
+def resolve(thumb_path):
+    """
+    Filesystem path of a thumbnail, generating it from the original if it
+    is missing. None when the name isn't a valid thumbnail or the original
+    is gone.
+    """
+    match = THUMB_RE.match(thumb_path)
+    config = get_thumbnail_config()
+    if match is None or int(match.group('size')) not in config['SIZES']:
+        return None
+    target = storage.absolute_path(thumb_path)
+    if os.path.exists(target):
+        return target
+
+    from .models import StoredImage
+    original = StoredImage.objects.filter(digest=match.group('digest')).values_list('path', flat=True).first()
+    image = cv2.imread(storage.absolute_path(original)) if original else None
+    if image is None:
+        return None
+    storage.write_once(target, encode(downscale(image, int(match.group('size'))), match.group('fmt'),
+                                      config['QUALITY']))
+    return target
@@ -16,8 +16,17 @@ urlpatterns = [
     path('api/history/clear', views.clear_history_api, name='clear_history_api'),
     path('api/profile', views.profile_api, name='profile_api'),
     path('api/predict', views.predict_api, name='predict_api'),
+    path('api/predict/video', views.predict_video_api, name='predict_video_api'),
+    path('api/explanation/render', views.explanation_render_api, name='explanation_render_api'),
+    path('api/similar', views.similar_api, name='similar_api'),
+    path('thumbs/<path:path>', views.thumbnail_view, name='thumbnail'),
     
     # Admin API endpoints
     path('api/admin/logs', views.admin_logs_api, name='admin_logs_api'),
+    path('api/admin/export', views.admin_export_api, name='admin_export_api'),
+    path('api/admin/trends', views.admin_trends_api, name='admin_trends_api'),
     path('api/admin/user/<int:user_id>', views.admin_user_api, name='admin_user_api'),
+    path('api/admin/metrics', views.admin_metrics_api, name='admin_metrics_api'),
+    path('api/admin/profiles', views.admin_profiles_api, name='admin_profiles_api'),
+    path('api/admin/profiles/<str:profile_id>', views.admin_profile_api, name='admin_profile_api'),
 ]
\ No newline at end of file
@@ -0,0 +1,493 @@
+"""
+On-disk vector index of image embeddings for "similar past analyses".
+
+classifyImage captures the output of the CNN's Dense(256) layer in the same
+forward pass as the verdict. predict_api appends it here keyed by the
+upload's content digest (the StoredImage digest), and the upload garbage
+collector deletes it when the file is collected, so the index covers
+exactly the stored images. Search results are joined back to AnalysisLog,
+which stays the source of truth for what a caller may see.
+
+Layout, one directory per model version (embeddings from different
+weights aren't comparable):
+
+    meta.json               dim, row count, deletions, segment, IVF state
+    vectors-<seg>.f16       (capacity, dim) float16 unit vectors, memory-mapped
+    keys-<seg>.u8           (capacity, 32) raw SHA-256 digests
+    alive-<seg>.u8          (capacity,) 1 = live row, 0 = deleted
+    ivf-<seg>-<gen>.npz     centroids and row lists of the partitioned mode
+
+Appends write the row before bumping the count in meta.json, deletions
+clear the alive flag in place, and compaction writes a new segment before
+pointing meta.json at it, so readers in other processes never see a
+partial row. Writers serialise on a file lock.
+
+Search is a batched brute-force cosine scan (vectors are stored
+normalised, so cosine is a dot product). Once the index holds
+IVF_MIN_VECTORS rows, `manage.py vector_index train` (or the background
+retention pass) clusters it with k-means; queries then scan only the
+IVF_PROBE nearest partitions plus the rows appended since training.
+"""
+import json
+import os
+import threading
+
+import numpy as np
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialised within a process
+    fcntl = None
+
+DEFAULT_VECTOR_INDEX = {
+    'ENABLED': True,
+    'DIR': 'vector_index',
+    'BLOCK_ROWS': 65536,        # rows scored per matrix product
+    'IVF_MIN_VECTORS': 50000,   # partition the index once it is this large
+    'IVF_LISTS': 0,             # 0 = about sqrt(rows)
+    'IVF_PROBE': 8,             # partitions scanned per query
+    'IVF_TRAIN_SAMPLE': 100000,
+    'RETRAIN_FRACTION': 0.2,    # retrain once unpartitioned rows exceed this share
+    'COMPACT_FRACTION': 0.2,    # rewrite once this share of rows are deleted
+}
+
+KEY_BYTES = 32
+INITIAL_CAPACITY = 1024
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_vector_index_config():
+    config = dict(DEFAULT_VECTOR_INDEX)
+    config.update(getattr(settings, 'VECTOR_INDEX', {}) or {})
+    return config
+
+
+def normalize(vectors):
+    vectors = np.atleast_2d(np.asarray(vectors, dtype='float32'))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def digest_key(digest):
+    return np.frombuffer(bytes.fromhex(digest), dtype='uint8')
+
+
+class VectorIndex:
+    """One model version's index. Safe to share between threads."""
+
+    def __init__(self, directory, config=None):
+        self.directory = directory
+        self.config = config or get_vector_index_config()
+        self._lock = threading.RLock()
+        self._meta_stamp = None
+        self.meta = None
+        self.vectors = self.keys = self.alive = None
+        self.ivf = None
+
+    # Files and metadata --------------------------------------------------
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _data_path(self, kind, segment=None):
+        segment = self.meta['segment'] if segment is None else segment
+        return self._path({'vectors': f'vectors-{segment}.f16', 'keys': f'keys-{segment}.u8',
+                           'alive': f'alive-{segment}.u8'}[kind])
+
+    def _read_meta(self):
+        try:
+            with open(self._path('meta.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, meta):
+        meta = dict(meta, generation=meta.get('generation', 0) + 1)
+        tmp = self._path(f'meta.json.{os.getpid()}.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._path('meta.json'))
+        self.meta = meta
+        self._map()
+        self._meta_stamp = self._stamp()
+
+    def _map(self):
+        meta = self.meta
+        mode = 'r+'
+        self.vectors = np.memmap(self._data_path('vectors'), dtype='float16', mode=mode,
+                                 shape=(meta['capacity'], meta['dim']))
+        self.keys = np.memmap(self._data_path('keys'), dtype='uint8', mode=mode, shape=(meta['capacity'], KEY_BYTES))
+        self.alive = np.memmap(self._data_path('alive'), dtype='uint8', mode=mode, shape=(meta['capacity'],))
+        self.ivf = None
+        if meta.get('ivf'):
+            with np.load(self._path(meta['ivf'])) as data:
+                self.ivf = {name: data[name] for name in ('centroids', 'order', 'offsets')}
+
+    def _stamp(self):
+        # meta.json is replaced, never rewritten, so its inode changes on every write
+        stat = os.stat(self._path('meta.json'))
+        return stat.st_ino, stat.st_mtime_ns
+
+    def refresh(self):
+        """Pick up appends, deletions and compactions made by other processes."""
+        try:
+            stamp = self._stamp()
+        except OSError:
+            return False
+        if stamp != self._meta_stamp:
+            meta = self._read_meta()
+            if meta is None:
+                return self.meta is not None
+            with self._lock:
+                self.meta = meta
+                self._map()
+                self._meta_stamp = stamp
+        return True
+
+    def _write_lock(self):
+        return _FileLock(self._path('lock'), self._lock)
+
+    def _create(self, dim):
+        os.makedirs(self.directory, exist_ok=True)
+        meta = {'dim': int(dim), 'count': 0, 'deleted': 0, 'capacity': 0, 'segment': 0, 'ivf': None,
+                'ivf_rows': 0, 'generation': 0}
+        self.meta = meta
+        self._allocate(meta, 0, INITIAL_CAPACITY)
+        self._write_meta(meta)
+
+    def _allocate(self, meta, segment, capacity):
+        for kind, width in (('vectors', meta['dim'] * 2), ('keys', KEY_BYTES), ('alive', 1)):
+            with open(self._data_path(kind, segment), 'ab') as f:
+                f.truncate(capacity * width)
+        meta['capacity'] = capacity
+
+    # Reads --------------------------------------------------------------
+
+    def __len__(self):
+        if not self.refresh():
+            return 0
+        return self.meta['count'] - self.meta['deleted']
+
+    def _find(self, digest):
+        """Live row of a digest, or None."""
+        count = self.meta['count']
+        if not count:
+            return None
+        key = digest_key(digest)
+        # Compare the first 8 bytes across all rows, then confirm the rest
+        first = self.keys[:count].view('<u8')[:, 0]
+        for row in np.flatnonzero(first == key[:8].view('<u8')[0])[::-1]:
+            if self.alive[row] and (self.keys[row] == key).all():
+                return int(row)
+        return None
+
+    def get(self, digest):
+        """Stored (unit) vector for a digest as float32, or None."""
+        if not self.refresh():
+            return None
+        with self._lock:
+            row = self._find(digest)
+            return np.asarray(self.vectors[row], dtype='float32') if row is not None else None
+
+    def rows_for(self, digests):
+        """Live rows of several digests (unknown ones are skipped)."""
+        if not self.refresh():
+            return np.zeros(0, dtype='int64')
+        keys = np.array([digest_key(digest) for digest in digests], dtype='uint8').reshape(-1, KEY_BYTES)
+        with self._lock:
+            count = self.meta['count']
+            if not count or not len(keys):
+                return np.zeros(0, dtype='int64')
+            # One pass over the first 8 bytes of every row, then confirm the rest
+            rows = np.flatnonzero(np.isin(self.keys[:count].view('<u8')[:, 0], keys.view('<u8')[:, 0]))
+            wanted = {bytes(key) for key in keys}
+            return np.array([row for row in rows
+                             if self.alive[row] and bytes(self.keys[row]) in wanted], dtype='int64')
+
+    def search(self, vector, k=10, rows=None, probe=None):
+        """
+        The k most similar live vectors as [(digest, cosine)], best first.
+        `rows` restricts the search to those rows (e.g. one user's images).
+        """
+        if not self.refresh():
+            return []
+        query = normalize(vector)[0]
+        with self._lock:
+            count = self.meta['count']
+            if rows is not None:
+                candidates = [np.asarray(rows, dtype='int64')]
+            elif self.ivf is not None:
+                candidates = self._ivf_candidates(query, probe or self.config['IVF_PROBE'])
+            else:
+                candidates = None
+
+            best_rows, best_scores = np.zeros(0, dtype='int64'), np.zeros(0, dtype='float32')
+            for block_rows, block in self._blocks(candidates, count):
+                scores = block.astype('float32') @ query
+                scores[self.alive[block_rows] == 0] = -np.inf
+                best_rows = np.concatenate([best_rows, block_rows])
+                best_scores = np.concatenate([best_scores, scores])
+                if len(best_scores) > k:
+                    keep = np.argpartition(-best_scores, k)[:k]
+                    best_rows, best_scores = best_rows[keep], best_scores[keep]
+            order = np.argsort(-best_scores)
+            return [(bytes(self.keys[row]).hex(), float(best_scores[i]))
+                    for i, row in ((i, best_rows[i]) for i in order) if np.isfinite(best_scores[i])]
+
+    def _blocks(self, candidates, count):
+        block_rows = self.config['BLOCK_ROWS']
+        if candidates is None:
+            for start in range(0, count, block_rows):
+                stop = min(count, start + block_rows)
+                yield np.arange(start, stop), self.vectors[start:stop]
+            return
+        for rows in candidates:
+            rows = rows[rows < count]
+            for start in range(0, len(rows), block_rows):
+                chunk = np.sort(rows[start:start + block_rows])
+                yield chunk, self.vectors[chunk]
+
+    def _ivf_candidates(self, query, probe):
+        ivf = self.ivf
+        lists = np.argsort(-(ivf['centroids'] @ query))[:probe]
+        candidates = [ivf['order'][ivf['offsets'][i]:ivf['offsets'][i + 1]] for i in lists]
+        # Rows appended since training aren't partitioned yet: scan them all
+        candidates.append(np.arange(self.meta['ivf_rows'], self.meta['count']))
+        return candidates
+
+    # Writes -------------------------------------------------------------
+
+    def add(self, digest, vector):
+        """Append a vector for a digest unless it is already indexed. Returns True if added."""
+        return self.add_many([digest], [vector]) == 1
+
+    def add_many(self, digests, vectors):
+        """Append vectors for digests not indexed yet, with one metadata write. Returns how many were added."""
+        vectors = normalize(vectors)
+        with self._write_lock():
+            if not self.refresh():
+                self._create(vectors.shape[1])
+            if vectors.shape[1] != self.meta['dim']:
+                raise ValueError(f"Expected {self.meta['dim']}-d vectors, got {vectors.shape[1]}")
+            known = set(bytes(self.keys[row]).hex() for row in self.rows_for(digests))
+            new = []
+            for digest, vector in zip(digests, vectors):
+                if digest not in known:
+                    known.add(digest)
+                    new.append((digest, vector))
+            if not new:
+                return 0
+            meta = dict(self.meta)
+            start = meta['count']
+            if start + len(new) > meta['capacity']:
+                capacity = meta['capacity']
+                while start + len(new) > capacity:
+                    capacity *= 2
+                self._allocate(meta, meta['segment'], capacity)
+                self.meta = meta
+                self._map()
+            stop = start + len(new)
+            self.vectors[start:stop] = np.array([vector for _, vector in new], dtype='float16')
+            self.keys[start:stop] = np.array([digest_key(digest) for digest, _ in new])
+            self.alive[start:stop] = 1
+            for array in (self.vectors, self.keys, self.alive):
+                array.flush()
+            meta['count'] = stop
+            self._write_meta(meta)
+        return len(new)
+
+    def remove(self, digests):
+        """Delete the vectors of these digests. Returns how many were live."""
+        with self._write_lock():
+            if not self.refresh():
+                return 0
+            # One pass over the keys for the whole batch, not one per digest
+            rows = self.rows_for(digests)
+            self.alive[rows] = 0
+            removed = len(rows)
+            if removed:
+                self.alive.flush()
+                self._write_meta(dict(self.meta, deleted=self.meta['deleted'] + removed))
+        return removed
+
+    def compact(self):
+        """Rewrite live rows into a new segment, dropping deletions. Returns rows dropped."""
+        with self._write_lock():
+            if not self.refresh() or not self.meta['deleted']:
+                return 0
+            old = dict(self.meta)
+            old_files = [self._data_path(kind) for kind in ('vectors', 'keys', 'alive')]
+            old_ivf = old.get('ivf')
+            live = np.flatnonzero(self.alive[:old['count']])
+            meta = dict(old, segment=old['segment'] + 1, count=len(live), deleted=0, ivf=None, ivf_rows=0)
+            self._allocate(meta, meta['segment'], max(INITIAL_CAPACITY, len(live) * 2))
+            vectors = np.memmap(self._data_path('vectors', meta['segment']), dtype='float16', mode='r+',
+                                shape=(meta['capacity'], meta['dim']))
+            keys = np.memmap(self._data_path('keys', meta['segment']), dtype='uint8', mode='r+',
+                             shape=(meta['capacity'], KEY_BYTES))
+            alive = np.memmap(self._data_path('alive', meta['segment']), dtype='uint8', mode='r+',
+                              shape=(meta['capacity'],))
+            step = self.config['BLOCK_ROWS']
+            for start in range(0, len(live), step):
+                rows = live[start:start + step]
+                vectors[start:start + len(rows)] = self.vectors[rows]
+                keys[start:start + len(rows)] = self.keys[rows]
+            alive[:len(live)] = 1
+            for array in (vectors, keys, alive):
+                array.flush()
+            del vectors, keys, alive
+            self._write_meta(meta)
+            # Readers still mapping the old files keep them until they refresh
+            for path in old_files + ([self._path(old_ivf)] if old_ivf else []):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            dropped = old['count'] - len(live)
+        if old_ivf:
+            self.train()
+        return dropped
+
+    def train(self, lists=None, iterations=10):
+        """
+        Cluster live rows with k-means and store the partitions. Returns the
+        list count. Clustering runs without the write lock (appends only add
+        rows past the snapshot, deletions only clear flags); rows appended
+        meanwhile stay in the scanned tail.
+        """
+        if not self.refresh():
+            return 0
+        with self._lock:
+            segment, count = self.meta['segment'], self.meta['count']
+            live = np.flatnonzero(self.alive[:count])
+            vectors = self.vectors
+        if not len(live):
+            return 0
+        lists = lists or self.config['IVF_LISTS'] or int(np.sqrt(len(live)))
+        rng = np.random.RandomState(0)
+        sample = np.sort(rng.choice(live, min(len(live), self.config['IVF_TRAIN_SAMPLE'], 64 * lists),
+                                    replace=False))
+        points = vectors[sample].astype('float32')
+        lists = max(1, min(lists, len(points)))
+        centroids = points[rng.choice(len(points), lists, replace=False)]
+        for _ in range(iterations):
+            assignment = np.argmax(points @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, points)
+            filled = np.bincount(assignment, minlength=lists) > 0
+            centroids[filled] = normalize(sums[filled])
+
+        assignment = np.empty(len(live), dtype='int64')
+        step = self.config['BLOCK_ROWS']
+        for start in range(0, len(live), step):
+            rows = live[start:start + step]
+            assignment[start:start + len(rows)] = np.argmax(vectors[rows].astype('float32') @ centroids.T, axis=1)
+        by_list = np.argsort(assignment, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=lists))])
+
+        with self._write_lock():
+            if not self.refresh() or self.meta['segment'] != segment:
+                return 0  # compacted meanwhile; row numbers changed
+            old_ivf = self.meta.get('ivf')
+            name = f"ivf-{segment}-{self.meta['generation'] + 1}.npz"
+            with open(self._path(name), 'wb') as f:
+                np.savez(f, centroids=centroids.astype('float32'), order=live[by_list].astype('int64'),
+                         offsets=offsets.astype('int64'))
+            self._write_meta(dict(self.meta, ivf=name, ivf_rows=count))
+            if old_ivf:
+                try:
+                    os.remove(self._path(old_ivf))
+                except OSError:
+                    pass
+        return lists
+
+    def maintain(self):
+        """Compact and (re)train when due. Returns a dict of what was done."""
+        done = {}
+        if not self.refresh():
+            return done
+        meta = self.meta
+        if meta['deleted'] and meta['deleted'] >= self.config['COMPACT_FRACTION'] * meta['count']:
+            done['compacted'] = self.compact()
+            meta = self.meta
+        live = meta['count'] - meta['deleted']
+        untrained = meta['count'] - meta['ivf_rows']
+        if live >= self.config['IVF_MIN_VECTORS'] and (
+                not meta.get('ivf') or untrained > self.config['RETRAIN_FRACTION'] * live):
+            done['trained_lists'] = self.train()
+        return done
+
+    def stats(self):
+        if not self.refresh():
+            return {'vectors': 0}
+        meta = self.meta
+        return {
+            'vectors': meta['count'] - meta['deleted'],
+            'rows': meta['count'],
+            'deleted': meta['deleted'],
+            'dim': meta['dim'],
+            'capacity': meta['capacity'],
+            'ivf_lists': len(self.ivf['centroids']) if self.ivf is not None else 0,
+            'unpartitioned': meta['count'] - meta['ivf_rows'] if self.ivf is not None else meta['count'],
+            'bytes': meta['capacity'] * (meta['dim'] * 2 + KEY_BYTES + 1),
+        }
+
+
+class _FileLock:
+    """Thread lock plus an exclusive flock on `path` where fcntl exists."""
+
+    def __init__(self, path, thread_lock):
+        self.path = path
+        self.thread_lock = thread_lock
+        self.handle = None
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        if fcntl is not None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.handle = open(self.path, 'a')
+            fcntl.flock(self.handle, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self.handle is not None:
+            fcntl.flock(self.handle, fcntl.LOCK_UN)
+            self.handle.close()
+            self.handle = None
+        self.thread_lock.release()
+
+
+def index_root(config=None):
+    path = (config or get_vector_index_config())['DIR']
+    return path if os.path.isabs(path) else os.path.join(settings.BASE_DIR, path)
+
+
+def index_dir(version, config=None):
+    return os.path.join(index_root(config), version)
+
+
+def get_index(version=None):
+    """Index for a model version (the current weights by default)."""
+    if version is None:
+        from . import runtime
+        version = runtime.model_version()
+    index = _indexes.get(version)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(version)
+            if index is None:
+                index = VectorIndex(index_dir(version))
+                _indexes[version] = index
+    return index
+
+
+def remove_digests(digests):
+    """Drop digests from every model version's index (called by the upload collector)."""
+    root = index_root()
+    if not digests or not os.path.isdir(root):
+        return 0
+    return sum(get_index(version).remove(digests) for version in sorted(os.listdir(root))
+               if os.path.isdir(os.path.join(root, version)))
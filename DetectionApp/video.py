@@ -0,0 +1,255 @@
+"""
+Video and frame-sequence analysis.
+
+A reader thread decodes the clip with cv2.VideoCapture, samples frames by a
+fixed stride or on scene changes, and hands 32x32 model inputs to the
+inference loop through a bounded queue. Frames are scored in batches and
+folded into running totals and a fixed-size timeline, so memory stays
+constant however long the clip is. analyze_video() is a generator of
+progress/partial-result events that views and the CLI can stream.
+"""
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+INPUT_SIZE = 32
+
+DEFAULT_VIDEO = {
+    'STRIDE': 15,               # score every Nth frame (or check for a scene change every Nth)
+    'SCENE_THRESHOLD': None,    # histogram distance (0..1) that counts as a cut; None = stride sampling
+    'MAX_GAP': 150,             # in scene mode, still sample at least every N frames
+    'BATCH_SIZE': 32,
+    'QUEUE_SIZE': 64,           # decoded frames buffered between reader and model
+    'TIMELINE_BINS': 120,
+    'MAX_FRAMES': 5000,         # sampled frames per clip
+}
+
+_END = object()
+
+
+def get_video_config(overrides=None):
+    config = dict(DEFAULT_VIDEO)
+    config.update(getattr(settings, 'VIDEO_ANALYSIS', {}) or {})
+    if overrides:
+        config.update({k: v for k, v in overrides.items() if v is not None})
+    return config
+
+
+class Timeline:
+    """
+    Fixed number of bins over the clip. When the frame count is unknown the
+    bin width doubles (adjacent bins merge) whenever the bins run out.
+    """
+
+    def __init__(self, max_bins, total_frames=0):
+        # Even bin count so pairs always merge cleanly
+        self.max_bins = max(2, max_bins - max_bins % 2)
+        max_bins = self.max_bins
+        self.width = max(1, int(np.ceil(total_frames / float(max_bins)))) if total_frames > 0 else 1
+        self.sums = np.zeros(max_bins, dtype='float64')
+        self.counts = np.zeros(max_bins, dtype='int64')
+        self.fps = 0.0
+
+    def add(self, frame_index, fake_prob):
+        slot = frame_index // self.width
+        while slot >= self.max_bins:
+            self._merge()
+            slot = frame_index // self.width
+        self.sums[slot] += fake_prob
+        self.counts[slot] += 1
+
+    def _merge(self):
+        half = self.max_bins // 2
+        self.sums[:half] = self.sums[0:2 * half:2] + self.sums[1:2 * half:2]
+        self.counts[:half] = self.counts[0:2 * half:2] + self.counts[1:2 * half:2]
+        self.sums[half:] = 0
+        self.counts[half:] = 0
+        self.width *= 2
+
+    def as_list(self):
+        points = []
+        for slot in np.flatnonzero(self.counts):
+            start = int(slot * self.width)
+            point = {
+                'start_frame': start,
+                'end_frame': start + self.width - 1,
+                'fake_prob': round(float(self.sums[slot] / self.counts[slot]) * 100, 2),
+                'frames': int(self.counts[slot]),
+            }
+            if self.fps:
+                point['start_s'] = round(start / self.fps, 2)
+            points.append(point)
+        return points
+
+
+def _frame_signature(frame):
+    """Normalised hue/saturation histogram of a small copy, for scene-change detection."""
+    small = cv2.resize(frame, (64, 36), interpolation=cv2.INTER_AREA)
+    hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+    hist = cv2.calcHist([hsv], [0, 1], None, [16, 8], [0, 180, 0, 256])
+    return cv2.normalize(hist, hist).flatten()
+
+
+class FrameReader(threading.Thread):
+    """Decode and sample frames, pushing (index, timestamp, uint8 32x32 input) onto a bounded queue."""
+
+    def __init__(self, path, frames, config):
+        super().__init__(daemon=True)
+        self.path = path
+        self.frames = frames
+        self.config = config
+        self.stop_event = threading.Event()
+        self.error = None
+        self.fps = 0.0
+        self.total_frames = 0
+        self.ready = threading.Event()
+
+    def _put(self, item):
+        # Block on the bounded queue, but give up promptly when asked to stop
+        while not self.stop_event.is_set():
+            try:
+                self.frames.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run(self):
+        capture = cv2.VideoCapture(self.path)
+        try:
+            if not capture.isOpened():
+                raise ValueError('Could not open video')
+            self.fps = capture.get(cv2.CAP_PROP_FPS) or 0.0
+            self.total_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+            self.ready.set()
+
+            stride = max(1, int(self.config['STRIDE']))
+            threshold = self.config['SCENE_THRESHOLD']
+            max_gap = int(self.config['MAX_GAP'])
+            max_frames = int(self.config['MAX_FRAMES'])
+            last_signature = None
+            last_sampled = -max_gap
+            sampled = 0
+            index = -1
+            while not self.stop_event.is_set() and sampled < max_frames:
+                # grab() skips decoding for frames we never look at
+                if not capture.grab():
+                    break
+                index += 1
+                if index % stride:
+                    continue
+                ok, frame = capture.retrieve()
+                if not ok:
+                    break
+                if threshold is not None:
+                    signature = _frame_signature(frame)
+                    changed = last_signature is None or cv2.compareHist(
+                        last_signature, signature, cv2.HISTCMP_BHATTACHARYYA) >= threshold
+                    last_signature = signature
+                    if not changed and index - last_sampled < max_gap:
+                        continue
+                timestamp = index / self.fps if self.fps else None
+                small = cv2.resize(frame, (INPUT_SIZE, INPUT_SIZE))
+                if not self._put((index, timestamp, small)):
+                    break
+                last_sampled = index
+                sampled += 1
+        except Exception as e:
+            self.error = e
+        finally:
+            capture.release()
+            self.ready.set()
+            self._put(_END)
+
+
+def analyze_video(path, model, stride=None, scene_threshold=None, batch_size=None, max_frames=None,
+                  threshold=0.5):
+    """
+    Yield events while analysing a clip:
+
+      {'type': 'start', ...}          clip metadata
+      {'type': 'frames', ...}         scores for the batch just processed
+      {'type': 'progress', ...}       frames done / estimated total, throughput
+      {'type': 'result', ...}         clip-level verdict and timeline
+    """
+    config = get_video_config({
+        'STRIDE': stride, 'SCENE_THRESHOLD': scene_threshold,
+        'BATCH_SIZE': batch_size, 'MAX_FRAMES': max_frames,
+    })
+    frames = queue.Queue(maxsize=int(config['QUEUE_SIZE']))
+    reader = FrameReader(path, frames, config)
+    reader.start()
+    reader.ready.wait()
+
+    timeline = Timeline(int(config['TIMELINE_BINS']), reader.total_frames)
+    timeline.fps = reader.fps
+    expected = reader.total_frames // max(1, int(config['STRIDE'])) if reader.total_frames else None
+    if expected and config['SCENE_THRESHOLD'] is None:
+        expected = min(expected, int(config['MAX_FRAMES']))
+    yield {'type': 'start', 'fps': reader.fps, 'total_frames': reader.total_frames,
+           'expected_samples': expected}
+
+    started = time.perf_counter()
+    scored = 0
+    fake_sum = 0.0
+    fake_frames = 0
+    peak = {'fake_prob': -1.0}
+    batch_size = int(config['BATCH_SIZE'])
+    inputs = np.empty((batch_size, INPUT_SIZE, INPUT_SIZE, 3), dtype='float32')
+    meta = []
+    finished = False
+    try:
+        while not finished:
+            item = frames.get()
+            if item is _END:
+                finished = True
+            else:
+                index, timestamp, small = item
+                inputs[len(meta)] = small
+                meta.append((index, timestamp))
+            if meta and (len(meta) == batch_size or finished):
+                batch = inputs[:len(meta)] / 255
+                probs = model.predict(batch, batch_size=len(meta))
+                partial = []
+                for (index, timestamp), prob in zip(meta, probs[:, 0]):
+                    prob = float(prob)
+                    fake_sum += prob
+                    if 1 - prob < threshold:
+                        fake_frames += 1
+                    if prob > peak['fake_prob']:
+                        peak = {'frame': index, 'time_s': timestamp, 'fake_prob': prob}
+                    timeline.add(index, prob)
+                    partial.append({'frame': index, 'time_s': timestamp, 'fake_prob': round(prob * 100, 2)})
+                scored += len(meta)
+                meta = []
+                elapsed = time.perf_counter() - started
+                yield {'type': 'frames', 'frames': partial}
+                yield {'type': 'progress', 'scored': scored, 'expected': expected,
+                       'frames_per_s': round(scored / elapsed, 1) if elapsed else None,
+                       'running_fake_prob': round(fake_sum / scored * 100, 2)}
+    finally:
+        reader.stop_event.set()
+        reader.join(timeout=5)
+
+    if reader.error is not None:
+        raise reader.error
+    if not scored:
+        raise ValueError('No frames could be decoded from the video')
+
+    fake_prob = fake_sum / scored
+    elapsed = time.perf_counter() - started
+    yield {
+        'type': 'result',
+        'fake_prob': fake_prob * 100,
+        'real_prob': (1 - fake_prob) * 100,
+        'frames_scored': scored,
+        'fake_frame_ratio': round(fake_frames / float(scored), 4),
+        'peak': dict(peak, fake_prob=round(peak['fake_prob'] * 100, 2)),
+        'timeline': timeline.as_list(),
+        'elapsed_s': round(elapsed, 3),
+        'frames_per_s': round(scored / elapsed, 1) if elapsed else None,
+    }
@@ -1,48 +1,48 @@
 import os
-import io
 import base64
 import json
-import uuid
 import random
 import hashlib
+import re
+import tempfile
+from datetime import timedelta
 
 import cv2
 import numpy as np
-import matplotlib
-matplotlib.use('Agg')  # Use non-GUI backend for threading
-import matplotlib.pyplot as plt
 
+from django.conf import settings
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import (FileResponse, Http404, HttpResponse, HttpResponseNotModified, JsonResponse,
+                         StreamingHttpResponse)
+from django.utils.cache import patch_vary_headers
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User
+from django.db import transaction
 from django.db.models import Avg
+from django.utils import timezone
 
-from keras.models import load_model, Model
-from lime import lime_image
-from skimage.segmentation import mark_boundaries
-
-from .models import AnalysisLog
-
-# Initialize LIME explainer
-explainer = lime_image.LimeImageExplainer()
-
-#get Grad Cam Image
-def getGradCam(img, model):
-    feature_model = Model(model.inputs, model.layers[-7].output)
-    predict = feature_model.predict(img)#now using  cnn model to detcet tumor damage
-    predict = predict[0]
-    pred = predict[:,:,24]
-    pred =  pred*255
-    pred = cv2.resize(pred, (150, 150))
-    return pred
+from .models import AnalysisLog, AnalysisRollup, StoredImage
+from . import runtime
+from .admission import AdmissionRejected, FIDELITY_FULL, get_controller
+from .explainers import EXPLAINERS, ExplainerBudgetExceeded, parse_explainer_names, plan_explainers
+from .scanning import parse_scan_options, render_heatmap_overlay, scan_image
+from .video import analyze_video
+from .log_writer import get_writer
+from .auth import get_api_user
+from .history_cache import (bump_history_version, get_body as get_history_body, history_etag,
+                            history_version, put_body as put_history_body)
+from . import export, memory, profiling, rollups, storage, thumbnails, vector_index, xai_pool
+from .explanation_cache import (LAYOUTS, MAX_PANEL_SIZE, get_explanation_cache, input_panel,
+                                render_explanation)
 
 # Threshold for classifying as "Real" - higher value = stricter (more likely to flag as Fake)
 # Class 0 = Fake, Class 1 = Real
 # If Real confidence is below this threshold, classify as Fake
 AI_FAKE_THRESHOLD = 0.50  # 50% - standard classification (whichever class is higher wins)
 
+HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+
 
 # Dynamic explanation templates based on classification
 FAKE_EXPLANATIONS = [
@@ -104,59 +104,84 @@ def generate_explanation(is_real, confidence):
 
 
 
+#function to turn the Real probability into status, is_real and confidence
+def getVerdict(real_prob):
+    # Use threshold-based classification for better AI detection
+    # If real_prob is below threshold, classify as Fake
+    if real_prob >= AI_FAKE_THRESHOLD:
+        status = "Real"
+        is_real = True
+        confidence = real_prob * 100
+    else:
+        status = "Fake"
+        is_real = False
+        # Confidence should reflect how confident we are it's fake
+        confidence = (1 - real_prob) * 100
+    return status, is_real, confidence
+
+
 #function to classify image as fake or real
-def classifyImage(image_path, nasnet_model):
-    image = cv2.imread(image_path)
+def classifyImage(image_path, nasnet_model, fidelity=FIDELITY_FULL, explainers=None, image_hash=None, image=None):
+    if image is None:
+        image = cv2.imread(image_path)
     img = cv2.resize(image, (32,32))
     im2arr = np.array(img)
     im2arr = im2arr.reshape(1,32,32,3)
     img = np.asarray(im2arr)
     img = img.astype('float32')
     img = img/255
-    raw_predict = nasnet_model.predict(img)
+
+    # Verdicts and raw explanations are cached by content hash + model version
+    cache = get_explanation_cache()
+    version = runtime.model_version() if image_hash else None
+    cached = cache.get_verdict(image_hash, version) if image_hash else None
+    if cached is not None:
+        raw_predict = cached['probs'][np.newaxis, :]
+        embedding = cached.get('embedding')
+    else:
+        # The Dense(256) activations come out of the same forward pass and
+        # feed the similar-images index (vector_index.py)
+        raw_predict, embedding = runtime.get_embedding_model(nasnet_model).predict(img)
+        embedding = embedding[0]
+        if image_hash:
+            cache.put_verdict(image_hash, version, raw_predict[0], img, embedding)
     
     # Get probabilities for each class
     fake_prob = float(raw_predict[0][0])  # Probability of being Fake (class 0)
     real_prob = float(raw_predict[0][1])  # Probability of being Real (class 1)
     
 
-    # Use threshold-based classification for better AI detection
-    # If real_prob is below threshold, classify as Fake
-    if real_prob >= AI_FAKE_THRESHOLD:
-        status = "Real"
-        is_real = True
-        confidence = real_prob * 100
-    else:
-        status = "Fake"
-        is_real = False
-        # Confidence should reflect how confident we are it's fake
-        confidence = (1 - real_prob) * 100
-    
+    status, is_real, confidence = getVerdict(real_prob)
 
-    grad_cam = getGradCam(img, nasnet_model)
-    # Generate Lime explanation
-    explanation = explainer.explain_instance(img[0], nasnet_model.predict)
-    # Visualize the explanation
-    temp, mask = explanation.get_image_and_mask(explanation.top_labels[0], positive_only=True, num_features=5, hide_rest=False)
-    lime_marking = mark_boundaries(temp / 2 + 0.5, mask)
-    lime_marking = cv2.resize(lime_marking, (150, 150), interpolation=cv2.INTER_LANCZOS4)
-    image = cv2.imread(image_path)
-    image = cv2.resize(image, (150, 150))
-    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    #lime_marking = cv2.cvtColor(lime_marking, cv2.COLOR_BGR2RGB)
-    cv2.putText(image, status, (10, 25),  cv2.FONT_HERSHEY_SIMPLEX,0.7, (0, 0, 255), 2)
-    f, axarr = plt.subplots(1,3, figsize=(8,4)) 
-    axarr[0].imshow(image)
-    axarr[0].title.set_text("Input Image")
-    axarr[1].imshow(grad_cam)
-    axarr[1].title.set_text('Grad Cam Image')
-    axarr[2].imshow(lime_marking)
-    axarr[2].title.set_text('Lime Explanation Image')
-    plt.axis('off')
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', bbox_inches='tight')
-    plt.close()
-    img_b64 = base64.b64encode(buf.getvalue()).decode()
+    if explainers is None:
+        explainers, _ = plan_explainers(fidelity=fidelity)
+
+    img_b64 = ''
+    if explainers:
+        known = {}
+        if image_hash:
+            for backend in explainers:
+                result = cache.get_result(image_hash, version, backend)
+                if result is not None:
+                    known[backend.name] = result
+        if xai_pool.is_enabled():
+            # CPU-bound explain/render work runs in the XAI process pool
+            try:
+                img_b64, computed = xai_pool.explain(image, img, raw_predict[0], status,
+                                                     [backend.name for backend in explainers], known)
+            except xai_pool.XAIError:
+                # Answer with the verdict alone rather than fail the request
+                computed = {}
+                explainers = []
+        else:
+            computed = {backend.name: backend.explain(img, nasnet_model, raw_predict[0])
+                        for backend in explainers if backend.name not in known}
+            img_b64 = render_explanation(input_panel(image, status), img,
+                                         [known.get(backend.name) or computed[backend.name] for backend in explainers])
+        if image_hash:
+            for backend in explainers:
+                if backend.name in computed:
+                    cache.put_result(image_hash, version, backend, computed[backend.name])
     # Generate dynamic text explanation
     text_explanation = generate_explanation(is_real, confidence)
     # Return structured data
@@ -167,7 +192,39 @@ def classifyImage(image_path, nasnet_model):
         'confidence': confidence,
         'real_prob': real_prob * 100,  # Return as percentage
         'fake_prob': fake_prob * 100,  # Return as percentage
-        'explanation': text_explanation
+        'explanation': text_explanation,
+        'fidelity': fidelity,
+        'explainers': [backend.name for backend in explainers],
+        'explanation_cost': sum(backend.cost for backend in explainers),
+        'embedding': embedding,
+    }
+
+#function to classify a large image by scanning overlapping patches at several scales
+def scanImage(image_path, nasnet_model, stride=None, scales=None, max_patches=None, image=None):
+    if image is None:
+        image = cv2.imread(image_path)
+    scan = scan_image(image, nasnet_model, stride=stride, scales=scales, max_patches=max_patches)
+    real_prob = scan['real_prob']
+    fake_prob = scan['fake_prob']
+    status, is_real, confidence = getVerdict(real_prob)
+    overlay = render_heatmap_overlay(image, scan['heatmap'])
+    return {
+        'image': base64.b64encode(overlay).decode(),
+        'status': status,
+        'is_real': is_real,
+        'confidence': confidence,
+        'real_prob': real_prob * 100,
+        'fake_prob': fake_prob * 100,
+        'explanation': generate_explanation(is_real, confidence),
+        'fidelity': 'scan',
+        'explainers': [],
+        'explanation_cost': scan['patches'],
+        'scan': {
+            'patches': scan['patches'],
+            'scales': scan['scales'],
+            'elapsed_ms': round(scan['elapsed'] * 1000, 1),
+            'heatmap_shape': list(scan['heatmap'].shape),
+        }
     }
 
 # Legacy index view - redirects to React frontend
@@ -349,66 +406,89 @@ def reset_password_api(request):
 
 @csrf_exempt
 def history_api(request):
-    user = None
-    
-    # Try session auth first
-    if request.user.is_authenticated:
-        user = request.user
-    else:
-        # Fallback to X-User-ID header
-        user_id = request.headers.get('X-User-ID')
-        if user_id:
-            try:
-                user = User.objects.get(id=int(user_id))
-            except (User.DoesNotExist, ValueError):
-                pass
+    # Session user first, then the X-User-ID header
+    user = get_api_user(request)
     
     if user:
-        logs = AnalysisLog.objects.filter(user=user).order_by('-timestamp')
+        # Rows still queued in the write-behind writer come first, and replace
+        # older stored rows with the same image hash. Such responses are not
+        # cached: the writer bumps the version again once they are flushed.
+        pending = get_writer().pending_for(user.id)
+        version = history_version(user.id)
+        etag = history_etag(user.id, version)
+        if not pending:
+            if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+                response = HttpResponseNotModified()
+                return _history_headers(response, etag)
+            body = get_history_body(user.id, version)
+            if body is not None:
+                return _history_headers(HttpResponse(body, content_type='application/json'), etag)
+
+        pending_hashes = set()
         data = []
-        for log in logs:
+        for record in pending:
+            if record['image_hash'] in pending_hashes:
+                continue
+            pending_hashes.add(record['image_hash'])
             data.append({
-                'image_path': log.image_path,
-                'is_real': log.is_real,
-                'confidence': log.confidence,
-                'real_prob': log.real_prob,
-                'fake_prob': log.fake_prob,
-                'explanation_image': log.explanation_image or '',
-                'explanation_text': log.explanation_text or '',
-                'timestamp': log.timestamp.strftime("%Y-%m-%d %H:%M:%S")
+                'image_path': record['image_path'],
+                'thumbnails': thumbnails.thumbnail_urls(record['image_path']),
+                'is_real': record['is_real'],
+                'confidence': record['confidence'],
+                'real_prob': record['real_prob'],
+                'fake_prob': record['fake_prob'],
+                'explanation_image': record['explanation_image'] or '',
+                'explanation_text': record['explanation_text'] or '',
+                'timestamp': record['timestamp'].strftime("%Y-%m-%d %H:%M:%S")
             })
-        return JsonResponse({'success': True, 'history': data})
+
+        logs = AnalysisLog.objects.filter(user=user).order_by('-timestamp')
+        if pending_hashes:
+            logs = logs.exclude(image_hash__in=pending_hashes)
+        for log in logs.values('image_path', 'is_real', 'confidence', 'real_prob', 'fake_prob',
+                               'explanation_image', 'explanation_text', 'timestamp'):
+            log['thumbnails'] = thumbnails.thumbnail_urls(log['image_path'])
+            log['explanation_image'] = log['explanation_image'] or ''
+            log['explanation_text'] = log['explanation_text'] or ''
+            log['timestamp'] = log['timestamp'].strftime("%Y-%m-%d %H:%M:%S")
+            data.append(log)
+        response = JsonResponse({'success': True, 'history': data})
+        if pending:
+            return response
+        put_history_body(user.id, version, response.content)
+        return _history_headers(response, etag)
     return JsonResponse({'success': False, 'message': 'Not authenticated'}, status=401)
 
+def _history_headers(response, etag):
+    # Browsers revalidate with If-None-Match on every fetch; the response
+    # differs per caller, however they authenticate
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    patch_vary_headers(response, ('Cookie', 'X-User-ID'))
+    return response
+
 @csrf_exempt
 def clear_history_api(request):
     """Clear all analysis history for the current user"""
     if request.method != 'DELETE':
         return JsonResponse({'success': False, 'message': 'Method not allowed'}, status=405)
     
-    user = None
-    if request.user.is_authenticated:
-        user = request.user
-    else:
-        user_id = request.headers.get('X-User-ID')
-        if user_id:
-            try:
-                user = User.objects.get(id=int(user_id))
-            except (User.DoesNotExist, ValueError):
-                pass
+    user = get_api_user(request)
     
     if not user:
         return JsonResponse({'success': False, 'message': 'Not authenticated'}, status=401)
     
-    # Delete all user's analysis logs and their images
+    # Delete all user's analysis logs and their images, including queued ones
+    get_writer().flush()
     user_logs = AnalysisLog.objects.filter(user=user)
-    deleted_count = 0
-    for log in user_logs:
-        old_path = os.path.join("DetectionApp/static", log.image_path)
-        if os.path.exists(old_path):
-            os.remove(old_path)
-        deleted_count += 1
-    user_logs.delete()
+    with transaction.atomic():
+        rows = list(user_logs.values_list('image_path', *rollups.ROW_FIELDS))
+        user_logs.delete()
+        rollups.record_deleted([row[1:] for row in rows])
+    image_paths = [row[0] for row in rows]
+    deleted_count = len(image_paths)
+    storage.release(image_paths)
+    bump_history_version(user.id)
     
     return JsonResponse({'success': True, 'message': f'Cleared {deleted_count} history items'})
 
@@ -428,16 +508,7 @@ def profile_api(request):
             digits = digits[1:]
         return digits[-10:] if len(digits) >= 10 else digits
     
-    user = None
-    if request.user.is_authenticated:
-        user = request.user
-    else:
-        user_id = request.headers.get('X-User-ID')
-        if user_id:
-            try:
-                user = User.objects.get(id=int(user_id))
-            except (User.DoesNotExist, ValueError):
-                pass
+    user = get_api_user(request)
     
     if not user:
         return JsonResponse({'success': False, 'message': 'Not authenticated'}, status=401)
@@ -520,21 +591,12 @@ def profile_api(request):
 
 @csrf_exempt
 def admin_logs_api(request):
-    # Check for X-User-ID header for admin verification
-    user = None
-    if request.user.is_authenticated:
-        user = request.user
-    else:
-        user_id = request.headers.get('X-User-ID')
-        if user_id:
-            try:
-                user = User.objects.get(id=int(user_id))
-            except (User.DoesNotExist, ValueError):
-                pass
+    # Session or X-User-ID header; must be a superuser
+    user = get_api_user(request)
     
     if user and user.is_superuser:
         # Get all logs with explanation data
-        logs = AnalysisLog.objects.all().order_by('-timestamp')
+        logs = AnalysisLog.objects.select_related('user').order_by('-timestamp')
         logs_data = []
         for log in logs:
             logs_data.append({
@@ -542,6 +604,7 @@ def admin_logs_api(request):
                 'username': log.user.username,
                 'email': log.user.email,
                 'image_path': log.image_path,
+                'thumbnails': thumbnails.thumbnail_urls(log.image_path),
                 'is_real': log.is_real,
                 'confidence': log.confidence,
                 'real_prob': log.real_prob,
@@ -551,15 +614,12 @@ def admin_logs_api(request):
                 'timestamp': log.timestamp.strftime("%Y-%m-%d %H:%M:%S")
             })
         
-        # Get all users with their analysis stats
-        from django.db.models import Count, Avg
-        users = User.objects.all()
+        # Per-user stats come from the all-time rollup rows, not from AnalysisLog
+        totals = rollups.user_totals()
         users_data = []
-        for u in users:
-            user_logs = AnalysisLog.objects.filter(user=u)
-            real_count = user_logs.filter(is_real=True).count()
-            fake_count = user_logs.filter(is_real=False).count()
-            avg_confidence = user_logs.aggregate(Avg('confidence'))['confidence__avg'] or 0
+        for u in User.objects.order_by('id'):
+            total = totals.get(u.id)
+            avg_confidence = total.confidence_sum / total.total if total and total.total else 0
             
             users_data.append({
                 'id': u.id,
@@ -569,29 +629,78 @@ def admin_logs_api(request):
                 'is_superuser': u.is_superuser,
                 'date_joined': u.date_joined.strftime("%Y-%m-%d %H:%M"),
                 'last_login': u.last_login.strftime("%Y-%m-%d %H:%M") if u.last_login else 'Never',
-                'total_analyses': user_logs.count(),
-                'real_count': real_count,
-                'fake_count': fake_count,
+                'total_analyses': total.total if total else 0,
+                'real_count': total.real_count if total else 0,
+                'fake_count': total.fake_count if total else 0,
                 'avg_confidence': round(avg_confidence, 1)
             })
         
         return JsonResponse({'success': True, 'logs': logs_data, 'users': users_data})
     return JsonResponse({'success': False, 'message': 'Unauthorized'}, status=403)
 
+@csrf_exempt
+def admin_trends_api(request):
+    """Analysis trends from the rollup table, e.g. ?period=hour&days=2&user=5"""
+    user = get_api_user(request)
+    if not user or not user.is_superuser:
+        return JsonResponse({'success': False, 'message': 'Unauthorized'}, status=403)
+
+    period = request.GET.get('period', 'day')
+    if period not in (AnalysisRollup.PERIOD_DAY, AnalysisRollup.PERIOD_HOUR):
+        return JsonResponse({'success': False, 'message': 'period must be day or hour'}, status=400)
+    try:
+        # Bounded windows keep the response size and cost independent of history length
+        days = min(max(int(request.GET.get('days', 30 if period == 'day' else 2)), 1),
+                   366 if period == 'day' else 31)
+        target = int(request.GET['user']) if request.GET.get('user') else None
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'days and user must be integers'}, status=400)
+
+    since = timezone.localtime().replace(minute=0, second=0, microsecond=0) - timedelta(days=days)
+    if period == AnalysisRollup.PERIOD_DAY:
+        since = since.replace(hour=0)
+    return JsonResponse({
+        'success': True,
+        'period': period,
+        'since': since.isoformat(),
+        'histogram_edges': [rollups.HIST_START + rollups.HIST_WIDTH * i for i in range(rollups.HIST_BUCKETS + 1)],
+        'points': rollups.trends(period, since, target),
+    })
+
+@csrf_exempt
+def admin_export_api(request):
+    """Stream AnalysisLog as CSV or JSON Lines, e.g. ?format=jsonl&gzip=1&since=2026-01-01&columns=id,username"""
+    if request.method != 'GET':
+        return JsonResponse({'success': False, 'message': 'Method not allowed'}, status=405)
+    user = get_api_user(request)
+    if not user or not user.is_superuser:
+        return JsonResponse({'success': False, 'message': 'Unauthorized'}, status=403)
+
+    fmt = request.GET.get('format', 'csv')
+    compress = request.GET.get('gzip') in ('1', 'true')
+    try:
+        if fmt not in export.FORMATS:
+            raise ValueError(f"format must be one of {', '.join(export.FORMATS)}")
+        columns = export.parse_columns(request.GET.get('columns'))
+        logs = export.export_queryset(columns, since=request.GET.get('since'), until=request.GET.get('until'),
+                                      user=request.GET.get('user'))
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+
+    # Include rows still queued in the write-behind writer
+    get_writer().flush()
+    content_type = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    if compress:
+        content_type = 'application/gzip'
+    response = StreamingHttpResponse(export.iter_export(logs, columns, fmt, compress), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{export.export_filename(fmt, compress)}"'
+    return response
+
 @csrf_exempt
 def admin_user_api(request, user_id):
     """Admin API to update or delete a user"""
     # Verify admin access
-    admin = None
-    if request.user.is_authenticated:
-        admin = request.user
-    else:
-        admin_id = request.headers.get('X-User-ID')
-        if admin_id:
-            try:
-                admin = User.objects.get(id=int(admin_id))
-            except (User.DoesNotExist, ValueError):
-                pass
+    admin = get_api_user(request)
     
     if not admin or not admin.is_superuser:
         return JsonResponse({'success': False, 'message': 'Unauthorized'}, status=403)
@@ -651,105 +760,193 @@ def admin_user_api(request, user_id):
         if target_user.id == admin.id:
             return JsonResponse({'success': False, 'message': 'Cannot delete yourself'}, status=400)
         
-        # Delete user's analysis logs and images
+        # Delete user's analysis logs and images, including queued ones
+        get_writer().flush()
         user_logs = AnalysisLog.objects.filter(user=target_user)
-        for log in user_logs:
-            old_path = os.path.join("DetectionApp/static", log.image_path)
-            if os.path.exists(old_path):
-                os.remove(old_path)
+        image_paths = list(user_logs.values_list('image_path', flat=True))
         user_logs.delete()
+        storage.release(image_paths)
+        bump_history_version(target_user.id)
         
         target_user.delete()
         return JsonResponse({'success': True, 'message': 'User deleted successfully'})
     
     return JsonResponse({'success': False, 'message': 'Method not allowed'}, status=405)
 
+@csrf_exempt
+def admin_metrics_api(request):
+    """Memory and admission metrics of the worker process serving this call (?top=1 adds allocation sites)"""
+    user = get_api_user(request)
+    if not user or not user.is_superuser:
+        return JsonResponse({'success': False, 'message': 'Unauthorized'}, status=403)
+    accountant = memory.get_accountant()
+    data = {'success': True, 'memory': accountant.stats(), 'admission': get_controller().stats()}
+    if request.GET.get('top') in ('1', 'true'):
+        data['memory']['top_allocations'] = accountant.top_allocations()
+    return JsonResponse(data)
+
+@csrf_exempt
+def admin_profiles_api(request):
+    """List archived request profiles (see DetectionApp/profiling.py)"""
+    user = get_api_user(request)
+    if not user or not user.is_superuser:
+        return JsonResponse({'success': False, 'message': 'Unauthorized'}, status=403)
+    return JsonResponse({'success': True, 'profiles': profiling.list_profiles()})
+
+@csrf_exempt
+def admin_profile_api(request, profile_id):
+    """One archived profile: pstats summary and allocation sites, or ?format=prof for the raw dump"""
+    user = get_api_user(request)
+    if not user or not user.is_superuser:
+        return JsonResponse({'success': False, 'message': 'Unauthorized'}, status=403)
+
+    if request.GET.get('format') == 'prof':
+        path = profiling.profile_path(profile_id, '.prof')
+        if path is None:
+            return JsonResponse({'success': False, 'message': 'Profile not found'}, status=404)
+        response = FileResponse(open(path, 'rb'), content_type='application/octet-stream')
+        response['Content-Disposition'] = f'attachment; filename="{profile_id}.prof"'
+        return response
+
+    path = profiling.profile_path(profile_id, '.json')
+    if path is None:
+        return JsonResponse({'success': False, 'message': 'Profile not found'}, status=404)
+    with open(path) as f:
+        return JsonResponse({'success': True, 'profile': json.load(f)})
+
 @csrf_exempt
 def predict_api(request):
     if request.method == 'POST':
         try:
-            if 'image' not in request.FILES:
-                return JsonResponse({'success': False, 'message': 'No image provided'}, status=400)
-            
-            file = request.FILES['image']
+            # Bounded admission: fail fast with 503 when the wait queue is full,
+            # and trade explanation detail for latency as the queue grows
+            with get_controller().admit() as fidelity:
+                if 'image' not in request.FILES:
+                    return JsonResponse({'success': False, 'message': 'No image provided'}, status=400)
             
-            # Generate unique filename for history
-            ext = os.path.splitext(file.name)[1]
-            filename = f"{uuid.uuid4()}{ext}"
+                file = request.FILES['image']
             
-            # Save file temporarily
-            if not os.path.exists("DetectionApp/static"):
-                os.makedirs("DetectionApp/static")
-            
-            save_path = os.path.join("DetectionApp/static", filename)
-            
-            # Read file content and compute hash for duplicate detection
-            import hashlib
-            file_content = file.read()
-            image_hash = hashlib.md5(file_content).hexdigest()
-            
-            # Write file to disk
-            with open(save_path, "wb") as f:
-                f.write(file_content)
-            
-            # Load model and predict
-            model_path = "model/nasnet_weights.hdf5"
-            if not os.path.exists(model_path):
-                 return JsonResponse({'success': False, 'message': 'Model file not found'}, status=500)
+                # Read file content and compute hash for duplicate detection.
+                # A client that downscaled the image before upload (reduced=1)
+                # sends the SHA-256 of the original file, so history entries
+                # still deduplicate against full-resolution uploads of it.
+                file_content = file.read()
+                content_hash = hashlib.sha256(file_content).hexdigest()
+                image_hash = content_hash
+                if request.POST.get('reduced') == '1':
+                    image_hash = request.POST.get('original_hash', '').lower()
+                    if not HASH_RE.match(image_hash):
+                        return JsonResponse({'success': False, 'message': 'original_hash must be a SHA-256 hex digest'}, status=400)
 
-            model = load_model(model_path)
-            
-            # classifyImage returns dict with image and prediction data
-            result = classifyImage(save_path, model)
-            
-            # Log analysis - try session first, then X-User-ID header
-            user = None
-            if request.user.is_authenticated:
-                user = request.user
-            else:
-                user_id = request.headers.get('X-User-ID')
-                if user_id:
+                # Decode once; the model input, explanation panel and thumbnails share it
+                image = cv2.imdecode(np.frombuffer(file_content, dtype='uint8'), cv2.IMREAD_COLOR)
+                if image is None:
+                    return JsonResponse({'success': False, 'message': 'Could not decode image'}, status=400)
+
+                # Explainer selection: explicit ?explainer=gradcam,occlusion or
+                # the default plan for the current load level, within budget
+                budget = request.POST.get('budget') or request.GET.get('budget')
+                try:
+                    explainers, skipped_explainers = plan_explainers(
+                        request.POST.get('explainer') or request.GET.get('explainer'),
+                        fidelity=fidelity,
+                        budget=int(budget) if budget else None,
+                    )
+                except (ValueError, ExplainerBudgetExceeded) as e:
+                    return JsonResponse({'success': False, 'message': str(e)}, status=400)
+
+                # mode=scan parameters are client-controlled; reject bad ones before any work
+                scan_options = None
+                if request.POST.get('mode') == 'scan':
                     try:
-                        user = User.objects.get(id=int(user_id))
-                    except (User.DoesNotExist, ValueError):
-                        pass
-            
-            if user:
-                # Delete any existing entry with the same image hash (duplicate detection)
-                old_entries = AnalysisLog.objects.filter(user=user, image_hash=image_hash)
-                for old_entry in old_entries:
-                    # Delete the old image file
-                    old_path = os.path.join("DetectionApp/static", old_entry.image_path)
-                    if os.path.exists(old_path):
-                        os.remove(old_path)
-                old_entries.delete()
-                
-                # Create new entry
-                AnalysisLog.objects.create(
-                    user=user,
-                    image_path=filename,
-                    is_real=result['is_real'],
-                    confidence=result['confidence'],
-                    real_prob=result['real_prob'],
-                    fake_prob=result['fake_prob'],
-                    explanation_image=result.get('image', ''),  # Base64 XAI visualization
-                    explanation_text=result.get('explanation', ''),
-                    image_hash=image_hash
-                )
+                        scan_options = parse_scan_options(request.POST.get('stride'), request.POST.get('scales'),
+                                                          request.POST.get('max_patches'))
+                    except ValueError as e:
+                        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+
+                # Load model once per process (see runtime.py) and predict
+                model_path = settings.DETECTION_MODEL_PATH
+                if not os.path.exists(model_path):
+                     return JsonResponse({'success': False, 'message': 'Model file not found'}, status=500)
+
+                model = runtime.get_model(model_path)
 
+                # Content-addressed storage: identical uploads share one file
+                ext = os.path.splitext(file.name)[1]
+                filename = storage.store(file_content, ext, digest=content_hash)
+                save_path = storage.absolute_path(filename)
+
+                # classifyImage returns dict with image and prediction data;
+                # mode=scan scores tiled patches instead of one 32x32 resize
+                try:
+                    with runtime.inference_context():
+                        if scan_options is not None:
+                            result = scanImage(save_path, model, image=image, **scan_options)
+                        else:
+                            result = classifyImage(save_path, model, fidelity=fidelity, explainers=explainers,
+                                                   image_hash=content_hash, image=image)
+                except Exception:
+                    storage.release([filename])
+                    raise
             
-            return JsonResponse({
-                'success': True, 
-                'image': result['image'],
-                'isReal': result['is_real'],
-                'confidence': result['confidence'],
-                'real_prob': result['real_prob'],
-                'fake_prob': result['fake_prob'],
-                'status': result['status'],
-                'explanation': result['explanation'],
-                'message': 'Prediction complete'
-            })
+                # Log analysis - try session first, then X-User-ID header
+                user = get_api_user(request)
             
+                if not user:
+                    # Nothing will reference an anonymous upload; let the collector reclaim it
+                    storage.release([filename])
+                else:
+                    # Thumbnails for the history pages, from the decoded array
+                    try:
+                        thumbnails.generate(filename, image)
+                    except Exception:
+                        import traceback
+                        traceback.print_exc()
+
+                    # Index the embedding for similar-image lookups
+                    if result.get('embedding') is not None and vector_index.get_vector_index_config()['ENABLED']:
+                        try:
+                            vector_index.get_index().add(content_hash, result['embedding'])
+                        except Exception:
+                            import traceback
+                            traceback.print_exc()
+
+                    # Queue the log row; the write-behind writer replaces any
+                    # older entry with the same image hash (duplicate detection)
+                    get_writer().submit(
+                        user.id,
+                        image_path=filename,
+                        image_hash=image_hash,
+                        is_real=result['is_real'],
+                        confidence=result['confidence'],
+                        real_prob=result['real_prob'],
+                        fake_prob=result['fake_prob'],
+                        explanation_image=result.get('image', ''),  # Base64 XAI visualization
+                        explanation_text=result.get('explanation', '')
+                    )
+                    bump_history_version(user.id)
+
+                return JsonResponse({
+                    'success': True, 
+                    'image': result['image'],
+                    'isReal': result['is_real'],
+                    'confidence': result['confidence'],
+                    'real_prob': result['real_prob'],
+                    'fake_prob': result['fake_prob'],
+                    'status': result['status'],
+                    'explanation': result['explanation'],
+                    'fidelity': result['fidelity'],
+                    'explainers': result['explainers'],
+                    'skipped_explainers': skipped_explainers if scan_options is None else [],
+                    'explanation_cost': result['explanation_cost'],
+                    'scan': result.get('scan'),
+                    'message': 'Prediction complete'
+                })
+
+        except AdmissionRejected as e:
+            response = JsonResponse({'success': False, 'message': str(e)}, status=503)
+            response['Retry-After'] = str(e.retry_after)
+            return response
         except Exception as e:
             import traceback
             traceback.print_exc()
@@ -757,3 +954,232 @@ def predict_api(request):
             
     return JsonResponse({'success': False, 'message': 'Method not allowed'}, status=405)
 
+def thumbnail_view(request, path):
+    """Serve an upload thumbnail; names are content-addressed, so caches may keep them forever"""
+    target = thumbnails.resolve(path)
+    if target is None:
+        raise Http404('Thumbnail not found')
+    content_type = 'image/webp' if target.endswith('.webp') else 'image/jpeg'
+    response = FileResponse(open(target, 'rb'), content_type=content_type)
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+@csrf_exempt
+def similar_api(request):
+    """The k previously analysed images most similar to one of the caller's analyses, with their verdicts"""
+    if request.method != 'GET':
+        return JsonResponse({'success': False, 'message': 'Method not allowed'}, status=405)
+
+    user = get_api_user(request)
+
+    if not user:
+        return JsonResponse({'success': False, 'message': 'Not authenticated'}, status=401)
+
+    try:
+        k = min(max(int(request.GET.get('k', 10)), 1), 50)
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'k must be an integer'}, status=400)
+    # Superusers may search every user's analyses; everyone else only their own
+    search_all = user.is_superuser and request.GET.get('scope') == 'all'
+
+    logs = AnalysisLog.objects.filter(image_hash=request.GET.get('hash', ''))
+    if not user.is_superuser:
+        logs = logs.filter(user=user)
+    log = logs.order_by('-timestamp').only('image_path').first()
+    if log is None:
+        return JsonResponse({'success': False, 'message': 'Analysis not found'}, status=404)
+
+    digest = storage.digest_of(log.image_path)
+    index = vector_index.get_index()
+    vector = index.get(digest) if digest else None
+    if vector is None:
+        return JsonResponse({'success': False, 'message': 'Image is not in the similarity index'}, status=404)
+
+    scope = AnalysisLog.objects.all() if search_all else AnalysisLog.objects.filter(user=user)
+    if search_all:
+        # Oversample: recently released files are still indexed but have no rows
+        hits = index.search(vector, k * 4 + 1)
+    else:
+        paths = scope.order_by().values_list('image_path', flat=True).distinct()
+        rows = index.rows_for([d for d in (storage.digest_of(path) for path in paths) if d])
+        hits = index.search(vector, k + 1, rows=rows)
+    hits = [(hit, score) for hit, score in hits if hit != digest]
+
+    paths = dict(StoredImage.objects.filter(digest__in=[hit for hit, _ in hits]).values_list('digest', 'path'))
+    latest = {}
+    for row in scope.filter(image_path__in=list(paths.values())).order_by('-timestamp').values(
+            'image_path', 'image_hash', 'is_real', 'confidence', 'real_prob', 'fake_prob', 'timestamp',
+            'user__username'):
+        latest.setdefault(row['image_path'], row)
+
+    matches = []
+    for hit, score in hits:
+        row = latest.get(paths.get(hit))
+        if row is None:
+            continue
+        match = {
+            'image_hash': row['image_hash'],
+            'image_path': row['image_path'],
+            'thumbnails': thumbnails.thumbnail_urls(row['image_path']),
+            'similarity': round(score, 4),
+            'is_real': row['is_real'],
+            'confidence': row['confidence'],
+            'real_prob': row['real_prob'],
+            'fake_prob': row['fake_prob'],
+            'timestamp': row['timestamp'].strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        if search_all:
+            match['username'] = row['user__username']
+        matches.append(match)
+        if len(matches) == k:
+            break
+    return JsonResponse({'success': True, 'matches': matches})
+
+@csrf_exempt
+def explanation_render_api(request):
+    """Re-render a cached explanation in another layout or size without running the model"""
+    if request.method != 'GET':
+        return JsonResponse({'success': False, 'message': 'Method not allowed'}, status=405)
+
+    user = get_api_user(request)
+
+    if not user:
+        return JsonResponse({'success': False, 'message': 'Not authenticated'}, status=401)
+
+    image_hash = request.GET.get('hash', '')
+    logs = AnalysisLog.objects.filter(image_hash=image_hash)
+    if not user.is_superuser:
+        logs = logs.filter(user=user)
+    log = logs.order_by('-timestamp').first()
+    if log is None:
+        return JsonResponse({'success': False, 'message': 'Analysis not found'}, status=404)
+
+    layout = request.GET.get('layout', 'row')
+    if layout not in LAYOUTS:
+        return JsonResponse({'success': False, 'message': f"layout must be one of {', '.join(LAYOUTS)}"}, status=400)
+    try:
+        size = min(max(int(request.GET.get('size', 150)), 32), MAX_PANEL_SIZE)
+        names = parse_explainer_names(request.GET.get('explainer', 'gradcam,lime'))
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+
+    # Model outputs are cached under the digest of the bytes actually
+    # analysed, which differs from image_hash for downscaled uploads
+    cache_key = storage.digest_of(log.image_path) or image_hash
+    cache = get_explanation_cache()
+    version = runtime.model_version()
+    verdict = cache.get_verdict(cache_key, version)
+    results = [cache.get_result(cache_key, version, EXPLAINERS[name]) for name in names]
+    if verdict is None or any(result is None for result in results):
+        return JsonResponse({'success': False, 'message': 'Explanation is no longer cached, analyze the image again'}, status=404)
+
+    img = verdict['input'][np.newaxis].astype('float32') / 255
+    status = "Real" if verdict['probs'][1] >= AI_FAKE_THRESHOLD else "Fake"
+    source = cv2.imread(storage.absolute_path(log.image_path))
+    if source is None:
+        source = verdict['input']
+    if xai_pool.is_enabled():
+        try:
+            image, _ = xai_pool.explain(source, img, verdict['probs'], status, names, dict(zip(names, results)),
+                                        layout=layout, size=size)
+        except xai_pool.XAIError as e:
+            return JsonResponse({'success': False, 'message': str(e)}, status=503)
+    else:
+        image = render_explanation(input_panel(source, status, size), img, results, layout=layout, size=size)
+    return JsonResponse({'success': True, 'image': image, 'layout': layout, 'size': size, 'explainers': names})
+
+class ClosingIterator:
+    """Iterate `iterable`; close() (called by the response) also runs `on_close`."""
+
+    def __init__(self, iterable, on_close):
+        self._iterator = iter(iterable)
+        self._on_close = on_close
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._iterator)
+
+    def close(self):
+        try:
+            if hasattr(self._iterator, 'close'):
+                self._iterator.close()
+        finally:
+            self._on_close()
+
+@csrf_exempt
+def predict_video_api(request):
+    """Analyze a short clip and stream progress, per-frame scores and the verdict as JSON Lines"""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'message': 'Method not allowed'}, status=405)
+    if 'video' not in request.FILES:
+        return JsonResponse({'success': False, 'message': 'No video provided'}, status=400)
+
+    model_path = settings.DETECTION_MODEL_PATH
+    if not os.path.exists(model_path):
+        return JsonResponse({'success': False, 'message': 'Model file not found'}, status=500)
+
+    try:
+        stride = int(request.POST['stride']) if request.POST.get('stride') else None
+        scene_threshold = float(request.POST['scene_threshold']) if request.POST.get('scene_threshold') else None
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'Invalid stride or scene_threshold'}, status=400)
+
+    # Take the admission slot before streaming starts so overload still gets a 503
+    slot = get_controller().admit()
+    try:
+        slot.__enter__()
+    except AdmissionRejected as e:
+        response = JsonResponse({'success': False, 'message': str(e)}, status=503)
+        response['Retry-After'] = str(e.retry_after)
+        return response
+
+    video_path = None
+    released = []
+
+    def cleanup():
+        # Runs once: from the stream's end, the response's close() or a failed setup
+        if released:
+            return
+        released.append(True)
+        slot.__exit__(None, None, None)
+        if video_path and os.path.exists(video_path):
+            os.remove(video_path)
+
+    # VideoCapture needs a real file; stream the upload to disk in chunks
+    file = request.FILES['video']
+    try:
+        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.name)[1]) as tmp:
+            video_path = tmp.name
+            for chunk in file.chunks():
+                tmp.write(chunk)
+    except Exception as e:
+        cleanup()
+        return JsonResponse({'success': False, 'message': f'Could not store upload: {e}'}, status=500)
+
+    def stream():
+        try:
+            model = runtime.get_model(model_path)
+            events = analyze_video(video_path, model, stride=stride, scene_threshold=scene_threshold)
+            while True:
+                with runtime.inference_context():
+                    event = next(events, None)
+                if event is None:
+                    break
+                if event['type'] == 'result':
+                    status, is_real, confidence = getVerdict(event['real_prob'] / 100)
+                    event.update({'status': status, 'isReal': is_real, 'confidence': confidence})
+                yield json.dumps(event) + "\n"
+        except Exception as e:
+            yield json.dumps({'type': 'error', 'message': str(e)}) + "\n"
+        finally:
+            cleanup()
+
+    # The server closes the response even when the client disconnects
+    # before the body is iterated, which a generator's finally never sees
+    response = StreamingHttpResponse(ClosingIterator(stream(), cleanup), content_type='application/x-ndjson')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
@@ -0,0 +1,256 @@
+"""
+Process pool for the explanation stage.
+
+LIME's ridge fits, superpixel segmentation, mark_boundaries and the PNG
+encode are CPU-bound Python. Run in a threaded Django worker they hold the
+GIL and stall every other request in the process, so classifyImage and the
+explanation re-render hand them to a small pool of processes instead. Each
+pool process loads the model once (single-threaded TF/BLAS/OpenCV, so the
+pool scales with cores rather than oversubscribing them) and keeps its own
+explainers.
+
+Arrays go both ways through multiprocessing.shared_memory: the caller
+copies the decoded upload and model input into blocks and sends only their
+names; the worker returns new heatmaps/segment maps the same way and the
+caller unlinks them after copying. On Pythons without shared_memory (< 3.8,
+which includes the pinned TF 1.14 stack) arrays are pickled instead.
+
+Tasks taking longer than TASK_TIMEOUT raise XAITimeout and the caller
+answers without an explanation image; the worker finishes in the
+background and its output blocks are released when it does. Any other
+failure in the pool is raised as XAIError, so the verdict always stands.
+"""
+import atexit
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+
+import numpy as np
+from django.conf import settings
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+DEFAULT_XAI_POOL = {
+    'ENABLED': False,
+    'WORKERS': 2,               # capped at the CPU count
+    'TASK_TIMEOUT': 60,         # seconds before the caller gives up on a task
+    'THREADS_PER_WORKER': 1,    # TF/BLAS/OpenCV threads inside each pool process
+    'START_METHOD': 'spawn',    # forking a process that holds a TF session is unsafe
+}
+
+
+class XAIError(Exception):
+    """The pool could not produce an explanation; the verdict is still valid."""
+
+
+class XAITimeout(XAIError):
+    """The pool did not finish an explanation within TASK_TIMEOUT."""
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Pool-process state, set by _init_worker
+_worker_model = None
+
+
+def get_xai_pool_config():
+    config = dict(DEFAULT_XAI_POOL)
+    config.update(getattr(settings, 'XAI_POOL', {}) or {})
+    return config
+
+
+def is_enabled():
+    return bool(get_xai_pool_config()['ENABLED'])
+
+
+# Shared-memory transfer -------------------------------------------------
+
+def share_array(array, blocks):
+    """Descriptor for an array, copied into a new shared block appended to `blocks`."""
+    array = np.ascontiguousarray(array)
+    if shared_memory is None:
+        return {'array': array}
+    block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    blocks.append(block)
+    return {'shm': block.name, 'shape': array.shape, 'dtype': array.dtype.str}
+
+
+def load_array(descriptor):
+    """Copy an array out of its descriptor; the block itself is left to its owner."""
+    if 'array' in descriptor:
+        return descriptor['array']
+    block = shared_memory.SharedMemory(name=descriptor['shm'])
+    try:
+        return np.ndarray(descriptor['shape'], dtype=descriptor['dtype'], buffer=block.buf).copy()
+    finally:
+        block.close()
+
+
+def share_result(result, blocks):
+    return {key: {'__array__': share_array(value, blocks)} if isinstance(value, np.ndarray) else value
+            for key, value in result.items()}
+
+
+def load_result(shared):
+    return {key: load_array(value['__array__']) if isinstance(value, dict) and '__array__' in value else value
+            for key, value in shared.items()}
+
+
+def release(blocks):
+    for block in blocks:
+        block.close()
+        try:
+            block.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def release_descriptors(shared_results):
+    """Unlink the blocks behind results returned by a worker."""
+    for result in shared_results.values():
+        for value in result.values():
+            if isinstance(value, dict) and 'shm' in value.get('__array__', {}):
+                try:
+                    block = shared_memory.SharedMemory(name=value['__array__']['shm'])
+                except FileNotFoundError:
+                    continue
+                release([block])
+
+
+# Pool processes ---------------------------------------------------------
+
+def _init_worker(model_path, threads):
+    global _worker_model
+    from . import runtime
+    runtime.apply_thread_limits({
+        'TF_INTRA_OP_THREADS': threads,
+        'TF_INTER_OP_THREADS': 1,
+        'BLAS_THREADS': threads,
+        'CV2_THREADS': threads,
+        'CPU_AFFINITY': '',
+    })
+    _worker_model = runtime.get_model(model_path) if model_path else None
+
+
+def _run_task(task):
+    """Pool entry point: run the missing explainers and render the panel PNG."""
+    from . import runtime
+    from .explainers import EXPLAINERS
+    from .explanation_cache import input_panel, render_explanation
+
+    image = load_array(task['image'])
+    img = load_array(task['input'])
+    cached = {name: load_result(result) for name, result in task['cached'].items()}
+    computed = {}
+    results = []
+    for name in task['explainers']:
+        result = cached.get(name)
+        if result is None:
+            with runtime.inference_context():
+                result = EXPLAINERS[name].explain(img, _worker_model, task['probs'])
+            computed[name] = result
+        results.append(result)
+    png = render_explanation(input_panel(image, task['status'], task['size']), img, results,
+                             layout=task['layout'], size=task['size'])
+
+    # Ownership of the result blocks passes to the caller, which unlinks them
+    blocks = []
+    shared = {name: share_result(result, blocks) for name, result in computed.items()}
+    for block in blocks:
+        block.close()
+    return {'image': png, 'results': shared}
+
+
+# Caller side ------------------------------------------------------------
+
+def get_pool():
+    """Process-wide executor, started on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                config = get_xai_pool_config()
+                workers = max(1, min(int(config['WORKERS']), os.cpu_count() or 1))
+                _pool = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context(config['START_METHOD']),
+                    initializer=_init_worker,
+                    initargs=(getattr(settings, 'DETECTION_MODEL_PATH', None), config['THREADS_PER_WORKER']),
+                )
+    return _pool
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+            _pool = None
+
+
+atexit.register(shutdown)
+
+
+def _discard_late_result(future):
+    # The caller timed out and will never read this result
+    try:
+        release_descriptors(future.result()['results'])
+    except Exception:
+        pass
+
+
+def explain(image, img, probs, status, names, cached, layout='row', size=None):
+    """
+    Run explainers `names` (skipping those in `cached`, {name: result}) in
+    the pool and render the panels. Returns (base64 PNG, {name: new result}).
+    """
+    from .explainers import PANEL_SIZE
+
+    config = get_xai_pool_config()
+    blocks = []
+    try:
+        task = {
+            'image': share_array(image, blocks),
+            'input': share_array(img, blocks),
+            'probs': np.asarray(probs, dtype='float32'),
+            'status': status,
+            'explainers': list(names),
+            'cached': {name: share_result(result, blocks) for name, result in cached.items()},
+            'layout': layout,
+            'size': size or PANEL_SIZE,
+        }
+        try:
+            future = get_pool().submit(_run_task, task)
+        except BrokenProcessPool:
+            # A pool process died (e.g. killed for memory); start a fresh pool
+            shutdown()
+            future = get_pool().submit(_run_task, task)
+        try:
+            output = future.result(timeout=config['TASK_TIMEOUT'])
+        except FutureTimeout:
+            future.add_done_callback(_discard_late_result)
+            raise XAITimeout(f"Explanation took longer than {config['TASK_TIMEOUT']}s")
+        except BrokenProcessPool:
+            shutdown()
+            raise XAIError('Explanation pool process died')
+        except Exception as e:
+            # Anything raised in the worker (including a queued task finding
+            # its inputs unlinked after a timeout) costs only the explanation
+            raise XAIError(f'Explanation failed: {e}') from e
+    finally:
+        # The worker has copied its inputs by the time it returns. After a
+        # timeout, a task that was still queued finds them gone and fails
+        release(blocks)
+
+    try:
+        computed = {name: load_result(result) for name, result in output['results'].items()}
+    finally:
+        release_descriptors(output['results'])
+    return output['image'], computed
@@ -0,0 +1,238 @@
+"""
+Stratified k-fold cross-validation and grid sweeps for the detection CNN.
+
+Every (configuration, fold) pair is one training run in a process pool.
+Workers map model/X.npy read-only instead of holding their own copy of the
+dataset, and each trains with train_model.fit, early-stopping on a
+stratified slice of its training folds so the held-out fold is only used
+for the reported metrics. Runs checkpoint under runs/cv/<sweep>/, so an
+interrupted sweep resumes where it stopped when started again. A run only
+resumes if it was started with the same configuration, folds, seed and
+validation fraction; otherwise its directory is cleared and it restarts.
+
+    python cross_validate.py                                  # 5-fold CV of the served configuration
+    python cross_validate.py --batch-sizes 32,64 --learning-rates 1e-3,3e-4 --dense-units 128,256
+    python cross_validate.py --folds 10 --workers 4 --threads-per-worker 2 --sweep wide
+
+The report (runs/cv/<sweep>/report.json) lists per-configuration mean and
+standard deviation of accuracy, precision, recall and F1, and every run's
+wall-clock and CPU seconds.
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import train_model
+
+METRICS = ('accuracy', 'precision', 'recall', 'fscore')
+
+_threads = 0  # per-worker thread limit, re-applied after every run
+
+
+def stratified_folds(labels, folds, seed):
+    """[(train_idx, test_idx)] with class proportions kept in every fold."""
+    from sklearn.model_selection import StratifiedKFold
+    splitter = StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed)
+    return [(train, test) for train, test in splitter.split(np.zeros(len(labels)), labels)]
+
+
+def holdout(labels, idx, fraction, seed):
+    """Split idx into (fit, validation) keeping class proportions."""
+    from sklearn.model_selection import train_test_split
+    fit_idx, val_idx = train_test_split(idx, test_size=fraction, stratify=labels[idx], random_state=seed)
+    return np.sort(fit_idx), np.sort(val_idx)
+
+
+def score(labels, predicted):
+    from sklearn.metrics import accuracy_score, f1_score, precision_score, recall_score
+    return {
+        'accuracy': accuracy_score(labels, predicted) * 100,
+        'precision': precision_score(labels, predicted, average='macro', zero_division=0) * 100,
+        'recall': recall_score(labels, predicted, average='macro', zero_division=0) * 100,
+        'fscore': f1_score(labels, predicted, average='macro', zero_division=0) * 100,
+    }
+
+
+def predict_classes(model, X, idx, batch_size=256):
+    predicted = []
+    for start in range(0, len(idx), batch_size):
+        chunk = idx[start:start + batch_size]
+        predicted.append(np.argmax(model.predict_on_batch(train_model.batch_inputs(X, chunk)), axis=1))
+    return np.concatenate(predicted) if predicted else np.zeros(0, dtype='int64')
+
+
+# Pool processes ---------------------------------------------------------
+
+def _init_worker(threads):
+    global _threads
+    _threads = threads
+    train_model.limit_threads(threads)
+
+
+def _resumable(run_dir, config):
+    """Whether run_dir holds a run started with exactly this config."""
+    try:
+        with open(os.path.join(run_dir, 'state.json')) as f:
+            return json.load(f)['config'] == config
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+def _run_fold(task):
+    """Pool entry point: train one configuration on one fold and score it."""
+    from keras import backend as K
+    from keras.models import load_model
+
+    wall_started, cpu_started = time.time(), time.process_time()
+    X, Y = train_model.load_dataset(mmap=True)
+    # The fold layout and holdout are part of what the checkpoint was trained on
+    config = dict(task['config'], folds=task['folds'], fold=task['fold'], val_fraction=task['val_fraction'])
+    resume = _resumable(task['run_dir'], config)
+    if not resume:
+        shutil.rmtree(task['run_dir'], ignore_errors=True)
+    fit_idx, val_idx = holdout(Y, task['train_idx'], task['val_fraction'], config['seed'])
+    targets = train_model.one_hot(Y)
+    best_path = os.path.join(task['run_dir'], 'best.hdf5')
+    try:
+        state = train_model.fit(
+            task['run_dir'],
+            lambda: train_model.build_model(X.shape[1:], targets.shape[1], config['dense_units'],
+                                            config['learning_rate']),
+            X, targets, fit_idx, val_idx, config, resume=resume, best_path=best_path, verbose=False)
+        test_idx = np.sort(task['test_idx'])
+        metrics = score(Y[test_idx], predict_classes(load_model(best_path), X, test_idx))
+    finally:
+        # Don't let graphs pile up across the runs a worker handles; a new
+        # session needs the thread limit again
+        K.clear_session()
+        train_model.limit_threads(_threads)
+    return dict(metrics, name=task['name'], fold=task['fold'], epochs=state['epoch'],
+                best_epoch=state['best_epoch'], wall_seconds=round(time.time() - wall_started, 2),
+                cpu_seconds=round(time.process_time() - cpu_started, 2))
+
+
+# Sweep ------------------------------------------------------------------
+
+def configurations(options):
+    for batch_size, learning_rate, dense_units in itertools.product(
+            options.batch_sizes, options.learning_rates, options.dense_units):
+        config = dict(train_model.DEFAULTS, epochs=options.epochs, batch_size=batch_size,
+                      learning_rate=learning_rate, dense_units=dense_units, seed=options.seed,
+                      patience=options.patience)
+        yield f'bs{batch_size}-lr{learning_rate:g}-dense{dense_units}', config
+
+
+def aggregate(runs, configs):
+    """Per-configuration mean/std of each metric plus summed run times, best first."""
+    results = []
+    for name, config in configs:
+        folds = sorted((run for run in runs if run['name'] == name), key=lambda run: run['fold'])
+        if not folds:
+            continue
+        entry = {'name': name, 'batch_size': config['batch_size'], 'learning_rate': config['learning_rate'],
+                 'dense_units': config['dense_units'], 'folds': len(folds)}
+        for metric in METRICS:
+            values = np.array([run[metric] for run in folds])
+            entry[metric + '_mean'] = round(float(values.mean()), 2)
+            entry[metric + '_std'] = round(float(values.std(ddof=1)) if len(values) > 1 else 0.0, 2)
+        entry['wall_seconds'] = round(sum(run['wall_seconds'] for run in folds), 1)
+        entry['cpu_seconds'] = round(sum(run['cpu_seconds'] for run in folds), 1)
+        entry['runs'] = folds
+        results.append(entry)
+    return sorted(results, key=lambda entry: (-entry['accuracy_mean'], entry['accuracy_std']))
+
+
+def print_table(results):
+    print(f"\n{'configuration':<32} {'accuracy':>15} {'precision':>15} {'recall':>15} {'F1':>15} "
+          f"{'wall s':>8} {'cpu s':>8}")
+    for entry in results:
+        cells = ' '.join(f"{entry[m + '_mean']:>7.2f} ± {entry[m + '_std']:<5.2f}" for m in METRICS)
+        print(f"{entry['name']:<32} {cells} {entry['wall_seconds']:>8.0f} {entry['cpu_seconds']:>8.0f}")
+
+
+def csv_list(kind):
+    def parse(value):
+        try:
+            return [kind(item) for item in value.split(',') if item]
+        except ValueError:
+            raise argparse.ArgumentTypeError(f'expected a comma-separated list of {kind.__name__}')
+    return parse
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Cross-validate and grid-sweep the detection CNN')
+    parser.add_argument('--sweep', default='default', help='Run directory under runs/cv/')
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--batch-sizes', type=csv_list(int), default=[train_model.DEFAULTS['batch_size']])
+    parser.add_argument('--learning-rates', type=csv_list(float), default=[train_model.DEFAULTS['learning_rate']])
+    parser.add_argument('--dense-units', type=csv_list(int), default=[train_model.DEFAULTS['dense_units']])
+    parser.add_argument('--epochs', type=int, default=train_model.DEFAULTS['epochs'])
+    parser.add_argument('--patience', type=int, default=train_model.DEFAULTS['patience'])
+    parser.add_argument('--val-fraction', type=float, default=0.1,
+                        help='Share of the training folds used for early stopping')
+    parser.add_argument('--seed', type=int, default=train_model.DEFAULTS['seed'])
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 1) // 2))
+    parser.add_argument('--threads-per-worker', type=int, default=2)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    sweep_dir = os.path.join(train_model.RUNS_DIR, 'cv', options.sweep)
+    os.makedirs(sweep_dir, exist_ok=True)
+
+    # Build the shared cache once; workers only ever map it
+    _, Y = train_model.load_dataset()
+    folds = stratified_folds(Y, options.folds, options.seed)
+    configs = list(configurations(options))
+    tasks = [{
+        'name': name,
+        'config': config,
+        'fold': fold,
+        'folds': options.folds,
+        'train_idx': train_idx,
+        'test_idx': test_idx,
+        'val_fraction': options.val_fraction,
+        'run_dir': os.path.join(sweep_dir, name, f'fold{fold}'),
+    } for name, config in configs for fold, (train_idx, test_idx) in enumerate(folds)]
+    print(f'{len(configs)} configurations x {options.folds} folds = {len(tasks)} runs '
+          f'on {options.workers} workers ({options.threads_per_worker} threads each)')
+
+    runs = []
+    started = time.time()
+    with ProcessPoolExecutor(max_workers=options.workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker, initargs=(options.threads_per_worker,)) as pool:
+        futures = [pool.submit(_run_fold, task) for task in tasks]
+        for future in as_completed(futures):
+            run = future.result()
+            runs.append(run)
+            print(f"[{len(runs)}/{len(tasks)}] {run['name']} fold {run['fold']}: accuracy {run['accuracy']:.2f}% "
+                  f"({run['wall_seconds']:.0f}s wall, {run['cpu_seconds']:.0f}s cpu)")
+
+    results = aggregate(runs, configs)
+    print_table(results)
+    report = {
+        'folds': options.folds,
+        'seed': options.seed,
+        'val_fraction': options.val_fraction,
+        'epochs': options.epochs,
+        'workers': options.workers,
+        'threads_per_worker': options.threads_per_worker,
+        'wall_seconds': round(time.time() - started, 1),
+        'results': results,
+    }
+    report_path = os.path.join(sweep_dir, 'report.json')
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'\nReport written to {report_path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+"""
+Knowledge distillation from DenseNet121 into the fast served CNN.
+
+The teacher (model/densenet_weights.hdf5, trained by AIFakeDetection_script.py)
+is run once over model/X.npy in batches. Its probabilities are cached in
+model/teacher_probs.npy, keyed by the teacher's and the dataset's size and
+mtime. The student is trained with train_model.fit (resumable, early
+stopping) on the loss
+
+    alpha * T^2 * CE(softmax(log(p_teacher) / T), softmax(z_student / T))
+        + (1 - alpha) * CE(one_hot(label), softmax(z_student))
+
+so both sides are softened at T, and is validated against the true labels
+only. At inference the student is an ordinary softmax classifier. It has
+the served architecture by default; --conv-filters and --dense-units make
+it smaller or larger.
+
+    python distill.py                                            # T=4, alpha=0.7, served architecture
+    python distill.py --run-name small --conv-filters 16,32 --dense-units 128
+    python distill.py --run-name small --resume                  # continue an interrupted run
+    python distill.py --output model/nasnet_weights.hdf5         # train straight into the served model
+
+The student trains on the rows AIFakeDetection_script.py trained the
+teacher on (its split stage, which must have run), so the report
+(runs/distill/<run>/report.json) compares the student, the teacher and the
+served CNN on the split the teacher held out. It covers overall and
+per-class accuracy, single-image latency percentiles and batched
+throughput, and flags a model as not held out when its weights did not
+come from that pipeline run (adopted or replaced since).
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+import train_model
+from pipeline import artifacts_unchanged, load_output
+
+TEACHER_PATH = 'model/densenet_weights.hdf5'
+TEACHER_CACHE = 'model/teacher_probs.npy'
+DISTILL_DIR = os.path.join(train_model.RUNS_DIR, 'distill')
+CLASS_NAMES = ['fake', 'real']
+
+
+def _stamp(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def teacher_probabilities(X, teacher_path=TEACHER_PATH, batch_size=256):
+    """Teacher softmax outputs for every row of X, computed once and cached."""
+    from keras.models import load_model
+
+    meta_path = os.path.splitext(TEACHER_CACHE)[0] + '.json'
+    stamp = {'teacher': _stamp(teacher_path), 'dataset': _stamp(train_model.X_CACHE)}
+    if os.path.exists(TEACHER_CACHE) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if json.load(f) == stamp:
+                return np.load(TEACHER_CACHE)
+
+    teacher = load_model(teacher_path)
+    probs = np.zeros((len(X), teacher.output_shape[-1]), dtype='float32')
+    started = time.time()
+    for start in range(0, len(X), batch_size):
+        rows = np.arange(start, min(start + batch_size, len(X)))
+        probs[rows] = teacher.predict_on_batch(train_model.batch_inputs(X, rows))
+        if (start // batch_size) % 20 == 0:
+            print(f"  Teacher: {rows[-1] + 1}/{len(X)} images ({time.time() - started:.0f}s)")
+    np.save(TEACHER_CACHE, probs)
+    with open(meta_path, 'w') as f:
+        json.dump(stamp, f)
+    return probs
+
+
+def soften(probs, temperature):
+    """Re-temper softmax outputs: softmax(log(p) / T)."""
+    logits = np.log(np.clip(probs, 1e-7, 1.0)) / temperature
+    logits -= logits.max(axis=1, keepdims=True)
+    soft = np.exp(logits)
+    return (soft / soft.sum(axis=1, keepdims=True)).astype('float32')
+
+
+def distillation_targets(teacher_probs, labels, train_idx, temperature):
+    """
+    [softened teacher | one-hot label] per row, the y_true distillation_loss
+    unpacks. Rows outside train_idx carry the label in both halves.
+    """
+    hard = train_model.one_hot(labels, teacher_probs.shape[1])
+    soft = hard.copy()
+    soft[train_idx] = soften(teacher_probs[train_idx], temperature)
+    return np.concatenate([soft, hard], axis=1)
+
+
+def distillation_objects(classes, temperature, alpha):
+    """The loss and metric the student is compiled with, by name (for load_model)."""
+    from keras import backend as K
+
+    def distillation_loss(y_true, y_pred):
+        soft, hard = y_true[:, :classes], y_true[:, classes:]
+        softened = K.softmax(K.log(K.clip(y_pred, K.epsilon(), 1.0)) / temperature)
+        return (alpha * temperature ** 2 * K.categorical_crossentropy(soft, softened)
+                + (1 - alpha) * K.categorical_crossentropy(hard, y_pred))
+
+    def hard_accuracy(y_true, y_pred):
+        return K.cast(K.equal(K.argmax(y_true[:, classes:], axis=-1), K.argmax(y_pred, axis=-1)), K.floatx())
+
+    return {'distillation_loss': distillation_loss, 'hard_accuracy': hard_accuracy}
+
+
+def build_student(input_shape, classes, config, custom_objects):
+    from keras.optimizers import Adam
+    model = train_model.build_model(input_shape, classes, config['dense_units'], config['learning_rate'],
+                                    conv_filters=config['conv_filters'])
+    model.compile(optimizer=Adam(lr=config['learning_rate']), loss=custom_objects['distillation_loss'],
+                  metrics=[custom_objects['hard_accuracy']])
+    return model
+
+
+def export_student(best_path, output):
+    """Save the best student without the training loss/optimizer, so plain load_model reads it."""
+    from keras.models import load_model
+    model = load_model(best_path, compile=False)
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    tmp = output + '.tmp'
+    model.save(tmp, include_optimizer=False)
+    os.replace(tmp, output)
+
+
+def pipeline_split(n):
+    """
+    (train rows, test rows) of model/X.npy from AIFakeDetection_script.py's
+    split stage, mapped back through the preprocess shuffle.
+    """
+    load, preprocess, split = (load_output(name) for name in ('load', 'preprocess', 'split'))
+    if None in (load, preprocess, split) or not os.path.exists(preprocess.path('order.npy')):
+        raise SystemExit("No pipeline split found; run `python AIFakeDetection_script.py split` first")
+    if not artifacts_unchanged(load):
+        raise SystemExit(f"{train_model.X_CACHE} changed since the pipeline split it; rerun the pipeline")
+    order = np.load(preprocess.path('order.npy'))
+    if len(order) != n:
+        raise SystemExit(f"The pipeline split covers {len(order)} images, {train_model.X_CACHE} has {n}")
+    split = np.load(split.path('split.npz'))
+    return np.sort(order[split['train']]), np.sort(order[split['test']])
+
+
+def trained_on_split(stage, path):
+    """Whether the weights at path are the ones the pipeline's `stage` trained on its split."""
+    output = load_output(stage)
+    return bool(output is not None and not output.result.get('adopted')
+                and os.path.abspath(output.artifacts['weights']) == os.path.abspath(path)
+                and artifacts_unchanged(output))
+
+
+# Report -----------------------------------------------------------------
+
+def accuracy_report(model, X, labels, idx, batch_size=256):
+    predicted = np.concatenate([
+        np.argmax(model.predict_on_batch(train_model.batch_inputs(X, idx[start:start + batch_size])), axis=1)
+        for start in range(0, len(idx), batch_size)])
+    truth = labels[np.sort(idx)]
+    report = {'accuracy': round(float((predicted == truth).mean()) * 100, 2)}
+    for label, name in enumerate(CLASS_NAMES):
+        mask = truth == label
+        report[name + '_accuracy'] = round(float((predicted[mask] == label).mean()) * 100, 2) if mask.any() else None
+    return report
+
+
+def latency_report(model, X, idx, samples=200, batch_size=64):
+    """Single-image latency percentiles (ms) and batched throughput (images/s)."""
+    rows = np.sort(idx)[:samples]
+    for row in rows[:10]:  # warm up
+        model.predict_on_batch(train_model.batch_inputs(X, [row]))
+    times = []
+    for row in rows:
+        image = train_model.batch_inputs(X, [row])
+        started = time.perf_counter()
+        model.predict_on_batch(image)
+        times.append((time.perf_counter() - started) * 1000)
+    batch = train_model.batch_inputs(X, np.sort(idx)[:batch_size])
+    model.predict_on_batch(batch)
+    started = time.perf_counter()
+    for _ in range(5):
+        model.predict_on_batch(batch)
+    elapsed = time.perf_counter() - started
+    return {
+        'p50_ms': round(float(np.percentile(times, 50)), 3),
+        'p95_ms': round(float(np.percentile(times, 95)), 3),
+        'batch_images_per_s': round(5 * len(batch) / elapsed, 1),
+        'parameters': int(model.count_params()),
+    }
+
+
+def compare(models, held_out, X, labels, test_idx):
+    results = {}
+    for name, path in models.items():
+        if not os.path.exists(path):
+            print(f"  {name}: {path} not found, skipped")
+            continue
+        from keras.models import load_model
+        model = load_model(path)
+        results[name] = dict(path=path, held_out=held_out[name], **accuracy_report(model, X, labels, test_idx),
+                             **latency_report(model, X, test_idx))
+    return results
+
+
+def print_table(results):
+    print(f"\n{'model':<10} {'accuracy':>9} {'fake':>7} {'real':>7} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'img/s':>9} {'params':>11} {'held out':>9}")
+    for name, entry in results.items():
+        cells = [f"{entry[key]:.2f}" if entry[key] is not None else '-'
+                 for key in ('accuracy', 'fake_accuracy', 'real_accuracy')]
+        print(f"{name:<10} {cells[0]:>9} {cells[1]:>7} {cells[2]:>7} {entry['p50_ms']:>8.2f} "
+              f"{entry['p95_ms']:>8.2f} {entry['batch_images_per_s']:>9.0f} {entry['parameters']:>11,} "
+              f"{'yes' if entry['held_out'] else 'NO':>9}")
+
+
+# Command line -----------------------------------------------------------
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Distil the DenseNet121 teacher into a small CNN')
+    parser.add_argument('--run-name', default='default', help=f'Run directory under {DISTILL_DIR}/')
+    parser.add_argument('--resume', action='store_true', help='Continue the run from its last checkpoint')
+    parser.add_argument('--teacher', default=TEACHER_PATH)
+    parser.add_argument('--baseline', default=train_model.BEST_MODEL_PATH, help='Served CNN to compare with')
+    parser.add_argument('--output', help='Where the best student is saved (default: <run dir>/student.hdf5)')
+    parser.add_argument('--temperature', type=float, default=4.0, help='Softening of teacher and student in the loss')
+    parser.add_argument('--alpha', type=float, default=0.7, help='Weight of the teacher targets (0-1)')
+    parser.add_argument('--conv-filters', default='32,32', help='Student conv filters per layer')
+    parser.add_argument('--dense-units', type=int, default=train_model.DEFAULTS['dense_units'])
+    parser.add_argument('--epochs', type=int, default=train_model.DEFAULTS['epochs'])
+    parser.add_argument('--batch-size', type=int, default=train_model.DEFAULTS['batch_size'])
+    parser.add_argument('--learning-rate', type=float, default=train_model.DEFAULTS['learning_rate'])
+    parser.add_argument('--patience', type=int, default=train_model.DEFAULTS['patience'])
+    parser.add_argument('--val-fraction', type=float, default=0.1,
+                        help='Share of the teacher\'s training rows used for early stopping')
+    parser.add_argument('--seed', type=int, default=train_model.DEFAULTS['seed'])
+    parser.add_argument('--threads', type=int, default=0, help='Limit TF/BLAS threads (0 = library default)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.path.exists(args.teacher):
+        raise SystemExit(f"Teacher weights {args.teacher} not found; run AIFakeDetection_script.py train_densenet")
+    train_model.limit_threads(args.threads)
+    run_dir = os.path.join(DISTILL_DIR, args.run_name)
+    output = args.output or os.path.join(run_dir, 'student.hdf5')
+    best_path = os.path.join(run_dir, 'best.hdf5')
+    config = dict(train_model.DEFAULTS, epochs=args.epochs, batch_size=args.batch_size,
+                  learning_rate=args.learning_rate, dense_units=args.dense_units, patience=args.patience,
+                  val_fraction=args.val_fraction, seed=args.seed, temperature=args.temperature, alpha=args.alpha,
+                  conv_filters=[int(n) for n in args.conv_filters.split(',') if n])
+    state_path = os.path.join(run_dir, 'state.json')
+    if args.resume and os.path.exists(state_path):
+        with open(state_path) as f:
+            config = dict(json.load(f)['config'], epochs=args.epochs)
+
+    print("[1/4] Loading dataset...")
+    X, Y = train_model.load_dataset(mmap=True)
+    rest, test_idx = pipeline_split(len(X))
+    fit_pos, val_pos = train_model.split_indices(len(rest), config['val_fraction'], config['seed'])
+    train_idx, val_idx = rest[fit_pos], rest[val_pos]
+    print(f"{len(train_idx)} images used to train, {len(val_idx)} to validate, {len(test_idx)} to evaluate")
+
+    print("\n[2/4] Teacher probabilities...")
+    probs = teacher_probabilities(X, args.teacher)
+    classes = probs.shape[1]
+    targets = distillation_targets(probs, Y, train_idx, config['temperature'])
+    custom_objects = distillation_objects(classes, config['temperature'], config['alpha'])
+
+    print(f"\n[3/4] Training student (T={config['temperature']}, alpha={config['alpha']}, "
+          f"conv {config['conv_filters']}, dense {config['dense_units']})...")
+    state = train_model.fit(
+        run_dir, lambda: build_student(X.shape[1:], classes, config, custom_objects),
+        X, targets, train_idx, val_idx, config, resume=args.resume, best_path=best_path,
+        val_targets=train_model.one_hot(Y, classes), custom_objects=custom_objects)
+    export_student(best_path, output)
+
+    print("\n[4/4] Comparing models on the held-out split...")
+    held_out = {'teacher': trained_on_split('train_densenet', args.teacher),
+                'baseline': trained_on_split('train_cnn', args.baseline), 'student': True}
+    results = compare({'teacher': args.teacher, 'baseline': args.baseline, 'student': output}, held_out,
+                      X, Y, test_idx)
+    print_table(results)
+    report = {'config': config, 'best_epoch': state['best_epoch'], 'models': results}
+    report_path = os.path.join(run_dir, 'report.json')
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nStudent saved to {output}; report written to {report_path}")
+    stale = [name for name, entry in results.items() if not entry['held_out']]
+    if stale:
+        print(f"Note: {', '.join(stale)} did not come from the pipeline run that made this split "
+              "and may have been trained on some of these images.")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,14 @@ import React, { useState, useEffect } from 'react';
 import axios from 'axios';
 import { useNavigate } from 'react-router-dom';
 
+const SERVER_URL = 'http://localhost:8000';
+
+// Thumbnail of an analysed image at one of the server's sizes (64/150/512),
+// or the original upload for entries stored before thumbnails existed
+const imageSrc = (item, size) => item.thumbnails
+    ? `${SERVER_URL}${item.thumbnails[size]}`
+    : `${SERVER_URL}/static/${item.image_path}`;
+
 export default function AdminDashboard() {
     const [logs, setLogs] = useState([]);
     const [users, setUsers] = useState([]);
@@ -604,7 +612,8 @@ export default function AdminDashboard() {
                                 >
                                     <td style={styles.td}>
                                         <img
-                                            src={`http://localhost:8000/static/${log.image_path}`}
+                                            src={imageSrc(log, '64')}
+                                            loading="lazy"
                                             alt=""
                                             style={styles.thumb}
                                             onError={(e) => { e.target.src = 'https://via.placeholder.com/40?text=?' }}
@@ -782,7 +791,8 @@ export default function AdminDashboard() {
                                             cursor: 'pointer'
                                         }} onClick={() => { setSelectedUser(null); setSelectedLog(log); }}>
                                             <img
-                                                src={`http://localhost:8000/static/${log.image_path}`}
+                                                src={imageSrc(log, '150')}
+                                                loading="lazy"
                                                 alt=""
                                                 style={{ width: '100%', height: '100px', objectFit: 'cover' }}
                                                 onError={(e) => { e.target.src = 'https://via.placeholder.com/150?text=?' }}
@@ -826,7 +836,7 @@ export default function AdminDashboard() {
                             <div style={{ display: 'grid', gridTemplateColumns: '1fr 1fr', gap: '24px' }}>
                                 <div>
                                     <img
-                                        src={`http://localhost:8000/static/${selectedLog.image_path}`}
+                                        src={imageSrc(selectedLog, '512')}
                                         alt="Analysis"
                                         style={{ width: '100%', borderRadius: '12px', maxHeight: '300px', objectFit: 'contain', background: '#0d0d10' }}
                                         onError={(e) => { e.target.src = 'https://via.placeholder.com/300?text=Image+Not+Found' }}
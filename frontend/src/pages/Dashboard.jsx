@@ -1,6 +1,7 @@
 import React, { useState, useRef, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
 import axios from 'axios';
+import { prepareUpload, getFullResolution, setFullResolution } from '../utils/upload';
 
 export default function Dashboard() {
     const [selectedFile, setSelectedFile] = useState(null);
@@ -13,6 +14,7 @@ export default function Dashboard() {
     const [showResult, setShowResult] = useState(false);
     const [showCamera, setShowCamera] = useState(false);
     const [cameraStream, setCameraStream] = useState(null);
+    const [fullResolution, setFullResolutionState] = useState(getFullResolution);
     const fileInputRef = useRef(null);
     const videoRef = useRef(null);
     const canvasRef = useRef(null);
@@ -37,10 +39,9 @@ export default function Dashboard() {
         setError('');
         setAnalysisStage('processing');
 
-        const formData = new FormData();
-        formData.append('image', file);
-
         try {
+            const formData = await prepareUpload(file);
+
             // Simulate stage transitions with slightly longer times for better feel
             setTimeout(() => setAnalysisStage('generating'), 2000);
 
@@ -63,7 +64,12 @@ export default function Dashboard() {
                 setLoading(false);
             }, 800);
         } catch (err) {
-            setError('Analysis failed. Please try again.');
+            if (err.response?.status === 503) {
+                const retryAfter = err.response.headers['retry-after'];
+                setError(`Server is busy. Please try again${retryAfter ? ` in ${retryAfter}s` : ''}.`);
+            } else {
+                setError('Analysis failed. Please try again.');
+            }
             setLoading(false);
             setAnalysisStage('');
         }
@@ -761,6 +767,22 @@ export default function Dashboard() {
                                 />
                             </div>
 
+                            {/* Upload resolution */}
+                            <label
+                                style={{ display: 'flex', alignItems: 'center', justifyContent: 'center', gap: '8px', marginTop: '16px', color: '#6b6b78', fontSize: '13px', cursor: 'pointer' }}
+                                title="Send the original file instead of a downscaled copy"
+                            >
+                                <input
+                                    type="checkbox"
+                                    checked={fullResolution}
+                                    onChange={(e) => {
+                                        setFullResolution(e.target.checked);
+                                        setFullResolutionState(e.target.checked);
+                                    }}
+                                />
+                                Full-resolution upload (forensic)
+                            </label>
+
                             {/* Camera Capture Option */}
                             <div style={{ marginTop: '24px', textAlign: 'center' }}>
                                 <p style={{ color: '#6b6b78', fontSize: '13px', marginBottom: '16px' }}>or</p>
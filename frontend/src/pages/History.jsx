@@ -2,6 +2,14 @@ import React, { useState, useEffect } from 'react';
 import axios from 'axios';
 import { useNavigate, Link } from 'react-router-dom';
 
+const SERVER_URL = 'http://localhost:8000';
+
+// Thumbnail of an analysed image at one of the server's sizes (64/150/512),
+// or the original upload for entries stored before thumbnails existed
+const imageSrc = (item, size) => item.thumbnails
+    ? `${SERVER_URL}${item.thumbnails[size]}`
+    : `${SERVER_URL}/static/${item.image_path}`;
+
 export default function History() {
     const [history, setHistory] = useState([]);
     const [loading, setLoading] = useState(true);
@@ -292,7 +300,10 @@ export default function History() {
                         >
                             <div style={styles.imageContainer}>
                                 <img
-                                    src={`http://localhost:8000/static/${item.image_path}`}
+                                    src={imageSrc(item, '512')}
+                                    srcSet={item.thumbnails ? `${imageSrc(item, '150')} 150w, ${imageSrc(item, '512')} 512w` : undefined}
+                                    sizes="(max-width: 640px) 100vw, 360px"
+                                    loading="lazy"
                                     alt="Analysis"
                                     style={styles.image}
                                     onError={(e) => { e.target.src = 'https://via.placeholder.com/300?text=Image+Not+Found' }}
@@ -334,7 +345,7 @@ export default function History() {
                         </div>
                         <div style={styles.modalBody}>
                             <img
-                                src={`http://localhost:8000/static/${selectedItem.image_path}`}
+                                src={imageSrc(selectedItem, '512')}
                                 alt="Analysis"
                                 style={styles.modalImage}
                                 onError={(e) => { e.target.src = 'https://via.placeholder.com/600?text=Image+Not+Found' }}
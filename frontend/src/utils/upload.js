@@ -0,0 +1,50 @@
+// Client-side downscaling for /api/predict uploads.
+//
+// The server only keeps a 32x32 model input and a 150px display image, so
+// by default the browser sends a copy no larger than VITE_UPLOAD_MAX_EDGE
+// plus the SHA-256 of the original file (the server deduplicates history on
+// that hash). Forensic mode, or any failure here, sends the original file.
+
+const MAX_EDGE = Number(import.meta.env.VITE_UPLOAD_MAX_EDGE) || 1024;
+const QUALITY = 0.9;
+const FULL_RES_KEY = 'upload_full_resolution';
+
+export const getFullResolution = () => localStorage.getItem(FULL_RES_KEY) === '1';
+
+export const setFullResolution = (enabled) => {
+    localStorage.setItem(FULL_RES_KEY, enabled ? '1' : '0');
+};
+
+const downscaleInWorker = (file) => new Promise((resolve, reject) => {
+    const worker = new Worker(new URL('../workers/downscale.worker.js', import.meta.url), { type: 'module' });
+    worker.onmessage = ({ data }) => {
+        worker.terminate();
+        data.error ? reject(new Error(data.error)) : resolve(data);
+    };
+    worker.onerror = (event) => {
+        worker.terminate();
+        reject(new Error(event.message));
+    };
+    worker.postMessage({ file, maxEdge: MAX_EDGE, quality: QUALITY });
+});
+
+// Returns a FormData ready to post to /api/predict.
+export const prepareUpload = async (file, fullResolution = getFullResolution()) => {
+    const formData = new FormData();
+    if (!fullResolution && typeof Worker !== 'undefined' && window.crypto?.subtle) {
+        try {
+            const { hash, blob } = await downscaleInWorker(file);
+            if (blob) {
+                const name = file.name.replace(/\.[^.]*$/, '') + '.jpg';
+                formData.append('image', blob, name);
+                formData.append('reduced', '1');
+                formData.append('original_hash', hash);
+                return formData;
+            }
+        } catch (err) {
+            console.warn('Downscaling failed, uploading the original', err);
+        }
+    }
+    formData.append('image', file);
+    return formData;
+};
@@ -0,0 +1,34 @@
+// Decodes an image off the main thread, hashes the original bytes and
+// re-encodes a downscaled JPEG copy. Replies with { hash, blob } where blob
+// is null when the reduced copy wouldn't be smaller than the original, or
+// { error } when the browser lacks OffscreenCanvas / createImageBitmap.
+
+const toHex = (buffer) =>
+    Array.from(new Uint8Array(buffer), (b) => b.toString(16).padStart(2, '0')).join('');
+
+self.onmessage = async ({ data }) => {
+    const { file, maxEdge, quality } = data;
+    try {
+        if (typeof OffscreenCanvas === 'undefined' || typeof createImageBitmap === 'undefined') {
+            throw new Error('OffscreenCanvas is not supported');
+        }
+        const bytes = await file.arrayBuffer();
+        const hash = toHex(await crypto.subtle.digest('SHA-256', bytes));
+
+        const bitmap = await createImageBitmap(file);
+        const scale = Math.min(1, maxEdge / Math.max(bitmap.width, bitmap.height));
+        const width = Math.max(1, Math.round(bitmap.width * scale));
+        const height = Math.max(1, Math.round(bitmap.height * scale));
+
+        const canvas = new OffscreenCanvas(width, height);
+        const ctx = canvas.getContext('2d');
+        ctx.imageSmoothingQuality = 'high';
+        ctx.drawImage(bitmap, 0, 0, width, height);
+        bitmap.close();
+
+        const blob = await canvas.convertToBlob({ type: 'image/jpeg', quality });
+        self.postMessage({ hash, blob: blob.size < file.size ? blob : null });
+    } catch (err) {
+        self.postMessage({ error: err.message || String(err) });
+    }
+};
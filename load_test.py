@@ -0,0 +1,440 @@
+"""
+Load-test the API with scripted user journeys.
+
+A self-contained asyncio load generator (standard library only) meant to
+be pointed at a local `manage.py runserver` or WSGI server. Virtual users
+loop over journeys:
+
+    user   register -> log in -> upload testImages/* -> page through history
+           (revalidating with If-None-Match) -> log out
+    admin  log in -> admin logs -> trends -> export -> profiles -> log out
+
+Concurrency ramps through the stages given with --stages ("users:seconds"
+pairs). Per stage and endpoint the report holds request counts, throughput,
+error rate and latency percentiles; it is written as JSON and HTML. With
+--baseline the run is compared to an earlier JSON report and the exit
+status is 1 when an endpoint regressed by more than --max-regression.
+
+    python load_test.py --stages 1:20,5:30,10:30,20:60
+    python load_test.py --admin admin:secret --admin-ratio 0.1 --output reports/run1
+    python load_test.py --baseline reports/run1.json --max-regression 25
+
+Registered load-test users are deleted afterwards when --admin is given.
+Run against a scratch database: every upload is logged like a real one.
+"""
+import argparse
+import asyncio
+import glob
+import html
+import json
+import mimetypes
+import os
+import random
+import sys
+import time
+import uuid
+from urllib.parse import urlsplit
+
+DEFAULT_URL = 'http://127.0.0.1:8000'
+DEFAULT_STAGES = '1:15,5:30,10:30,20:30'
+PERCENTILES = (50, 90, 95, 99)
+THINK_TIME = (0.2, 1.0)         # seconds between a user's steps
+
+
+class HttpError(Exception):
+    pass
+
+
+class Client:
+    """
+    One virtual user's keep-alive HTTP/1.1 connection with a cookie jar.
+    Every request is timed and recorded under its endpoint label.
+    """
+
+    def __init__(self, base_url, stats, timeout):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.stats = stats
+        self.timeout = timeout
+        self.cookies = {}
+        self.headers = {}
+        self.reader = self.writer = None
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+    async def request(self, method, path, label=None, body=b'', headers=None, ok=(200,)):
+        label = label or f"{method} {path.split('?')[0]}"
+        started = time.perf_counter()
+        try:
+            status, response_headers, data = await asyncio.wait_for(
+                self._exchange(method, path, body, headers or {}), self.timeout)
+        except (OSError, asyncio.TimeoutError, HttpError) as e:
+            await self.close()
+            self.stats.record(label, time.perf_counter() - started, None, type(e).__name__)
+            raise HttpError(f'{label}: {type(e).__name__}') from e
+        self.stats.record(label, time.perf_counter() - started, status, None if status in ok else str(status))
+        return status, response_headers, data
+
+    async def json(self, method, path, payload=None, **kwargs):
+        body = json.dumps(payload).encode() if payload is not None else b''
+        headers = {'Content-Type': 'application/json'} if payload is not None else {}
+        status, _, data = await self.request(method, path, body=body, headers=headers, **kwargs)
+        try:
+            return status, json.loads(data or b'{}')
+        except ValueError:
+            return status, {}
+
+    async def _exchange(self, method, path, body, headers):
+        for attempt in (0, 1):
+            fresh = self.writer is None
+            if fresh:
+                self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+            try:
+                return await self._send(method, path, body, headers)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # The server closed an idle keep-alive connection; retry once on a new one
+                await self.close()
+                if fresh or attempt:
+                    raise
+
+    async def _send(self, method, path, body, headers):
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {self.host}:{self.port}',
+                 'Connection: keep-alive', f'Content-Length: {len(body)}']
+        lines += [f'{name}: {value}' for name, value in {**self.headers, **headers}.items()]
+        if self.cookies:
+            lines.append('Cookie: ' + '; '.join(f'{k}={v}' for k, v in self.cookies.items()))
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readuntil(b'\r\n')
+        try:
+            status = int(status_line.split()[1])
+        except (IndexError, ValueError):
+            raise HttpError(f'Bad status line {status_line!r}')
+        response_headers = {}
+        while True:
+            line = (await self.reader.readuntil(b'\r\n')).decode('latin-1').rstrip('\r\n')
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            name, value = name.strip().lower(), value.strip()
+            if name == 'set-cookie':
+                cookie, _, _ = value.partition(';')
+                key, _, cookie_value = cookie.partition('=')
+                self.cookies[key.strip()] = cookie_value.strip()
+            response_headers[name] = value
+
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            data = b''
+        elif 'content-length' in response_headers:
+            data = await self.reader.readexactly(int(response_headers['content-length']))
+        elif response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            data = await self._read_chunked()
+        else:
+            # No framing (e.g. a streamed export): the body ends with the connection
+            data = await self.reader.read()
+            await self.close()
+            return status, response_headers, data
+        if response_headers.get('connection', '').lower() == 'close':
+            await self.close()
+        return status, response_headers, data
+
+    async def _read_chunked(self):
+        chunks = []
+        while True:
+            size = int((await self.reader.readuntil(b'\r\n')).split(b';')[0], 16)
+            if size == 0:
+                while (await self.reader.readuntil(b'\r\n')) != b'\r\n':
+                    pass
+                return b''.join(chunks)
+            chunks.append(await self.reader.readexactly(size))
+            await self.reader.readexactly(2)
+
+
+def multipart(fields, files):
+    """Encode form fields and (name, filename, bytes) files as multipart/form-data."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filename, content in files:
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: {content_type}\r\n\r\n'.encode() + content + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class Stats:
+    """Latencies and errors per (stage, endpoint)."""
+
+    def __init__(self):
+        self.stage = None
+        self.samples = {}
+        self.errors = {}
+        self.stage_seconds = {}
+
+    def record(self, label, elapsed, status, error):
+        if self.stage is None:
+            return
+        key = (self.stage, label)
+        self.samples.setdefault(key, []).append(elapsed)
+        if error:
+            self.errors.setdefault(key, {}).setdefault(error, 0)
+            self.errors[key][error] += 1
+
+    def summary(self):
+        stages = []
+        for stage, seconds in self.stage_seconds.items():
+            endpoints = {}
+            for (sample_stage, label), latencies in sorted(self.samples.items()):
+                if sample_stage != stage:
+                    continue
+                errors = self.errors.get((stage, label), {})
+                endpoints[label] = summarize(latencies, sum(errors.values()), seconds)
+                endpoints[label]['errors_by_kind'] = errors
+            everything = [value for (s, _), values in self.samples.items() if s == stage for value in values]
+            error_count = sum(sum(kinds.values()) for (s, _), kinds in self.errors.items() if s == stage)
+            stages.append({'stage': stage, 'seconds': round(seconds, 1),
+                           'overall': summarize(everything, error_count, seconds), 'endpoints': endpoints})
+        return stages
+
+
+def summarize(latencies, errors, seconds):
+    ordered = sorted(latencies)
+    count = len(ordered)
+
+    def percentile(p):
+        return round(ordered[min(count - 1, int(count * p / 100))] * 1000, 1) if count else None
+
+    return {
+        'requests': count,
+        'throughput_rps': round(count / seconds, 2) if seconds else 0,
+        'error_rate': round(errors / count, 4) if count else 0,
+        **{f'p{p}_ms': percentile(p) for p in PERCENTILES},
+        'max_ms': round(ordered[-1] * 1000, 1) if count else None,
+    }
+
+
+async def think():
+    await asyncio.sleep(random.uniform(*THINK_TIME))
+
+
+async def user_journey(client, options, created):
+    username = f'lt-{options.run_id}-{uuid.uuid4().hex[:8]}'
+    password = uuid.uuid4().hex
+    await client.json('POST', '/api/register', {
+        'name': 'Load Test', 'username': username, 'password': password, 'email': f'{username}@example.invalid',
+    })
+    await think()
+    status, data = await client.json('POST', '/api/login', {'username': username, 'password': password})
+    if status != 200:
+        return
+    created.append(data.get('user_id'))
+    await think()
+
+    for path in random.sample(options.images, min(options.uploads, len(options.images))):
+        with open(path, 'rb') as f:
+            body, content_type = multipart({}, [('image', os.path.basename(path), f.read())])
+        # 503 is the admission controller shedding load: counted, but not as a failure
+        await client.request('POST', '/api/predict', body=body, headers={'Content-Type': content_type},
+                             ok=(200, 503))
+        await think()
+
+    etag = None
+    for _ in range(options.history_pages):
+        headers = {'If-None-Match': etag} if etag else {}
+        _, response_headers, _ = await client.request('GET', '/api/history', headers=headers, ok=(200, 304))
+        etag = response_headers.get('etag', etag)
+        await think()
+
+    await client.request('POST', '/api/logout')
+
+
+async def admin_journey(client, options, created):
+    username, password = options.admin
+    status, _ = await client.json('POST', '/api/login', {'username': username, 'password': password})
+    if status != 200:
+        return
+    await think()
+    for path in ('/api/admin/logs', '/api/admin/trends?period=day&days=30',
+                 '/api/admin/trends?period=hour&days=2',
+                 '/api/admin/export?format=jsonl&gzip=1&columns=id,timestamp,username,is_real,confidence',
+                 '/api/admin/profiles'):
+        await client.request('GET', path)
+        await think()
+    await client.request('POST', '/api/logout')
+
+
+async def virtual_user(options, stats, created, stop):
+    while not stop.is_set():
+        client = Client(options.url, stats, options.timeout)
+        journey = admin_journey if options.admin and random.random() < options.admin_ratio else user_journey
+        try:
+            await journey(client, options, created)
+        except HttpError:
+            # Already recorded; start the next journey after a pause
+            await asyncio.sleep(1)
+        finally:
+            await client.close()
+
+
+async def run_stages(options, stats, created):
+    users = []
+    stop = asyncio.Event()
+    for users_wanted, seconds in options.stages:
+        stats.stage = f'{users_wanted} users'
+        while len(users) < users_wanted:
+            users.append(asyncio.ensure_future(virtual_user(options, stats, created, stop)))
+            # Stagger arrivals over the first seconds of the stage
+            await asyncio.sleep(min(0.1, seconds / (4.0 * users_wanted)))
+        print(f'Stage: {users_wanted} concurrent users for {seconds}s', file=sys.stderr)
+        started = time.perf_counter()
+        await asyncio.sleep(seconds)
+        stats.stage_seconds[stats.stage] = time.perf_counter() - started
+    stats.stage = None
+    stop.set()
+    # Let journeys finish their current step, then abandon whatever is left
+    await asyncio.wait(users, timeout=options.timeout)
+    for task in users:
+        task.cancel()
+
+
+async def cleanup(options, created):
+    if not options.admin or not created:
+        return
+    client = Client(options.url, Stats(), options.timeout)
+    try:
+        username, password = options.admin
+        await client.json('POST', '/api/login', {'username': username, 'password': password})
+        for user_id in created:
+            if user_id:
+                await client.request('DELETE', f'/api/admin/user/{user_id}')
+    except HttpError as e:
+        print(f'Cleanup stopped: {e}', file=sys.stderr)
+    finally:
+        await client.close()
+
+
+def compare(report, baseline, max_regression):
+    """Endpoints whose p95 or error rate got worse than the baseline allows."""
+    regressions = []
+    old_stages = {stage['stage']: stage for stage in baseline['stages']}
+    for stage in report['stages']:
+        old = old_stages.get(stage['stage'])
+        if old is None:
+            continue
+        for label, new_stats in stage['endpoints'].items():
+            old_stats = old['endpoints'].get(label)
+            if not old_stats or not old_stats['p95_ms'] or not new_stats['p95_ms']:
+                continue
+            change = (new_stats['p95_ms'] - old_stats['p95_ms']) / old_stats['p95_ms'] * 100
+            if change > max_regression:
+                regressions.append(f"{stage['stage']} {label}: p95 {old_stats['p95_ms']} -> "
+                                   f"{new_stats['p95_ms']} ms (+{change:.0f}%)")
+            if new_stats['error_rate'] > old_stats['error_rate'] + 0.01:
+                regressions.append(f"{stage['stage']} {label}: error rate {old_stats['error_rate']:.2%} -> "
+                                   f"{new_stats['error_rate']:.2%}")
+    return regressions
+
+
+def render_html(report):
+    columns = ['requests', 'throughput_rps', 'error_rate'] + [f'p{p}_ms' for p in PERCENTILES] + ['max_ms']
+    rows = []
+    for stage in report['stages']:
+        rows.append(f"<h2>{html.escape(stage['stage'])} ({stage['seconds']}s)</h2><table><tr><th>endpoint</th>" +
+                    ''.join(f'<th>{c}</th>' for c in columns) + '</tr>')
+        for label, values in [('all', stage['overall'])] + list(stage['endpoints'].items()):
+            cells = ''.join(f"<td>{'' if values[c] is None else values[c]}</td>" for c in columns)
+            rows.append(f'<tr><td>{html.escape(label)}</td>{cells}</tr>')
+        rows.append('</table>')
+    regressions = ''.join(f'<li>{html.escape(r)}</li>' for r in report.get('regressions', []))
+    return (
+        '<!DOCTYPE html><html><head><meta charset="utf-8"><title>Load test report</title><style>'
+        'body{font-family:sans-serif;margin:2em}table{border-collapse:collapse;margin-bottom:1.5em}'
+        'td,th{border:1px solid #ccc;padding:4px 8px;text-align:right}td:first-child{text-align:left}'
+        '</style></head><body>'
+        f"<h1>Load test {html.escape(report['run_id'])}</h1>"
+        f"<p>{html.escape(report['url'])}, started {html.escape(report['started'])}</p>"
+        + (f'<h2>Regressions</h2><ul>{regressions}</ul>' if regressions else '')
+        + ''.join(rows) + '</body></html>'
+    )
+
+
+def parse_stages(spec):
+    try:
+        stages = [tuple(int(part) for part in stage.split(':')) for stage in spec.split(',') if stage]
+        if not stages or any(len(stage) != 2 or min(stage) < 1 for stage in stages):
+            raise ValueError
+    except ValueError:
+        raise argparse.ArgumentTypeError('stages must look like 1:30,5:60 (users:seconds)')
+    return stages
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Load-test the detection API with scripted journeys')
+    parser.add_argument('--url', default=DEFAULT_URL)
+    parser.add_argument('--stages', type=parse_stages, default=parse_stages(DEFAULT_STAGES),
+                        help=f'Concurrency ramp as users:seconds pairs (default {DEFAULT_STAGES})')
+    parser.add_argument('--images', default='testImages', help='Directory of images to upload')
+    parser.add_argument('--uploads', type=int, default=3, help='Uploads per user journey')
+    parser.add_argument('--history-pages', type=int, default=3, help='History requests per user journey')
+    parser.add_argument('--admin', help='username:password of a superuser, enables admin journeys and cleanup')
+    parser.add_argument('--admin-ratio', type=float, default=0.1, help='Share of journeys run as the admin')
+    parser.add_argument('--timeout', type=float, default=60.0, help='Per-request timeout in seconds')
+    parser.add_argument('--output', default='load-test-report', help='Report path without extension')
+    parser.add_argument('--baseline', help='Earlier JSON report to compare against')
+    parser.add_argument('--max-regression', type=float, default=20.0, help='Allowed p95 increase in percent')
+    options = parser.parse_args(argv)
+
+    if options.admin:
+        username, sep, password = options.admin.partition(':')
+        if not sep:
+            parser.error('--admin must be username:password')
+        options.admin = (username, password)
+    options.images = sorted(path for path in glob.glob(os.path.join(options.images, '*'))
+                            if mimetypes.guess_type(path)[0] in ('image/jpeg', 'image/png', 'image/webp', 'image/bmp'))
+    if not options.images:
+        parser.error('no images found to upload')
+    options.run_id = time.strftime('%Y%m%d%H%M%S')
+    return options
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    stats = Stats()
+    created = []
+    started = time.strftime('%Y-%m-%d %H:%M:%S')
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(run_stages(options, stats, created))
+    loop.run_until_complete(cleanup(options, created))
+
+    report = {'run_id': options.run_id, 'url': options.url, 'started': started,
+              'stages': stats.summary()}
+    if options.baseline:
+        with open(options.baseline) as f:
+            report['regressions'] = compare(report, json.load(f), options.max_regression)
+
+    os.makedirs(os.path.dirname(os.path.abspath(options.output)), exist_ok=True)
+    with open(options.output + '.json', 'w') as f:
+        json.dump(report, f, indent=2)
+    with open(options.output + '.html', 'w') as f:
+        f.write(render_html(report))
+
+    for stage in report['stages']:
+        overall = stage['overall']
+        print(f"{stage['stage']:>10}: {overall['throughput_rps']} req/s, p95 {overall['p95_ms']} ms, "
+              f"errors {overall['error_rate']:.2%}")
+    for regression in report.get('regressions', []):
+        print(f'REGRESSION {regression}')
+    print(f'Report written to {options.output}.json and {options.output}.html')
+    return 1 if report.get('regressions') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
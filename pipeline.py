@@ -0,0 +1,298 @@
+"""
+A small cached stage DAG for the research scripts.
+
+A Stage is a function plus the names of the stages it depends on, its
+parameters, the input files/directories it reads and, optionally, fixed
+artifact paths it writes (anything else goes into its own cache directory,
+ctx.path(...)). Every stage is keyed by a hash of its function's source,
+its parameters, the fingerprints (path, size, mtime) of its inputs and the
+output digests of its dependencies. A rerun only recomputes stages whose
+key changed or whose artifacts are gone, and runs stages that don't depend
+on each other in parallel in a process pool.
+
+Stages marked adopt=True take over artifacts that already exist before the
+pipeline ever recorded them (model/X.npy, model/*.hdf5), and accept files
+replaced behind the pipeline's back (e.g. by train_model.py) as their new
+output, so downstream stages rerun against them. Either way the output's
+result carries adopted=True and the adoption is logged, so reports can tell
+such files from ones the stage produced itself. A stage that started but
+never finished is never adopted: whatever it left behind is rerun.
+
+Records live in <cache dir>/<stage>/record.json; a stage's own files in
+<cache dir>/<stage>/<key prefix>/.
+"""
+import hashlib
+import inspect
+import json
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+CACHE_DIR = '.cache/pipeline'
+
+
+class PipelineError(Exception):
+    pass
+
+
+def fingerprint(path):
+    """Hash of the names, sizes and mtimes under path ('missing' if absent)."""
+    if not os.path.exists(path):
+        return 'missing'
+    digest = hashlib.sha256()
+    if os.path.isfile(path):
+        entries = [(os.path.basename(path), path)]
+    else:
+        entries = []
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                full = os.path.join(root, name)
+                entries.append((os.path.relpath(full, path), full))
+    for name, full in entries:
+        stat = os.stat(full)
+        digest.update(f'{name}\0{stat.st_size}\0{stat.st_mtime_ns}\n'.encode())
+    return digest.hexdigest()
+
+
+def _stat(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _hash(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class Stage:
+    def __init__(self, name, func, deps=(), params=None, inputs=(), artifacts=None, adopt=False):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.params = params or {}
+        self.inputs = list(inputs)
+        self.artifacts = artifacts or {}
+        self.adopt = adopt
+
+
+class Output:
+    """What a finished (or cached) stage hands to the stages after it."""
+
+    def __init__(self, record):
+        self.result = record['result']
+        self.dir = record['dir']
+        self.artifacts = {name: entry[0] for name, entry in record['artifacts'].items()}
+        self.artifact_stats = {name: tuple(entry) for name, entry in record['artifacts'].items()}
+        self.digest = record['digest']
+
+    def path(self, filename):
+        return os.path.join(self.dir, filename)
+
+
+def load_output(name, cache_dir=CACHE_DIR):
+    """
+    The recorded Output of a stage from an earlier run, for tools outside
+    the pipeline; None if it never ran or its directory is gone.
+    """
+    try:
+        with open(os.path.join(cache_dir, name, 'record.json')) as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return Output(record) if os.path.isdir(record['dir']) else None
+
+
+def artifacts_unchanged(output):
+    """True while the stage's fixed artifacts are still the files it recorded."""
+    return all(os.path.exists(path) and _stat(path) == stat for path, stat in output.artifact_stats.values())
+
+
+class Context:
+    """Passed to a stage function: its params, dependency outputs and output locations."""
+
+    def __init__(self, name, params, inputs, out_dir, artifacts):
+        self.name = name
+        self.params = params
+        self.inputs = inputs
+        self.out_dir = out_dir
+        self.artifacts = artifacts
+
+    def path(self, filename):
+        return os.path.join(self.out_dir, filename)
+
+
+def _execute(func, ctx):
+    started = time.time()
+    result = func(ctx) or {}
+    return result, time.time() - started
+
+
+class Pipeline:
+    def __init__(self, stages, cache_dir=CACHE_DIR, jobs=2, log=print):
+        self.stages = {stage.name: stage for stage in stages}
+        self.order = [stage.name for stage in stages]
+        self.cache_dir = cache_dir
+        self.jobs = max(1, jobs)
+        self.log = log
+        for stage in stages:
+            for dep in stage.deps:
+                if dep not in self.stages or self.order.index(dep) > self.order.index(stage.name):
+                    raise PipelineError(f'{stage.name}: dependency {dep} must be declared before it')
+
+    def needed(self, targets=None):
+        """Targets and everything upstream of them, in declaration order."""
+        wanted = set()
+        stack = list(targets or self.order)
+        while stack:
+            name = stack.pop()
+            if name not in self.stages:
+                raise PipelineError(f'Unknown stage {name}')
+            if name not in wanted:
+                wanted.add(name)
+                stack.extend(self.stages[name].deps)
+        return [name for name in self.order if name in wanted]
+
+    def key(self, stage, done):
+        return _hash({
+            'stage': stage.name,
+            'source': hashlib.sha256(inspect.getsource(stage.func).encode()).hexdigest(),
+            'params': stage.params,
+            'inputs': {path: fingerprint(path) for path in stage.inputs},
+            'deps': {dep: done[dep].digest for dep in stage.deps},
+        })
+
+    def _record_path(self, name):
+        return os.path.join(self.cache_dir, name, 'record.json')
+
+    def _load_record(self, name):
+        try:
+            with open(self._record_path(name)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_record(self, stage, key, out_dir, result, seconds):
+        artifacts = {name: [path, _stat(path)] for name, path in stage.artifacts.items()}
+        record = {
+            'key': key,
+            'dir': out_dir,
+            'result': result,
+            'artifacts': artifacts,
+            'digest': _hash([key, artifacts, result]),
+            'seconds': round(seconds, 2),
+            'finished': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        path = self._record_path(stage.name)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(record, f, indent=2)
+        os.replace(path + '.tmp', path)
+        return Output(record)
+
+    def _out_dir(self, name, key):
+        return os.path.join(self.cache_dir, name, key[:16])
+
+    def _running_path(self, name):
+        """Present from a stage's submission until its record is saved."""
+        return os.path.join(self.cache_dir, name, 'running')
+
+    def cached(self, stage, key):
+        """The stage's Output if it is up to date for key, else None."""
+        if os.path.exists(self._running_path(stage.name)):
+            return None  # the last run died part-way; its artifacts may be partial
+        record = self._load_record(stage.name)
+        present = all(os.path.exists(path) for path in stage.artifacts.values())
+        if record is None:
+            if stage.adopt and present and stage.artifacts:
+                self.log(f'[adopt]  {stage.name}: using existing {", ".join(stage.artifacts.values())}')
+                out_dir = self._out_dir(stage.name, key)
+                os.makedirs(out_dir, exist_ok=True)
+                return self._save_record(stage, key, out_dir, {'adopted': True}, 0)
+            return None
+        if record['key'] != key or not present or not os.path.isdir(record['dir']):
+            return None
+        if all(_stat(path) == record['artifacts'].get(name, [None, None])[1]
+               for name, path in stage.artifacts.items()):
+            return Output(record)
+        if stage.adopt:
+            # Replaced outside the pipeline; take the new files as this stage's output
+            self.log(f'[adopt]  {stage.name}: {", ".join(stage.artifacts.values())} replaced outside the '
+                     f'pipeline, not retrained on its split')
+            return self._save_record(stage, key, record['dir'], dict(record['result'], adopted=True), 0)
+        return None
+
+    def plan(self, targets=None):
+        """[(stage, 'cached' | 'run')] without running anything."""
+        done = {}
+        plan = []
+        for name in self.needed(targets):
+            stage = self.stages[name]
+            output = None
+            if all(dep in done for dep in stage.deps):
+                output = self.cached(stage, self.key(stage, done))
+            if output is not None:
+                done[name] = output
+            plan.append((name, 'cached' if output is not None else 'run'))
+        return plan
+
+    def run(self, targets=None, force=()):
+        """Bring targets (default: every stage) up to date; returns {name: Output}."""
+        pending = self.needed(targets)
+        unknown = set(force) - set(self.stages)
+        if unknown:
+            raise PipelineError(f"Unknown stage(s): {', '.join(sorted(unknown))}")
+        done = {}
+        running = {}
+        started = time.time()
+        context = multiprocessing.get_context('spawn')  # TF sessions must not be forked
+        with ProcessPoolExecutor(max_workers=self.jobs, mp_context=context) as pool:
+            while pending or running:
+                progressed = True
+                while progressed:
+                    progressed = False
+                    for name in list(pending):
+                        stage = self.stages[name]
+                        if not all(dep in done for dep in stage.deps):
+                            continue
+                        pending.remove(name)
+                        progressed = True
+                        key = self.key(stage, done)
+                        output = None if name in force else self.cached(stage, key)
+                        if output is not None:
+                            done[name] = output
+                            self.log(f'[cached] {name}')
+                            continue
+                        out_dir = self._out_dir(name, key)
+                        shutil.rmtree(out_dir, ignore_errors=True)
+                        os.makedirs(out_dir)
+                        for path in stage.artifacts.values():
+                            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                        open(self._running_path(name), 'w').close()
+                        ctx = Context(name, stage.params, {dep: done[dep] for dep in stage.deps}, out_dir,
+                                      stage.artifacts)
+                        running[pool.submit(_execute, stage.func, ctx)] = (stage, key, out_dir)
+                        self.log(f'[run]    {name}')
+                if not running:
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage, key, out_dir = running.pop(future)
+                    try:
+                        result, seconds = future.result()
+                    except Exception as e:
+                        raise PipelineError(f'Stage {stage.name} failed: {e}') from e
+                    done[stage.name] = self._save_record(stage, key, out_dir, result, seconds)
+                    os.remove(self._running_path(stage.name))
+                    self._prune(stage.name, out_dir)
+                    self.log(f'[done]   {stage.name} ({seconds:.1f}s)')
+        self.log(f'Pipeline finished in {time.time() - started:.1f}s')
+        return done
+
+    def _prune(self, name, keep):
+        """Drop the stage's directories from earlier keys."""
+        root = os.path.join(self.cache_dir, name)
+        for entry in os.listdir(root):
+            path = os.path.join(root, entry)
+            if os.path.isdir(path) and os.path.abspath(path) != os.path.abspath(keep):
+                shutil.rmtree(path, ignore_errors=True)
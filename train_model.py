@@ -1,120 +1,375 @@
 """
 Training script for AI Fake Detection Model
 This script retrains the CNN model with updated dataset
+
+Runs are resumable: after every epoch (and every --checkpoint-every
+batches) the run directory receives the full model including optimizer
+state, plus a JSON state file with the epoch, the batch cursor within the
+epoch's shuffled order, the seeds, the learning-rate/early-stopping
+counters and the history so far. `--resume` restores all of it and
+continues with the same batches it would have seen uninterrupted.
+
+    python train_model.py                              # train from scratch into runs/default
+    python train_model.py --run-name cnn512 --dense-units 512 --epochs 60
+    python train_model.py --run-name cnn512 --resume   # continue an interrupted run
+
+The best weights by validation loss are still written to
+model/nasnet_weights.hdf5 (--output), and the per-epoch history to
+<run dir>/history.json.
+
+The functions here (dataset loading, build_model, fit) are shared by the
+cross-validation sweep and the distillation trainer.
 """
+import argparse
+import json
 import os
+import time
+import warnings
+
 import cv2
 import numpy as np
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import accuracy_score
-from keras.utils.np_utils import to_categorical
-from keras.callbacks import ModelCheckpoint
-from keras.models import Sequential
-from keras.layers import Convolution2D, MaxPooling2D, Flatten, Dense
-import warnings
 warnings.filterwarnings("ignore")
 
-print("=" * 60)
-print("AI Fake Detection Model - Retraining Script")
-print("=" * 60)
-
-# Global variable definition for images and label storage
-X = []
-Y = []
-path = "Dataset"
-
-# Function to load real and fake images
-print("\n[1/5] Loading images from dataset...")
-print("This may take a few minutes for large datasets...")
-count = 0
-for root, dirs, directory in os.walk(path):
-    for j in range(len(directory)):
-        if 'Thumbs.db' not in directory[j]:
-            img = cv2.imread(root + "/" + directory[j])
-            if img is not None:
-                img = cv2.resize(img, (32, 32))
-                label = 0  # for fake image label will be 0
-                name = os.path.basename(root)
-                if name == "real":  # for real images label will be 1
-                    label = 1
-                X.append(img)
-                Y.append(label)
-                count += 1
-                if count % 5000 == 0:
-                    print(f"  Loaded {count} images...")
-
-X = np.array(X)
-Y = np.array(Y)
-
-print(f"Fake & Real Images Loading Completed")
-print(f"Total images found in dataset = {X.shape[0]}")
-
-# Count labels
-unique, counts = np.unique(Y, return_counts=True)
-print(f"Fake images (label 0): {counts[0]}")
-print(f"Real images (label 1): {counts[1]}")
-
-# Save processed data
-print("\n[2/5] Saving preprocessed data...")
-np.save('model/X.npy', X)
-np.save('model/Y.npy', Y)
-print("Saved X.npy and Y.npy")
-
-# Dataset processing: shuffling and normalizing
-print("\n[3/5] Preprocessing data...")
-X = X.astype('float32')
-X = X / 255
-indices = np.arange(X.shape[0])
-np.random.shuffle(indices)
-X = X[indices]
-Y = Y[indices]
-Y = to_categorical(Y)
-print("Images Shuffling & Normalization completed")
-
-# Splitting images data into train and test
-X_train, X_test, y_train, y_test = train_test_split(X, Y, test_size=0.2)
-print(f"\nDataset Train & Test Split Details")
-print(f"80% images used to train: {X_train.shape[0]}")
-print(f"20% images used to test: {X_test.shape[0]}")
-
-# Build and train the Sequential CNN model (same as notebook)
-print("\n[4/5] Building and training CNN model...")
-print("This may take 10-30 minutes depending on your hardware...")
-
-# Create Sequential CNN model (matching the notebook architecture)
-model = Sequential()
-model.add(Convolution2D(32, (3, 3), input_shape=(X_train.shape[1], X_train.shape[2], X_train.shape[3]), activation='relu'))
-model.add(MaxPooling2D(pool_size=(2, 2)))
-model.add(Convolution2D(32, (3, 3), activation='relu'))
-model.add(MaxPooling2D(pool_size=(2, 2)))
-model.add(Flatten())
-model.add(Dense(units=256, activation='relu'))
-model.add(Dense(units=y_train.shape[1], activation='softmax'))
-
-# Compile model
-model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
-
-# Train the model
-model_check_point = ModelCheckpoint(filepath='model/nasnet_weights.hdf5', 
-                                     verbose=1, save_best_only=True)
-hist = model.fit(X_train, y_train, 
-                 batch_size=64, 
-                 epochs=40, 
-                 validation_data=(X_test, y_test), 
-                 callbacks=[model_check_point], 
-                 verbose=1)
-
-# Evaluate the model
-print("\n[5/5] Evaluating model performance...")
-predict = model.predict(X_test)
-predict = np.argmax(predict, axis=1)
-y_test1 = np.argmax(y_test, axis=1)
-
-accuracy = accuracy_score(y_test1, predict) * 100
-print(f"\nModel Accuracy: {accuracy:.2f}%")
-
-print("\n" + "=" * 60)
-print("Training Complete!")
-print("The model has been saved to: model/nasnet_weights.hdf5")
-print("Please restart the Django server to use the new model.")
-print("=" * 60)
+DATASET_PATH = "Dataset"
+X_CACHE = 'model/X.npy'
+Y_CACHE = 'model/Y.npy'
+BEST_MODEL_PATH = 'model/nasnet_weights.hdf5'
+RUNS_DIR = 'runs'
+
+DEFAULTS = {
+    'epochs': 40,
+    'batch_size': 64,
+    'learning_rate': 0.001,
+    'dense_units': 256,
+    'test_size': 0.2,
+    'seed': 42,
+    'patience': 8,              # early stopping: epochs without val_loss improvement
+    'min_delta': 1e-4,
+    'lr_patience': 3,           # plateau schedule: epochs before the LR is reduced
+    'lr_factor': 0.5,
+    'min_lr': 1e-5,
+    'checkpoint_every': 0,      # also checkpoint every N batches within an epoch
+}
+
+
+# Dataset ----------------------------------------------------------------
+
+def load_images(path=DATASET_PATH):
+    """Read and resize every image under path; label 1 for a 'real' folder, else 0."""
+    X = []
+    Y = []
+    count = 0
+    for root, dirs, directory in os.walk(path):
+        for j in range(len(directory)):
+            if 'Thumbs.db' not in directory[j]:
+                img = cv2.imread(root + "/" + directory[j])
+                if img is not None:
+                    img = cv2.resize(img, (32, 32))
+                    label = 0  # for fake image label will be 0
+                    name = os.path.basename(root)
+                    if name == "real":  # for real images label will be 1
+                        label = 1
+                    X.append(img)
+                    Y.append(label)
+                    count += 1
+                    if count % 5000 == 0:
+                        print(f"  Loaded {count} images...")
+    return np.array(X), np.array(Y)
+
+
+def load_dataset(path=DATASET_PATH, reload=False, mmap=False):
+    """
+    uint8 images and int labels, from the model/X.npy cache when present
+    (mmap=True maps it read-only instead of loading it), else from `path`
+    with the cache written afterwards.
+    """
+    if not reload and os.path.exists(X_CACHE) and os.path.exists(Y_CACHE):
+        return np.load(X_CACHE, mmap_mode='r' if mmap else None), np.load(Y_CACHE)
+    X, Y = load_images(path)
+    os.makedirs(os.path.dirname(X_CACHE), exist_ok=True)
+    np.save(X_CACHE, X)
+    np.save(Y_CACHE, Y)
+    return X, Y
+
+
+def split_indices(n, test_size, seed):
+    """Deterministic shuffled train/validation index split."""
+    order = np.random.RandomState(seed).permutation(n)
+    cut = int(round(n * (1 - test_size)))
+    return np.sort(order[:cut]), np.sort(order[cut:])
+
+
+def one_hot(labels, classes=2):
+    return np.eye(classes, dtype='float32')[np.asarray(labels, dtype='int64')]
+
+
+def batch_inputs(X, idx):
+    """Normalised float batch gathered from (possibly memory-mapped) uint8 images."""
+    return X[np.sort(idx)].astype('float32') / 255 if len(idx) else np.zeros((0,) + X.shape[1:], 'float32')
+
+
+def limit_threads(threads):
+    """
+    Size this process's TF/BLAS/OpenCV thread pools, so several training
+    processes can share the machine without oversubscribing it. Call before
+    the first model is built.
+    """
+    if not threads:
+        return
+    for name in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+        os.environ[name] = str(threads)
+    cv2.setNumThreads(threads)
+    import tensorflow as tf
+    from keras import backend as K
+    K.set_session(tf.Session(config=tf.ConfigProto(
+        intra_op_parallelism_threads=threads, inter_op_parallelism_threads=1)))
+
+
+# Model ------------------------------------------------------------------
+
+def build_model(input_shape=(32, 32, 3), classes=2, dense_units=256, learning_rate=0.001,
+                conv_filters=(32, 32)):
+    """The served two-conv CNN (Dense width and conv filters configurable)."""
+    from keras.models import Sequential
+    from keras.layers import Convolution2D, MaxPooling2D, Flatten, Dense
+    from keras.optimizers import Adam
+
+    model = Sequential()
+    for i, filters in enumerate(conv_filters):
+        kwargs = {'input_shape': input_shape} if i == 0 else {}
+        model.add(Convolution2D(filters, (3, 3), activation='relu', **kwargs))
+        model.add(MaxPooling2D(pool_size=(2, 2)))
+    model.add(Flatten())
+    model.add(Dense(units=dense_units, activation='relu'))
+    model.add(Dense(units=classes, activation='softmax'))
+    model.compile(optimizer=Adam(lr=learning_rate), loss='categorical_crossentropy', metrics=['accuracy'])
+    return model
+
+
+def evaluate(model, X, targets, idx, batch_size=256):
+    """
+    (cross-entropy, accuracy) over idx in batches, against argmax of the
+    targets. Computed from the predictions, so it does not depend on the
+    loss the model was compiled with.
+    """
+    losses = correct = 0.0
+    for start in range(0, len(idx), batch_size):
+        chunk = np.sort(idx[start:start + batch_size])
+        probs = model.predict_on_batch(batch_inputs(X, chunk))
+        losses -= (targets[chunk] * np.log(np.clip(probs, 1e-7, 1.0))).sum()
+        correct += (np.argmax(probs, axis=1) == np.argmax(targets[chunk], axis=1)).sum()
+    return losses / max(1, len(idx)), correct / max(1, len(idx))
+
+
+# Resumable runner -------------------------------------------------------
+
+def _write_json(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _save_model(model, path):
+    tmp = path + '.tmp'
+    model.save(tmp)
+    os.replace(tmp, path)
+
+
+def fit(run_dir, build, X, targets, train_idx, val_idx, config, resume=False, best_path=None, verbose=True,
+        val_targets=None, custom_objects=None):
+    """
+    Train with per-epoch shuffling, early stopping and LR plateau reduction.
+
+    `build()` returns a compiled model for a fresh run. X holds uint8 images
+    (a memmap is fine) and targets the per-row training targets (one-hot or
+    soft, or whatever a custom compiled loss expects). Validation uses
+    val_targets (default: targets), which must be class probabilities.
+    custom_objects is passed to load_model when resuming. Checkpoints in
+    run_dir make the run resumable. Returns the state dict, whose 'history'
+    lists one entry per epoch.
+    """
+    from keras import backend as K
+    from keras.models import load_model
+
+    os.makedirs(run_dir, exist_ok=True)
+    state_path = os.path.join(run_dir, 'state.json')
+    checkpoint_path = os.path.join(run_dir, 'checkpoint.hdf5')
+    history_path = os.path.join(run_dir, 'history.json')
+
+    if resume and os.path.exists(state_path) and os.path.exists(checkpoint_path):
+        with open(state_path) as f:
+            state = json.load(f)
+        model = load_model(checkpoint_path, custom_objects=custom_objects)  # restores the optimizer state too
+        if verbose:
+            print(f"Resuming at epoch {state['epoch'] + 1}, batch {state['batch']}")
+    else:
+        np.random.seed(config['seed'])
+        try:
+            import tensorflow as tf
+            tf.set_random_seed(config['seed'])
+        except (ImportError, AttributeError):
+            pass
+        model = build()
+        state = {
+            'config': config,
+            'epoch': 0,                 # current epoch (0-based)
+            'batch': 0,                 # next batch within the epoch's order
+            'lr': float(K.get_value(model.optimizer.lr)),
+            'best_val_loss': None,
+            'best_epoch': None,
+            'epochs_without_improvement': 0,
+            'epochs_since_lr_change': 0,
+            'partial': {'loss': 0.0, 'accuracy': 0.0, 'samples': 0, 'seconds': 0.0},
+            'history': [],
+            'stopped_early': False,
+        }
+    K.set_value(model.optimizer.lr, state['lr'])
+
+    batch_size = config['batch_size']
+    batches = int(np.ceil(len(train_idx) / float(batch_size)))
+
+    def checkpoint():
+        _save_model(model, checkpoint_path)
+        _write_json(state_path, state)
+
+    while state['epoch'] < config['epochs'] and not state['stopped_early']:
+        epoch = state['epoch']
+        # The epoch's data order depends only on (seed, epoch), so a resumed
+        # run replays exactly the batches it would have seen
+        order = train_idx[np.random.RandomState(config['seed'] + epoch).permutation(len(train_idx))]
+        partial = state['partial']
+        started = time.time()
+        for batch in range(state['batch'], batches):
+            chunk = order[batch * batch_size:(batch + 1) * batch_size]
+            loss, accuracy = model.train_on_batch(batch_inputs(X, chunk), targets[np.sort(chunk)])
+            partial['loss'] += float(loss) * len(chunk)
+            partial['accuracy'] += float(accuracy) * len(chunk)
+            partial['samples'] += len(chunk)
+            state['batch'] = batch + 1
+            if config['checkpoint_every'] and state['batch'] % config['checkpoint_every'] == 0:
+                partial['seconds'] += time.time() - started
+                started = time.time()
+                checkpoint()
+
+        val_loss, val_accuracy = evaluate(model, X, targets if val_targets is None else val_targets, val_idx)
+        partial['seconds'] += time.time() - started
+        entry = {
+            'epoch': epoch + 1,
+            'loss': partial['loss'] / max(1, partial['samples']),
+            'accuracy': partial['accuracy'] / max(1, partial['samples']),
+            'val_loss': val_loss,
+            'val_accuracy': val_accuracy,
+            'lr': state['lr'],
+            'seconds': round(partial['seconds'], 2),
+        }
+
+        improved = state['best_val_loss'] is None or val_loss < state['best_val_loss'] - config['min_delta']
+        if improved:
+            state['best_val_loss'] = val_loss
+            state['best_epoch'] = epoch + 1
+            state['epochs_without_improvement'] = 0
+            state['epochs_since_lr_change'] = 0
+            if best_path:
+                _save_model(model, best_path)
+        else:
+            state['epochs_without_improvement'] += 1
+            state['epochs_since_lr_change'] += 1
+            if state['epochs_since_lr_change'] >= config['lr_patience'] and state['lr'] > config['min_lr']:
+                state['lr'] = max(config['min_lr'], state['lr'] * config['lr_factor'])
+                state['epochs_since_lr_change'] = 0
+                K.set_value(model.optimizer.lr, state['lr'])
+            if state['epochs_without_improvement'] >= config['patience']:
+                state['stopped_early'] = True
+        entry['improved'] = improved
+        state['history'].append(entry)
+        if verbose:
+            print(f"Epoch {epoch + 1}/{config['epochs']}: loss {entry['loss']:.4f} acc {entry['accuracy']:.4f} "
+                  f"val_loss {val_loss:.4f} val_acc {val_accuracy:.4f} lr {entry['lr']:.2e} "
+                  f"({entry['seconds']:.0f}s){' *' if improved else ''}")
+
+        state['epoch'] = epoch + 1
+        state['batch'] = 0
+        state['partial'] = {'loss': 0.0, 'accuracy': 0.0, 'samples': 0, 'seconds': 0.0}
+        checkpoint()
+        _write_json(history_path, state['history'])
+
+    if verbose and state['stopped_early']:
+        print(f"Early stopping: no val_loss improvement for {config['patience']} epochs "
+              f"(best {state['best_val_loss']:.4f} at epoch {state['best_epoch']})")
+    return state
+
+
+# Command line -----------------------------------------------------------
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Train the AI fake detection CNN')
+    parser.add_argument('--dataset', default=DATASET_PATH)
+    parser.add_argument('--reload', action='store_true', help='Re-read Dataset/ instead of model/X.npy')
+    parser.add_argument('--run-name', default='default', help=f'Run directory under {RUNS_DIR}/')
+    parser.add_argument('--resume', action='store_true', help='Continue the run from its last checkpoint')
+    parser.add_argument('--output', default=BEST_MODEL_PATH, help='Where the best model is saved')
+    parser.add_argument('--epochs', type=int, default=DEFAULTS['epochs'])
+    parser.add_argument('--batch-size', type=int, default=DEFAULTS['batch_size'])
+    parser.add_argument('--learning-rate', type=float, default=DEFAULTS['learning_rate'])
+    parser.add_argument('--dense-units', type=int, default=DEFAULTS['dense_units'])
+    parser.add_argument('--test-size', type=float, default=DEFAULTS['test_size'])
+    parser.add_argument('--seed', type=int, default=DEFAULTS['seed'])
+    parser.add_argument('--patience', type=int, default=DEFAULTS['patience'])
+    parser.add_argument('--lr-patience', type=int, default=DEFAULTS['lr_patience'])
+    parser.add_argument('--lr-factor', type=float, default=DEFAULTS['lr_factor'])
+    parser.add_argument('--min-lr', type=float, default=DEFAULTS['min_lr'])
+    parser.add_argument('--checkpoint-every', type=int, default=DEFAULTS['checkpoint_every'])
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    run_dir = os.path.join(RUNS_DIR, args.run_name)
+    config = dict(DEFAULTS, epochs=args.epochs, batch_size=args.batch_size, learning_rate=args.learning_rate,
+                  dense_units=args.dense_units, test_size=args.test_size, seed=args.seed, patience=args.patience,
+                  lr_patience=args.lr_patience, lr_factor=args.lr_factor, min_lr=args.min_lr,
+                  checkpoint_every=args.checkpoint_every)
+    state_path = os.path.join(run_dir, 'state.json')
+    if args.resume and os.path.exists(state_path):
+        # The split and model must match the interrupted run; only the epoch budget may change
+        with open(state_path) as f:
+            config = dict(json.load(f)['config'], epochs=args.epochs)
+
+    print("=" * 60)
+    print("AI Fake Detection Model - Retraining Script")
+    print("=" * 60)
+
+    print("\n[1/4] Loading images from dataset...")
+    X, Y = load_dataset(args.dataset, reload=args.reload)
+    print(f"Total images found in dataset = {X.shape[0]}")
+    unique, counts = np.unique(Y, return_counts=True)
+    for label, count in zip(unique, counts):
+        print(f"{'Real' if label == 1 else 'Fake'} images (label {label}): {count}")
+
+    print("\n[2/4] Splitting data...")
+    train_idx, val_idx = split_indices(len(X), config['test_size'], config['seed'])
+    targets = one_hot(Y)
+    print(f"{len(train_idx)} images used to train, {len(val_idx)} to validate")
+
+    print(f"\n[3/4] Training CNN model (run directory {run_dir})...")
+    state = fit(run_dir, lambda: build_model(X.shape[1:], targets.shape[1], config['dense_units'],
+                                             config['learning_rate']),
+                X, targets, train_idx, val_idx, config, resume=args.resume, best_path=args.output)
+
+    print("\n[4/4] Evaluating model performance...")
+    from keras.models import load_model
+    best = load_model(args.output)
+    _, accuracy = evaluate(best, X, targets, val_idx)
+    print(f"\nModel Accuracy: {accuracy * 100:.2f}% (best epoch {state['best_epoch']})")
+
+    print("\n" + "=" * 60)
+    print("Training Complete!")
+    print(f"The model has been saved to: {args.output}")
+    print(f"Per-epoch history: {os.path.join(run_dir, 'history.json')}")
+    print("Please restart the Django server to use the new model.")
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    main()